@@ -1,14 +1,17 @@
 import asyncio
+import contextvars
 import os
 import queue
 import re
 import sqlite3
 import threading
+import time
 from datetime import datetime
 from typing import Annotated, Any, Dict, List, Sequence, TypedDict
+from uuid import uuid4
 
 from dotenv import load_dotenv
-from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.memory import MemorySaver
@@ -18,12 +21,18 @@ from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
 
 from src.chatbot.openrouter.chat_openrouter import ChatOpenRouter
+from src.chatbot.llama.utterance import END_OF_UTTERANCE, Utterance
 
 from src.tts.tts_player import TTSPlayer
 from src.tts.tts_config import TTSConfig
 
 from src.memory.long_term.elastic_search import LongTermMemoryES
+from src.memory.long_term.fast_search.bm25_search import BM25Memory
 from src.memory.long_term.fast_search.fast_search import FastLongTermMemory
+from src.memory.long_term.hybrid_search.hybrid_search import HybridRetriever
+from src.memory.long_term.memory_documents import docs, docs_en
+from src.memory.long_term.retrieval_cache import CachedRetriever
+from src.memory.long_term.vector_search.vector_search import LocalVectorMemory
 from src.memory.long_term.base import MemoryRetriever
 
 from src.prompt.templates.general import general_settings_prompt_english
@@ -44,6 +53,15 @@ MODEL_NAME = os.getenv("MODEL_NAME", "google/gemma-3-27b-it:free")
 
 LTM_SCORE_THRESHOLD = float(os.getenv("LTM_SCORE_THRESHOLD", 0.65))
 LTM_MAX_HITS = int(os.getenv("LTM_MAX_HITS", 3))
+# 长期记忆后端："es"（Elasticsearch）、"local"（进程内的向量检索 / BM25，不需要 ES）
+# 或 "hybrid"（进程内 BM25 + 向量，RRF 融合）
+LTM_BACKEND = os.getenv("LTM_BACKEND", "es").lower()
+# hybrid 下 BM25 第一名的查询覆盖率（0~1）达到这个值（且明显领先第二名）时跳过向量检索
+LTM_LEXICAL_CONFIDENCE = float(os.getenv("LTM_LEXICAL_CONFIDENCE", 0.6))
+# BM25 结果的查询覆盖率下限，相当于词法一路的 LTM_SCORE_THRESHOLD
+LTM_LEXICAL_MIN_COVERAGE = float(os.getenv("LTM_LEXICAL_MIN_COVERAGE", 0.3))
+# 长期记忆检索结果缓存的有效期（秒），0 表示不缓存
+LTM_CACHE_TTL = float(os.getenv("LTM_CACHE_TTL", 600))
 
 # ───────────────────── Prompt / Regex ─────────────────────
 _LONG_PREFIX_HEADER = "（I seem to have heard these things somewhere, maybe they can be useful...）\n"
@@ -58,6 +76,11 @@ _BOUNDARY_RE = re.compile(
 
 _ABBR = {"Mr", "Mrs", "Ms", "Dr", "Prof", "Sr", "Jr", "St"}
 
+# 当前协程正在生成的回复所对应的 Utterance（LangGraph 节点会继承调用方的 context）
+_CURRENT_UTTERANCE: contextvars.ContextVar["Utterance | None"] = contextvars.ContextVar(
+    "current_utterance", default=None
+)
+
 
 class ChatMemory(TypedDict):
     conversation_history: List[BaseMessage]
@@ -74,6 +97,9 @@ class ChatState(TypedDict, total=False):
     memory: Dict[str, ChatMemory]
     # Optional per-request system prompt override
     system_prompt: str | None
+    # Optional per-request generation limits (e.g. from ResponseLengthController)
+    max_tokens: int | None
+    prompt_additions: List[str] | None
 
 
 class ChatEngine:
@@ -103,7 +129,13 @@ class ChatEngine:
 
         # TTS player & 队列
         self._tts_player = TTSPlayer(TTSConfig(connect_to_unity=connect_to_unity))
-        self._speak_q: "queue.Queue[str]" = __import__("queue").Queue()
+        self._speak_q: "queue.Queue[tuple[Utterance, Any]]" = __import__("queue").Queue()
+        # 已开始但还没播完的回复 → (所属事件循环, graph config)；正在生成的回复 → 生成协程所在 task
+        self._live_utterances: Dict[Utterance, tuple[asyncio.AbstractEventLoop, dict]] = {}
+        self._generating: Dict[Utterance, asyncio.Task] = {}
+        self._live_lock = threading.Lock()
+        self._spoken_seconds = 0.0  # 累计实际播放时长，供编排层统计每轮说话时间
+        self._speech_started_at = 0.0  # 最近一次从静默开始说话的时间（monotonic）
         self._start_tts_thread()
 
         # Prompt Builder
@@ -114,8 +146,10 @@ class ChatEngine:
 
         self._llm = self._init_llm()
 
-        # LTM
+        # LTM：同样的问题（归一化后）在 TTL 内直接用缓存结果，检索器自己的语料变了自动失效
         self._ltm = self._get_ltm_model()
+        if LTM_CACHE_TTL > 0:
+            self._ltm = CachedRetriever(self._ltm, ttl=LTM_CACHE_TTL)
 
         # Sync checkpointer
         self._sync_db_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
@@ -142,41 +176,96 @@ class ChatEngine:
             language: str = "English",
             *,
             system_prompt: str | None = None,
+            max_tokens: int | None = None,
+            prompt_additions: List[str] | None = None,
+            utterance: Utterance | None = None,
     ) -> str:
-        graph, _, _ = await self._graph_for_loop()  # We only need the graph here
-        cfg = {"configurable": {"thread_id": f"persistent_{user_id}"}}
-        state = {
-            "messages": [HumanMessage(content=msg)],
-            "user_id": user_id,
-            "language": language,
-            "memory": self._memory,
-        }
-
-        # Attach system_prompt only if caller supplied one
-        if system_prompt is not None:
-            state["system_prompt"] = system_prompt
-
-        result = await graph.ainvoke(state, cfg)
+        """
+        生成回复并把句子流式送进 TTS，返回完整回复文本（此时语音可能还在播放）。
+        需要知道何时播完时，自己 new_utterance() 传进来，然后 await utterance.played()。
+        传入 hold=True 的 utterance 时，句子会先缓存，直到调用方 release()。
+        生成被取消（不是 barge-in，比如丢弃的预生成）时，这一轮已经写进 checkpoint 的输入会被撤回，
+        调用方可以把同样的消息重新送进来，历史里不会多出重复或没有回复的 HumanMessage。
+        """
+        utt = utterance or self.new_utterance()
+        try:
+            graph, _, _ = await self._graph_for_loop()  # We only need the graph here
+            cfg = {"configurable": {"thread_id": f"persistent_{user_id}"}}
+            human = HumanMessage(content=msg, id=str(uuid4()))
+            state = {
+                "messages": [human],
+                "user_id": user_id,
+                "language": language,
+                "memory": self._memory,
+                # 这几项是单次请求的参数，但也会进 checkpoint：每次都显式写入（没传就清空），
+                # 否则上一轮的值会沿用到下一轮
+                "system_prompt": system_prompt,
+                "max_tokens": max_tokens,
+                "prompt_additions": prompt_additions or [],
+            }
+
+            with self._live_lock:
+                self._live_utterances[utt] = (asyncio.get_running_loop(), cfg)
+
+            token = _CURRENT_UTTERANCE.set(utt)
+            try:
+                result = await graph.ainvoke(state, cfg)
+            except asyncio.CancelledError:
+                if not utt.interrupted:
+                    await self._rollback_input(graph, cfg, human.id)
+                raise
+            finally:
+                _CURRENT_UTTERANCE.reset(token)
+        finally:
+            # 无论成功与否都要放结束标记，否则等待 played() 的调用方会一直挂着
+            utt.finish()
+            if utt.cancelled:
+                self._forget_utterance(utt)
         return result["messages"][-1].content
 
+    def new_utterance(self, hold: bool = False) -> Utterance:
+        return Utterance(self._speak_q, hold=hold)
+
     # TTS 队列线程
     def _start_tts_thread(self):
         if hasattr(self, "_tts_thread") and self._tts_thread.is_alive():
             return
 
         def _worker():
+            idle = True
             while True:
-                part = self._speak_q.get()
-                if part is None:
+                item = self._speak_q.get()
+                if item is None:
+                    self._speak_q.task_done()
                     break
                 try:
-                    self._tts_player.stream(part)
-                except Exception as exc:  # pragma: no cover
-                    print(f"\n[TTS error] {exc}\n")
+                    idle = self._speak_one(*item, idle=idle)
+                finally:
+                    self._speak_q.task_done()
 
         self._tts_thread = threading.Thread(target=_worker, daemon=True)
         self._tts_thread.start()
 
+    def _speak_one(self, utt: Utterance, part: Any, idle: bool) -> bool:
+        """TTS 线程里播放一个队列项，返回播完后扬声器是否空闲"""
+        if part is END_OF_UTTERANCE:
+            self._forget_utterance(utt)
+            utt.mark_played()
+            return self._speak_q.qsize() == 0
+        if utt.cancelled:
+            return idle
+        if idle:
+            self._speech_started_at = time.monotonic()
+        utt.mark_started(part)
+        t0 = time.perf_counter()
+        try:
+            self._tts_player.stream(part, should_stop=lambda: utt.cancelled)
+        except Exception as exc:  # pragma: no cover
+            print(f"\n[TTS error] {exc}\n")
+        finally:
+            self._spoken_seconds += time.perf_counter() - t0
+        return self._speak_q.qsize() == 0
+
     def _init_llm(self):
         if self.dialogue_actor == DialogueActor.AUDIENCE:
             # when talking to audience, use local llama cpp
@@ -213,6 +302,7 @@ class ChatEngine:
     async def _gen_response(self, state: ChatState) -> ChatState:  # noqa: C901
         uid = state["user_id"]
         mem = state["memory"][uid]
+        utt = _CURRENT_UTTERANCE.get() or self.new_utterance()
 
         # ---------- LTM ----------
         prefix = ""
@@ -226,11 +316,16 @@ class ChatEngine:
         # ---------------- System Prompt ----------------
         # 1) Use override provided by caller if any.
         # 2) Otherwise, build fresh prompt via PromptBuilder so that changes take effect per request.
+        additions = state.get("prompt_additions") or None
         if state.get("system_prompt") is not None:
             base_system_prompt: str = state["system_prompt"]  # type: ignore[assignment]
+            if additions:
+                base_system_prompt = "\n\n".join([base_system_prompt, *additions])
         else:
             # Build prompt dynamically for every request to capture latest builder settings.
-            base_system_prompt = self.prompt_builder.create_system_message(self.context).content
+            base_system_prompt = self.prompt_builder.create_system_message(
+                self.context, custom_additions=additions
+            ).content
 
         prompt_obj = ChatPromptTemplate.from_messages(
             [
@@ -242,12 +337,20 @@ class ChatEngine:
             {"history": mem["conversation_history"], "messages": state["messages"]}
         )
 
+        llm = self._llm
+        if state.get("max_tokens"):
+            llm = llm.bind(max_tokens=state["max_tokens"])
+
         buf = ""
         out_tokens: List[str] = []
         final_content = ""  # Initialize final_content
 
+        with self._live_lock:
+            self._generating[utt] = asyncio.current_task()
         try:
-            async for chunk in self._llm.astream(prompt_obj):
+            if utt.cancelled:
+                raise asyncio.CancelledError()
+            async for chunk in llm.astream(prompt_obj):
                 tok = chunk.content if isinstance(chunk, AIMessage) else chunk.get("content", "")
                 print(tok, end="", flush=True)
                 buf += tok
@@ -260,11 +363,11 @@ class ChatEngine:
                     cut = m.end()
                     sent = buf[:cut].strip()
                     if sent:
-                        self._speak_q.put(sent)
+                        utt.put(sent)
                     buf = buf[cut:]
 
             if buf.strip():
-                self._speak_q.put(buf.strip())
+                utt.put(buf.strip())
 
             final_content = "".join(out_tokens)
 
@@ -272,16 +375,31 @@ class ChatEngine:
             if not final_content.strip():
                 print("\n[ChatEngine] LLM stream completed but resulted in empty/whitespace content. Using fallback.")
                 final_content = "I'm sorry, I didn't quite understand. Could you say that again?"
-                self._speak_q.put(final_content)  # Send fallback to TTS
+                utt.put(final_content)  # Send fallback to TTS
 
         except Exception as e:
             # Catch any exception during the streaming process
             print(f"\n[ChatEngine _gen_response] Error during LLM stream: {type(e).__name__}: {e}")
             final_content = "I encountered an issue while processing your request. Please try again."
-            self._speak_q.put(final_content)  # Send fallback to TTS
+            utt.put(final_content)  # Send fallback to TTS
             # The exception 'e' is not re-raised, allowing graph execution to continue with fallback content.
 
-        ai_msg = AIMessage(content=final_content)
+        except asyncio.CancelledError:
+            # Barge-in: keep only what was actually said. Other cancellations (e.g. dropped speculation) propagate.
+            if not utt.interrupted:
+                raise
+            asyncio.current_task().uncancel()
+            print("\n[ChatEngine] Generation interrupted by barge-in.")
+
+        finally:
+            with self._live_lock:
+                self._generating.pop(utt, None)
+
+        if utt.interrupted:
+            final_content = self._interrupted_content(utt)
+
+        ai_msg = AIMessage(content=final_content, id=str(uuid4()))
+        utt.reply = ai_msg
         mem["conversation_history"].extend(state["messages"])
         mem["conversation_history"].append(ai_msg)
         return {"messages": [ai_msg]}
@@ -328,6 +446,89 @@ class ChatEngine:
     def _is_ellipsis(txt: str, idx: int) -> bool:
         return txt[idx] == "." and idx >= 2 and txt[idx - 2: idx + 1] == "..."
 
+    @staticmethod
+    def _interrupted_content(utt: Utterance) -> str:
+        spoken = utt.spoken_text()
+        return f"{spoken} (interrupted)" if spoken else "(interrupted before saying anything)"
+
+    def _forget_utterance(self, utt: Utterance) -> None:
+        with self._live_lock:
+            self._live_utterances.pop(utt, None)
+
+    def _drain_speak_queue(self) -> None:
+        while True:
+            try:
+                item = self._speak_q.get_nowait()
+            except queue.Empty:
+                return
+            self._speak_q.task_done()
+            if item is None:  # keep the shutdown sentinel
+                self._speak_q.put(None)
+                return
+
+    def interrupt(self) -> bool:
+        """
+        Barge-in：取消正在进行的生成、清空待播句子并立刻停止播放（可从任意线程调用）。
+        对话历史中只保留已经说出口的部分。返回是否真的打断了什么。
+        """
+        with self._live_lock:
+            live = list(self._live_utterances.items())
+            self._live_utterances.clear()
+
+        if not live and not self._tts_player.is_busy():
+            return False
+
+        for utt, (loop, cfg) in live:
+            utt.interrupt()
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._settle_interrupted, utt, cfg)
+
+        self._drain_speak_queue()
+        self._tts_player.stop()
+        return True
+
+    def _settle_interrupted(self, utt: Utterance, cfg: dict) -> None:
+        """在生成所在的事件循环里执行：还在生成就取消，已生成完就截断历史里的回复。"""
+        with self._live_lock:
+            task = self._generating.get(utt)
+        if task is not None:
+            task.cancel()  # _gen_response 捕获取消并写入截断后的回复
+        elif utt.reply is not None:
+            self._truncate_reply(utt, cfg)
+
+    @staticmethod
+    async def _rollback_input(graph, cfg: dict, message_id: str) -> None:
+        """生成被取消：从 checkpoint 里删掉这一轮的输入（还没写进去就什么都不做）"""
+        try:
+            snapshot = await graph.aget_state(cfg)
+            if any(m.id == message_id for m in snapshot.values.get("messages", [])):
+                await graph.aupdate_state(
+                    cfg, {"messages": [RemoveMessage(id=message_id)]}, as_node="generate_response"
+                )
+        except Exception as e:
+            print(f"[ChatEngine] Failed to roll back cancelled turn: {e}")
+
+    def _truncate_reply(self, utt: Utterance, cfg: dict) -> None:
+        """回复已生成完但没播完：把历史里的 AIMessage 改成实际说出的内容。"""
+        content = self._interrupted_content(utt)
+        if utt.reply.content == content:
+            return
+        utt.reply.content = content  # 同一对象也在 conversation_history 里
+
+        loop = asyncio.get_running_loop()
+        with self._loop_graphs_lock:
+            components = self._loop_graph_components.get(id(loop))
+        if components is None:
+            return
+        graph = components[0]
+        loop.create_task(
+            graph.aupdate_state(
+                cfg,
+                {"messages": [AIMessage(content=content, id=utt.reply.id)]},
+                as_node="generate_response",
+            )
+        )
+
     async def close(self):  # Make close async
         self._speak_q.put(None)
         if hasattr(self, "_tts_thread"):
@@ -356,15 +557,49 @@ class ChatEngine:
     def speech_queue_empty(self) -> bool:
         return self._speak_q.empty()
 
+    def spoken_seconds(self) -> float:
+        """TTS 累计播放秒数（单调递增），两次读数之差即为期间的说话时长。"""
+        return self._spoken_seconds
+
+    def last_speech_started_at(self) -> float:
+        """最近一次从静默转为播放的 time.monotonic() 时间戳，用于统计轮次间的冷场。"""
+        return self._speech_started_at
+
     def is_speaking(self) -> bool:
-        """检查 TTS 是否正在说话或队列中是否有待处理的语音。"""
-        return not self._speak_q.empty() or self._tts_player.is_busy()
+        """检查 TTS 是否正在说话或队列中是否有待处理的语音。
+
+        用 unfinished_tasks 而不是 empty()+busy：队列项直到播完才 task_done，
+        不存在「已出队、还没开始播」的空窗。
+        """
+        return self._speak_q.unfinished_tasks > 0 or self._tts_player.is_busy()
 
     def _get_ltm_model(self) -> MemoryRetriever:
+        if LTM_BACKEND == "hybrid":
+            # 和原来一样：观众用中文文档，其他对象用英文文档
+            if self.dialogue_actor == DialogueActor.AUDIENCE:
+                corpus, name = docs, "ltm_docs"
+            else:
+                corpus, name = docs_en, "chat_memory"
+            print(f"[LTM] Using HybridRetriever ({name})")
+            return HybridRetriever(
+                BM25Memory(documents=corpus, index_name=name, min_coverage=LTM_LEXICAL_MIN_COVERAGE),
+                LocalVectorMemory(
+                    threshold=LTM_SCORE_THRESHOLD,
+                    documents=corpus,
+                    index_dir=BASE_DIR / "src" / "runtime" / "storage" / f"vector_{name}",
+                ),
+                short_circuit_score=LTM_LEXICAL_CONFIDENCE,
+            )
         if self.dialogue_actor == DialogueActor.AUDIENCE:
+            if LTM_BACKEND == "local":
+                print("[LTM] Using LocalVectorMemory")
+                return LocalVectorMemory(threshold=LTM_SCORE_THRESHOLD)
             print("[LTM] Using LongTermMemoryES")
             return LongTermMemoryES(persist=True, threshold=LTM_SCORE_THRESHOLD)
         else:
+            if LTM_BACKEND == "local":
+                print("[LTM] Using BM25Memory")
+                return BM25Memory(index_name="chat_memory", min_coverage=LTM_LEXICAL_MIN_COVERAGE)
             print("[LTM] Using FastLongTermMemory")
             return FastLongTermMemory(index_name="chat_memory")
 
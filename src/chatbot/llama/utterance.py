@@ -0,0 +1,108 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, List, Optional, Tuple
+
+# 放在 TTS 队列里标记「这一轮的句子到此为止」
+END_OF_UTTERANCE = object()
+
+
+class Utterance:
+    """
+    一次回复对应的语音单元。
+    生成出来的句子经由 put() 以 (utterance, sentence) 的形式送进 TTS 队列；
+    hold=True 时先缓存在本地，直到 release() 才按顺序交给扬声器，
+    用于在上一句还在播放时提前生成下一条回复。
+    TTS 线程通过 mark_started() 记录真正开口说过的句子，被打断时据此修正对话历史。
+    整轮播完（或被取消/打断）时 done 被置位，调用方可以 await played() / wait_played() 而不必轮询。
+    """
+
+    def __init__(self, speak_q: "queue.Queue[Tuple[Utterance, Any]]", hold: bool = False):
+        self._speak_q = speak_q
+        self._lock = threading.Lock()
+        self._held = hold
+        self._buffer: List[Any] = []
+        self.cancelled = False
+        self.interrupted = False
+        self.finished = False
+        self.started: List[str] = []
+        # 生成完成后写入对话历史的 AIMessage，打断时原地截断
+        self.reply: Optional[Any] = None
+        self.done: "Future[None]" = Future()
+
+    @property
+    def held(self) -> bool:
+        return self._held
+
+    def put(self, sentence: str) -> None:
+        self._enqueue(sentence)
+
+    def finish(self) -> None:
+        """生成结束：在队列里放一个结束标记，TTS 线程播到这里即整轮播完。"""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        self._enqueue(END_OF_UTTERANCE)
+
+    def release(self) -> int:
+        """把缓存的句子交给 TTS，之后的句子直接入队。返回放出的句子数。"""
+        with self._lock:
+            if self.cancelled or not self._held:
+                return 0
+            self._held = False
+            released = sum(1 for item in self._buffer if item is not END_OF_UTTERANCE)
+            for item in self._buffer:
+                self._speak_q.put((self, item))
+            self._buffer.clear()
+            return released
+
+    def cancel(self) -> None:
+        """丢弃尚未播放的缓存，之后 put() 的句子也不再播放。"""
+        with self._lock:
+            self.cancelled = True
+            self._buffer.clear()
+        self.mark_played()
+
+    def interrupt(self) -> None:
+        """被用户打断：与 cancel 相同，但保留已说出的部分用于记录历史。"""
+        with self._lock:
+            self.interrupted = True
+        self.cancel()
+
+    def mark_started(self, sentence: str) -> None:
+        with self._lock:
+            self.started.append(sentence)
+
+    def mark_played(self) -> None:
+        """TTS 线程播到结束标记时调用；取消/打断时也会调用，因为之后不会再有声音。"""
+        try:
+            self.done.set_result(None)
+        except InvalidStateError:
+            pass
+
+    def wait_played(self, timeout: Optional[float] = None) -> bool:
+        """阻塞到整轮播完，返回是否在 timeout 内完成。"""
+        try:
+            self.done.result(timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    async def played(self) -> None:
+        # shield: 调用方被取消时不能连带取消 done
+        await asyncio.shield(asyncio.wrap_future(self.done))
+
+    def spoken_text(self) -> str:
+        with self._lock:
+            return " ".join(self.started)
+
+    def _enqueue(self, item: Any) -> None:
+        with self._lock:
+            if self.cancelled:
+                return
+            if self._held:
+                self._buffer.append(item)
+            else:
+                self._speak_q.put((self, item))
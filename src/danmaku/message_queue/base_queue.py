@@ -1,6 +1,6 @@
 import asyncio
 from collections import deque
-from typing import Deque, Optional
+from typing import Callable, Deque, List, Optional
 from src.danmaku.models import Message
 
 
@@ -18,6 +18,14 @@ class BaseQueue:
                 self._dq.popleft()  # drop oldest
             self._dq.append(msg)
 
+    async def put_front(self, msgs: List[Message]) -> None:
+        """Push *msgs* back to the head in their original order."""
+        async with self._lock:
+            for msg in reversed(msgs):
+                self._dq.appendleft(msg)
+            while len(self._dq) > self._max_size:
+                self._dq.pop()  # the newest message makes room for the requeued ones
+
     async def get(self) -> Optional[Message]:
         async with self._lock:
             if self._dq:
@@ -30,4 +38,22 @@ class BaseQueue:
 
     async def empty(self) -> bool:
         async with self._lock:
-            return not self._dq
\ No newline at end of file
+            return not self._dq
+
+    async def size(self) -> int:
+        async with self._lock:
+            return len(self._dq)
+
+    async def get_batch(
+            self,
+            max_count: int,
+            predicate: Optional[Callable[[Message], bool]] = None,
+    ) -> List[Message]:
+        """Pop up to *max_count* consecutive head messages accepted by *predicate*."""
+        out: List[Message] = []
+        async with self._lock:
+            while self._dq and len(out) < max_count:
+                if predicate and not predicate(self._dq[0]):
+                    break  # keep FIFO order: stop at the first incompatible message
+                out.append(self._dq.popleft())
+        return out
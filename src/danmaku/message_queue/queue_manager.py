@@ -1,5 +1,5 @@
-import queue
-from typing import Optional
+import inspect
+from typing import Any, Callable, Iterable, List, Optional
 
 from src.danmaku.message_queue.queue_types.danmu_queue import DanmuMessageQueue
 from src.danmaku.message_queue.queue_types.follow_queue import FollowMessageQueue
@@ -7,6 +7,13 @@ from src.danmaku.message_queue.queue_types.gift_queue import GiftMessageQueue
 from src.danmaku.models import Message, MessageType, User
 
 
+async def _resolve(value: Any) -> Any:
+    """danmu 队列是异步接口，gift/follow 队列是同步接口，这里统一一下。"""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
 class TotalMessageQueue:
     """Holds three priority sub-queues and picks the highest-priority message."""
 
@@ -23,23 +30,24 @@ class TotalMessageQueue:
         await self.danmu_queue.put_superchat(user, content, price)
 
     async def put_follow(self, user: User, content: str) -> None:
-        await self.follow_queue.put_message(user, content)
+        self.follow_queue.put_message(user, content)
 
     async def put_gift(self, gift_name: str, gift_count: int, user: User) -> None:
-        await self.gift_queue.put_message(gift_name, gift_count, user)
+        self.gift_queue.put_message(gift_name, gift_count, user)
 
     # ───────── Sync version (unused in bridge, kept for legacy) ─────────
     def get_next_message(self) -> Optional[Message]:
-        temp_pq: queue.PriorityQueue[Message] = queue.PriorityQueue()
+        candidates = []
         for q in (self.danmu_queue, self.gift_queue, self.follow_queue):
             msg = q.peek()  # sync peek
             if msg:
-                temp_pq.put(msg)
+                candidates.append(msg)
 
-        if temp_pq.empty():
+        # 只按 priority 比较，同优先级时取先出现的队列；Message 的其他字段不可排序
+        top_msg = min(candidates, key=lambda m: m.priority, default=None)
+        if top_msg is None:
             return None
 
-        top_msg: Message = temp_pq.get()
         if top_msg.type is MessageType.DANMU:
             return self.danmu_queue.get()
         if top_msg.type is MessageType.GIFT:
@@ -50,28 +58,61 @@ class TotalMessageQueue:
 
     # ───────── Async version used by bridge ─────────
     async def get_next_message_async(self) -> Optional[Message]:
-        temp_pq: queue.PriorityQueue[Message] = queue.PriorityQueue()
+        candidates = []
         for q in (self.danmu_queue, self.gift_queue, self.follow_queue):
             try:
-                msg = await q.peek()  # async peek
+                msg = await _resolve(q.peek())
                 if msg:
-                    temp_pq.put(msg)
+                    candidates.append(msg)
             except Exception:
                 # 静默处理，队列为空是正常情况
                 continue
 
-        if temp_pq.empty():
+        top_msg = min(candidates, key=lambda m: m.priority, default=None)
+        if top_msg is None:
             return None
 
-        top_msg: Message = temp_pq.get()
         try:
             if top_msg.type is MessageType.DANMU:
                 return await self.danmu_queue.get()
             if top_msg.type is MessageType.GIFT:
-                return await self.gift_queue.get()
+                return self.gift_queue.get()
             if top_msg.type is MessageType.FOLLOW:
-                return await self.follow_queue.get()
+                return self.follow_queue.get()
         except Exception as e:
             print(f"[TotalMessageQueue] Error getting message: {e}")
             
         return None
+
+    async def get_danmu_batch_async(
+            self,
+            max_count: int,
+            predicate: Optional[Callable[[Message], bool]] = None,
+    ) -> List[Message]:
+        """Pop up to *max_count* pending danmaku from the head of the danmu queue."""
+        if max_count <= 0:
+            return []
+        return await self.danmu_queue.get_batch(max_count, predicate)
+
+    async def danmu_backlog(self) -> int:
+        return await self.danmu_queue.size()
+
+    async def peek_next_message_async(self) -> Optional[Message]:
+        """不出队地查看当前优先级最高的消息"""
+        candidates = []
+        for q in (self.danmu_queue, self.gift_queue, self.follow_queue):
+            msg = await _resolve(q.peek())
+            if msg:
+                candidates.append(msg)
+        return min(candidates, key=lambda m: m.priority, default=None)
+
+    async def requeue_async(self, messages: Iterable[Message]) -> None:
+        """把取出但没回复的消息放回各自队列的队首（用于被抢占的预生成）"""
+        messages = list(messages)
+        danmu = [m for m in messages if m.type is MessageType.DANMU]
+        await self.danmu_queue.put_front(danmu)
+        for msg in messages:
+            if msg.type is MessageType.GIFT:
+                self.gift_queue.requeue(msg)
+            elif msg.type is MessageType.FOLLOW:
+                self.follow_queue.requeue(msg)
@@ -1,10 +1,13 @@
 from src.danmaku.message_queue.base_queue import BaseQueue
 from src.danmaku.models import Message, MessageType, User
 
+# 普通弹幕的优先级；SuperChat 用 -price，总是更高
+DANMU_PRIORITY = -3
+
 
 class DanmuMessageQueue(BaseQueue):
     async def put_danmu(self, user: User, content: str) -> None:
-        await self.put(Message(priority=-3, user=user, content=content, type=MessageType.DANMU))
+        await self.put(Message(priority=DANMU_PRIORITY, user=user, content=content, type=MessageType.DANMU))
 
     async def put_superchat(self, user: User, content: str, price: int) -> None:
         # SuperChat is treated as boosted Danmu – we still label it DANMU.
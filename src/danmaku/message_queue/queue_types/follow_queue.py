@@ -13,6 +13,9 @@ class FollowMessageQueue:
         msg = Message(priority=-4, user=user, content=content, type=MessageType.FOLLOW)
         self._queue.append(msg)
 
+    def requeue(self, msg: Message):
+        self._queue.appendleft(msg)
+
     def get(self) -> Message:
         return self._queue.popleft()
 
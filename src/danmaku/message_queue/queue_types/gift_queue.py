@@ -1,3 +1,4 @@
+import itertools
 import queue
 from src.danmaku.models import Message, MessageType, User
 
@@ -7,13 +8,17 @@ from src.danmaku.const.gift_mapping import gift_mapping
 class GiftMessageQueue:
     def __init__(self):
         # 只有礼物queue用的是priority queue
-        self._queue = queue.PriorityQueue()
+        # 元素是 (priority, seq, msg)：同档礼物按 seq 先进先出，不会去比较 Message 的其他字段
+        self._queue: queue.PriorityQueue[tuple[int, int, Message]] = queue.PriorityQueue()
+        self._seq = itertools.count()
+        # 放回的消息用递减的负数 seq，排在同档消息的最前面
+        self._requeue_seq = itertools.count(-1, -1)
 
     def put_message(self, gift_name: str, gift_count: int, user: User):
         priority = -5
         if gift_name not in gift_mapping:
             priority = -10
-        value = gift_mapping[gift_name] * gift_count
+        value = int(gift_mapping.get(gift_name, 0)) * gift_count
         if value < 10:
             priority = -5
         elif 10 <= value < 100:
@@ -24,8 +29,9 @@ class GiftMessageQueue:
             priority = -30
         elif 10000 < value:
             priority = -40
-        msg = Message(priority=priority, user=user, content=gift_name, type=MessageType.GIFT)
-        self._queue.put(msg)
+        msg = Message(priority=priority, user=user, content=gift_name, type=MessageType.GIFT,
+                      extra={"gift_name": gift_name, "gift_count": gift_count})
+        self._queue.put((msg.priority, next(self._seq), msg))
 
     def put_guard_message(self, gift_name: str, user: User):
         priority = -50
@@ -35,11 +41,15 @@ class GiftMessageQueue:
             priority = -1000
         elif gift_name == "总督":
             priority = -10000
-        msg = Message(priority=priority, user=user, content=gift_name, type=MessageType.GIFT)
-        self._queue.put(msg)
+        msg = Message(priority=priority, user=user, content=gift_name, type=MessageType.GIFT,
+                      extra={"gift_name": gift_name, "gift_count": 1})
+        self._queue.put((msg.priority, next(self._seq), msg))
 
-    def get(self):
-        return self._queue.get()
+    def requeue(self, msg: Message):
+        self._queue.put((msg.priority, next(self._requeue_seq), msg))
+
+    def get(self) -> Message:
+        return self._queue.get()[2]
 
     def empty(self):
         return self._queue.empty()
@@ -48,4 +58,4 @@ class GiftMessageQueue:
         if self.empty():
             return None
         # PriorityQueue 不支持下标访问，需要从内部 queue 列表取出
-        return self._queue.queue[0]
+        return self._queue.queue[0][2]
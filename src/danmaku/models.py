@@ -53,7 +53,7 @@ class Message:
         if self.type == MessageType.GIFT:
             gift_name = self.extra["gift_name"]
             gift_count = self.extra["gift_count"]
-            value = gift_mapping[gift_name] * gift_count
+            value = int(gift_mapping.get(gift_name, 0)) * gift_count
 
             if value < 20:
                 return f"""
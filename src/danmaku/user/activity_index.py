@@ -0,0 +1,82 @@
+import heapq
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+
+class ActivityIndex:
+    """
+    按 last_active 排序的活跃用户索引。
+    用两个懒删除的堆：_recent 是最大堆（存负时间戳）用来取最近活跃的前 N 个，
+    _oldest 是最小堆用来找超时的用户。_latest 记录每个用户当前的时间戳，
+    堆里和它对不上的条目是旧记录，弹出时直接丢弃；旧记录太多时整体重建。
+    """
+
+    def __init__(self):
+        self._latest: Dict[str, float] = {}
+        self._recent: List[Tuple[float, str]] = []
+        self._oldest: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._latest
+
+    def load(self, entries: Iterable[Tuple[str, float]]) -> None:
+        """批量载入 (user_id, last_active 时间戳)"""
+        with self._lock:
+            for user_id, ts in entries:
+                if ts > self._latest.get(user_id, float("-inf")):
+                    self._latest[user_id] = ts
+            self._rebuild()
+
+    def touch(self, user_id: str, ts: float) -> None:
+        with self._lock:
+            if self._latest.get(user_id) == ts:
+                return
+            self._latest[user_id] = ts
+            heapq.heappush(self._recent, (-ts, user_id))
+            heapq.heappush(self._oldest, (ts, user_id))
+            self._maybe_compact()
+
+    def remove(self, user_id: str) -> None:
+        # 堆里的条目留到弹出时再丢
+        with self._lock:
+            self._latest.pop(user_id, None)
+
+    def most_recent(self, limit: int, since: float) -> List[str]:
+        """last_active >= since 的用户里最近活跃的前 limit 个，O(k log n)"""
+        with self._lock:
+            picked: List[Tuple[float, str]] = []
+            while self._recent and len(picked) < limit:
+                neg_ts, user_id = heapq.heappop(self._recent)
+                if self._latest.get(user_id) != -neg_ts:
+                    continue
+                picked.append((neg_ts, user_id))
+                if -neg_ts < since:
+                    break
+            for entry in picked:
+                heapq.heappush(self._recent, entry)
+            return [user_id for neg_ts, user_id in picked if -neg_ts >= since]
+
+    def expire(self, before: float) -> List[str]:
+        """移除并返回 last_active < before 的用户，O(k log n)"""
+        expired: List[str] = []
+        with self._lock:
+            while self._oldest and self._oldest[0][0] < before:
+                ts, user_id = heapq.heappop(self._oldest)
+                if self._latest.get(user_id) == ts:
+                    del self._latest[user_id]
+                    expired.append(user_id)
+        return expired
+
+    def _maybe_compact(self) -> None:
+        if len(self._recent) > 2 * len(self._latest) + 64:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._recent = [(-ts, user_id) for user_id, ts in self._latest.items()]
+        self._oldest = [(ts, user_id) for user_id, ts in self._latest.items()]
+        heapq.heapify(self._recent)
+        heapq.heapify(self._oldest)
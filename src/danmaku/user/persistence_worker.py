@@ -0,0 +1,256 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from src.utils.metrics import DurationStats
+
+# 一次写操作：在写线程的连接上执行，外层事务由 worker 负责
+WriteOp = Callable[[sqlite3.Connection], None]
+# 写完回调：参数表示是否成功提交
+DoneCallback = Callable[[bool], None]
+
+_Item = Tuple[float, WriteOp, Optional[DoneCallback], Optional[Hashable]]
+_STOP = object()
+
+
+class PersistenceWorker:
+    """
+    单线程 SQLite 写队列。
+    sync 代码调用 submit()，async 代码 await submit_async()，都不依赖当前有没有事件循环。
+    队列有上限：满了 submit() 会阻塞、submit_async() 会在线程池里等，形成背压，
+    而不是像 create_task 那样无限堆积。写线程一次取出最多 max_batch 个操作放进同一个事务。
+    close() 会把已经入队的操作全部写完再返回。
+    写线程连不上数据库时按退避重试，仍然失败的那一批回调 False，下一批重新连接；
+    万一写线程已经退出，submit()/flush() 改在调用线程里直接写，不会永远阻塞。
+    提交时可以带一个 key（比如某个用户的某类记忆），worker 记着每个 key 还有几个操作没写完，
+    flush(key) 只等这个 key 的操作，没有排队的就立刻返回，不用等整个队列。
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        max_queue: int = 1000,
+        max_batch: int = 100,
+        connect_retries: int = 5,
+    ):
+        self._connect = connect
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self.max_batch = max_batch
+        self.connect_retries = connect_retries
+        self._closed = False
+        self._pending_keys: Dict[Hashable, int] = {}
+        self._keys_done = threading.Condition()
+
+        # 指标
+        self.write_latency = DurationStats()  # 入队到提交的耗时
+        self.max_depth = 0
+        self.blocked_puts = 0
+        self.batches = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(
+        self, op: WriteOp, on_done: Optional[DoneCallback] = None, key: Optional[Hashable] = None
+    ) -> None:
+        item = self._item(op, on_done, key)
+        if not self._thread.is_alive():
+            self._write_inline([item])
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.blocked_puts += 1
+            # 分段等待，等待期间写线程退出了就改为直接写
+            while True:
+                try:
+                    self._queue.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    if not self._thread.is_alive():
+                        self._write_inline([item])
+                        return
+        self._note_depth()
+
+    async def submit_async(
+        self, op: WriteOp, on_done: Optional[DoneCallback] = None, key: Optional[Hashable] = None
+    ) -> None:
+        item = self._item(op, on_done, key)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.blocked_puts += 1
+            await asyncio.get_running_loop().run_in_executor(None, self._queue.put, item)
+        self._note_depth()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def pending(self, key: Hashable) -> int:
+        """key 对应的还没写完的操作数"""
+        with self._keys_done:
+            return self._pending_keys.get(key, 0)
+
+    def flush(self, key: Optional[Hashable] = None) -> None:
+        """阻塞到当前已入队的操作全部处理完；给了 key 时只等这个 key 的操作"""
+        if key is not None:
+            with self._keys_done:
+                while self._pending_keys.get(key) and self._thread.is_alive():
+                    self._keys_done.wait(0.5)
+                if not self._pending_keys.get(key):
+                    return
+        while self._thread.is_alive():
+            with self._queue.all_tasks_done:
+                if not self._queue.unfinished_tasks:
+                    return
+                self._queue.all_tasks_done.wait(0.5)
+        # 写线程已经退出，剩下的在当前线程写完
+        self._drain_inline()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        # 和 close 并发、落在 _STOP 之后的操作，在当前线程补写
+        self._drain_inline()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth(),
+            "max_queue_depth": self.max_depth,
+            "blocked_puts": self.blocked_puts,
+            "batches": self.batches,
+            "writes": self.write_latency.count,
+            "failed_writes": self.failed,
+            "write_latency_ms_avg": round(self.write_latency.mean() * 1000, 2),
+            "write_latency_ms_p95": round(self.write_latency.percentile(95) * 1000, 2),
+        }
+
+    def _item(self, op: WriteOp, on_done: Optional[DoneCallback], key: Optional[Hashable]) -> _Item:
+        if self._closed:
+            raise RuntimeError("PersistenceWorker is closed")
+        if key is not None:
+            with self._keys_done:
+                self._pending_keys[key] = self._pending_keys.get(key, 0) + 1
+        return (time.monotonic(), op, on_done, key)
+
+    def _note_depth(self) -> None:
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _drain_inline(self) -> None:
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write_inline([item for item in leftovers if item is not _STOP])
+        for _ in leftovers:
+            self._queue.task_done()
+
+    def _write_inline(self, items: List[_Item]) -> None:
+        if not items:
+            return
+        try:
+            self._execute(self._connect(), items)
+        except Exception as e:
+            print(f"[PersistenceWorker] Inline write failed: {e}")
+            self.failed += len(items)
+            self._finish(items, [False] * len(items))
+
+    def _open(self) -> sqlite3.Connection:
+        delay = 0.05
+        for attempt in range(self.connect_retries):
+            try:
+                return self._connect()
+            except Exception as e:
+                print(f"[PersistenceWorker] Connect failed (attempt {attempt + 1}/{self.connect_retries}): {e}")
+                if attempt + 1 == self.connect_retries:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+
+    def _run(self) -> None:
+        conn: Optional[sqlite3.Connection] = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            items = [item for item in batch if item is not _STOP]
+            try:
+                if items and conn is None:
+                    conn = self._open()
+                self._execute(conn, items)
+            except Exception as e:
+                # 连不上库或连接已损坏：这一批回调失败，下一批重新连接，线程不退出
+                print(f"[PersistenceWorker] Batch of {len(items)} dropped: {e}")
+                self.failed += len(items)
+                self._finish(items, [False] * len(items))
+                conn = None
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if any(item is _STOP for item in batch):
+                return
+
+    def _execute(self, conn: sqlite3.Connection, items: List[_Item]) -> None:
+        if not items:
+            return
+        results: List[bool]
+        try:
+            with conn:
+                for _, op, _, _ in items:
+                    op(conn)
+            results = [True] * len(items)
+        except Exception as e:
+            # 整批回滚后逐条重试，坏掉的那条不拖累其他写入
+            print(f"[PersistenceWorker] Batch of {len(items)} failed, retrying one by one: {e}")
+            results = []
+            for _, op, _, _ in items:
+                try:
+                    with conn:
+                        op(conn)
+                    results.append(True)
+                except Exception as e:
+                    self.failed += 1
+                    print(f"[PersistenceWorker] Write failed: {e}")
+                    results.append(False)
+
+        self.batches += 1
+        self._finish(items, results)
+
+    def _finish(self, items: List[_Item], results: List[bool]) -> None:
+        now = time.monotonic()
+        keys = [item[3] for item in items if item[3] is not None]
+        if keys:
+            with self._keys_done:
+                for key in keys:
+                    left = self._pending_keys[key] - 1
+                    if left:
+                        self._pending_keys[key] = left
+                    else:
+                        del self._pending_keys[key]
+                self._keys_done.notify_all()
+        for (enqueued, _, on_done, _), ok in zip(items, results):
+            self.write_latency.record(now - enqueued)
+            if on_done is not None:
+                try:
+                    on_done(ok)
+                except Exception as e:
+                    print(f"[PersistenceWorker] Callback error: {e}")
@@ -1,14 +1,17 @@
 import asyncio
 import json
-import sqlite3
 import threading
 import time
 from datetime import datetime, timedelta
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set
 
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from src.danmaku.user.activity_index import ActivityIndex
+from src.danmaku.user.user_store import MessageRow, UserRow, UserStore
+from src.utils.lru_cache import BoundedLRU
 from src.utils.path import find_project_root
 
 
@@ -64,39 +67,108 @@ class User:
             metadata=json.loads(data["metadata"]) if data["metadata"] else {}
         )
 
+    def to_row(self) -> UserRow:
+        return (
+            self.user_id,
+            self.username,
+            self.created_at.isoformat(),
+            self.last_active.isoformat(),
+            self.status.value,
+            json.dumps(self.metadata)
+        )
+
+
+# 一个 LangChain 消息对象除正文外大约占用的内存，用于估算缓存体积
+MESSAGE_OVERHEAD_BYTES = 800
+
+# 分页读取历史消息：loader(limit, upto_seq) 返回 seq <= upto_seq 的最近 limit 条，按时间顺序
+MessageLoader = Callable[[int, int], List[BaseMessage]]
+
 
 class ConversationMemory:
-    """对话记忆类"""
+    """对话记忆类
+
+    每条消息按 seq（第几条，从 1 开始）追加写进 messages 表，不再整块重写。
+    从数据库恢复时只挂一个 loader，第一次访问 messages 时才读最近 window 条；
+    在那之前新加的消息先放在 _tail，加载后接到历史后面。
+    """
     def __init__(self, user_id: str, memory_type: MemoryType):
         self.user_id = user_id
         self.memory_type = memory_type
-        self.messages: List[BaseMessage] = []
+        self._messages: Optional[List[BaseMessage]] = []
+        self._tail: List[BaseMessage] = []
+        self._loader: Optional[MessageLoader] = None
+        self._stored_count = 0
+        self.window = 0
         self.user_info: Dict[str, Any] = {}
         self.created_at = datetime.now()
         self.last_updated = datetime.now()
         self.message_count = 0
 
-    def add_message(self, message: BaseMessage) -> None:
-        """添加消息到记忆中"""
-        self.messages.append(message)
+    @property
+    def messages(self) -> List[BaseMessage]:
+        if self._messages is None:
+            limit = max(self.window - len(self._tail), 0)
+            history = self._loader(limit, self._stored_count) if limit and self._stored_count else []
+            self._messages = history + self._tail
+            self._tail = []
+        return self._messages
+
+    @messages.setter
+    def messages(self, value: List[BaseMessage]) -> None:
+        self._messages = value
+        self._tail = []
+
+    def approx_size(self) -> int:
+        """估算常驻内存的字节数，尚未加载的历史不计"""
+        messages = self._messages if self._messages is not None else self._tail
+        return 1024 + sum(
+            MESSAGE_OVERHEAD_BYTES + len(str(msg.content)) * 2 for msg in messages
+        )
+
+    def attach_loader(self, loader: MessageLoader, stored_count: int, window: int) -> None:
+        """改为按需加载：数据库里已有 stored_count 条，最多加载最近 window 条"""
+        self._loader = loader
+        self._stored_count = stored_count
+        self.window = window
+        self._messages = None
+        self._tail = []
+
+    def add_message(self, message: BaseMessage) -> int:
+        """添加消息到记忆中，返回这条消息的 seq"""
+        if self._messages is None:
+            self._tail.append(message)
+        else:
+            self._messages.append(message)
         self.last_updated = datetime.now()
         self.message_count += 1
+        return self.message_count
 
     def get_recent_messages(self, limit: int = 50) -> List[BaseMessage]:
         """获取最近的消息"""
+        if self._messages is None and limit > 0:
+            # 还没加载历史：只读需要的那一页
+            if limit <= len(self._tail) or not self._stored_count:
+                return self._tail[-limit:]
+            return self._loader(limit - len(self._tail), self._stored_count) + self._tail
         return self.messages[-limit:] if limit > 0 else self.messages
 
     def clear_old_messages(self, keep_count: int = 100) -> None:
         """清理旧消息，保留最近的消息"""
-        if len(self.messages) > keep_count:
-            self.messages = self.messages[-keep_count:]
+        if self._messages is None:
+            # 新消息已经把历史全部挤出窗口，不必再去加载
+            if len(self._tail) >= keep_count:
+                self.messages = self._tail[-keep_count:]
+            return
+        if len(self._messages) > keep_count:
+            self._messages = self._messages[-keep_count:]
 
-    def to_dict(self) -> Dict[str, Any]:
-        """序列化为字典"""
+    def to_dict(self, include_messages: bool = True) -> Dict[str, Any]:
+        """序列化为字典；include_messages=False 时只保留元数据，消息在 messages 表里"""
         return {
             "user_id": self.user_id,
             "memory_type": self.memory_type.value,
-            "messages": [self._message_to_dict(msg) for msg in self.messages],
+            "messages": [self._message_to_dict(msg) for msg in self.messages] if include_messages else [],
             "user_info": self.user_info,
             "created_at": self.created_at.isoformat(),
             "last_updated": self.last_updated.isoformat(),
@@ -134,6 +206,10 @@ class ConversationMemory:
             return HumanMessage(content=data["content"])  # 默认为人类消息
 
 
+# messages 表上线后的库版本（PRAGMA user_version），低于它的库需要把旧 blob 拆成消息行
+MESSAGES_SCHEMA_VERSION = 1
+
+
 class UserManager:
     """
     企业级用户管理器
@@ -157,31 +233,46 @@ class UserManager:
         self._initialized = True
         self.db_path = db_path or (find_project_root() / "src" / "runtime" / "users" / "user_data.db")
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._store = UserStore(self.db_path)
+        
+        # 配置
+        self.max_personal_messages = 200
+        self.max_general_messages = 500
+        # 每追加多少条消息做一次区间删除，把窗口外的旧消息清出 messages 表
+        self.trim_interval = 50
+        self.inactive_threshold = timedelta(days=30)
+        # 缓存上限：冷用户和冷记忆被淘汰，下次访问时从 SQLite 重新加载
+        self.max_cached_users = 5000
+        self.max_cached_memories = 1000
+        self.max_memory_cache_bytes = 64 * 1024 * 1024
         
         # 内存缓存
-        self._users: Dict[str, User] = {}
-        self._personal_memories: Dict[str, ConversationMemory] = {}
+        self._users: BoundedLRU[str, User] = BoundedLRU(self.max_cached_users)
+        self._personal_memories: BoundedLRU[str, ConversationMemory] = BoundedLRU(
+            self.max_cached_memories,
+            max_bytes=self.max_memory_cache_bytes,
+            sizeof=ConversationMemory.approx_size,
+            on_evict=lambda _, memory: self._save_memory_to_db(memory)
+        )
         self._general_memory: Optional[ConversationMemory] = None
+        # 所有活跃用户（含已被淘汰出缓存的）按 last_active 排序的索引
+        self._activity = ActivityIndex()
         
         # 线程安全
         self._memory_lock = threading.RLock()
         self._user_lock = threading.RLock()
         
-        # 配置
-        self.max_personal_messages = 200
-        self.max_general_messages = 500
-        self.inactive_threshold = timedelta(days=30)
-        
         # 初始化数据库和general记忆
         self._init_database()
         self._init_general_memory()
+        self._init_activity_index()
         
         # 启动后台清理任务
         self._start_cleanup_task()
 
     def _init_database(self) -> None:
         """初始化数据库表"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._store.connection() as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     user_id TEXT PRIMARY KEY,
@@ -205,17 +296,70 @@ class UserManager:
                 )
             """)
             
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    user_id TEXT NOT NULL,
+                    memory_type TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    type TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    PRIMARY KEY (user_id, memory_type, seq)
+                ) WITHOUT ROWID
+            """)
+            
             conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_users_status 
                 ON users(status)
             """)
             
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_status_last_active 
+                ON users(status, last_active)
+            """)
+            
             conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_memories_user_type 
                 ON memories(user_id, memory_type)
             """)
-            
-            conn.commit()
+
+            self._migrate_memory_blobs(conn)
+
+    def _migrate_memory_blobs(self, conn) -> None:
+        """把旧版整块存在 memories.data 里的消息拆进 messages 表，只执行一次"""
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= MESSAGES_SCHEMA_VERSION:
+            return
+
+        rows = conn.execute("SELECT user_id, memory_type, data FROM memories").fetchall()
+        migrated = 0
+        for user_id, memory_type, data in rows:
+            blob = json.loads(data)
+            messages = blob.get("messages") or []
+            if not messages:
+                continue
+            # 旧 blob 只保留了最近的消息，seq 接在被清掉的那些之后
+            total = max(blob.get("message_count", 0), len(messages))
+            first_seq = total - len(messages) + 1
+            conn.executemany(
+                "INSERT OR IGNORE INTO messages "
+                "(user_id, memory_type, seq, type, content, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (user_id, memory_type, first_seq + i, msg["type"], msg["content"],
+                     msg.get("timestamp") or blob["last_updated"])
+                    for i, msg in enumerate(messages)
+                ]
+            )
+            blob["messages"] = []
+            blob["message_count"] = total
+            conn.execute(
+                "UPDATE memories SET data = ? WHERE user_id = ? AND memory_type = ?",
+                (json.dumps(blob), user_id, memory_type)
+            )
+            migrated += 1
+
+        conn.execute(f"PRAGMA user_version = {MESSAGES_SCHEMA_VERSION}")
+        if migrated:
+            print(f"[UserManager] Migrated {migrated} memory blobs to the messages table")
 
     def _init_general_memory(self) -> None:
         """初始化全局记忆"""
@@ -224,6 +368,24 @@ class UserManager:
             # 尝试从数据库加载
             self._load_memory_from_db("__GENERAL__", MemoryType.GENERAL)
 
+    def _init_activity_index(self) -> None:
+        """从数据库载入仍在活跃期内的用户"""
+        threshold = datetime.now() - self.inactive_threshold
+        try:
+            rows = self._store.active_users_since(threshold.isoformat())
+            self._activity.load(
+                (user_id, datetime.fromisoformat(last_active).timestamp())
+                for user_id, last_active in rows
+            )
+        except Exception as e:
+            print(f"[UserManager] Error loading activity index: {e}")
+
+    def _track_activity(self, user: User) -> None:
+        if user.status == UserStatus.ACTIVE:
+            self._activity.touch(user.user_id, user.last_active.timestamp())
+        else:
+            self._activity.remove(user.user_id)
+
     def register_user(
         self, 
         user_id: str, 
@@ -232,8 +394,9 @@ class UserManager:
     ) -> User:
         """注册新用户或更新现有用户"""
         with self._user_lock:
-            if user_id in self._users:
-                user = self._users[user_id]
+            # 被淘汰出缓存的老用户要从数据库取回，不能当新用户重建
+            user = self._users.get(user_id) or self._load_user_from_db(user_id)
+            if user:
                 user.last_active = datetime.now()
                 if username:
                     user.username = username
@@ -248,25 +411,18 @@ class UserManager:
                 self._users[user_id] = user
                 
                 # 初始化个人记忆
-                with self._memory_lock:
-                    if user_id not in self._personal_memories:
-                        self._personal_memories[user_id] = ConversationMemory(
-                            user_id, MemoryType.PERSONAL
-                        )
-                        # 尝试从数据库加载
-                        self._load_memory_from_db(user_id, MemoryType.PERSONAL)
+                self._ensure_personal_memory(user_id)
             
             # 保存到数据库
+            self._track_activity(user)
             self._save_user_to_db(user)
             return user
 
     def get_user(self, user_id: str) -> Optional[User]:
         """获取用户信息"""
         with self._user_lock:
-            if user_id not in self._users:
-                # 尝试从数据库加载
-                self._load_user_from_db(user_id)
-            return self._users.get(user_id)
+            # 缓存未命中时尝试从数据库加载
+            return self._users.get(user_id) or self._load_user_from_db(user_id)
 
     def get_personal_memory(self, user_id: str) -> Optional[ConversationMemory]:
         """获取用户个人记忆"""
@@ -274,8 +430,19 @@ class UserManager:
         if not self.get_user(user_id):
             self.register_user(user_id)
         
+        return self._ensure_personal_memory(user_id)
+
+    def _ensure_personal_memory(self, user_id: str) -> ConversationMemory:
+        """取缓存里的个人记忆，未命中时从数据库懒加载"""
         with self._memory_lock:
-            return self._personal_memories.get(user_id)
+            memory = self._personal_memories.get(user_id)
+            if memory is None:
+                memory = ConversationMemory(user_id, MemoryType.PERSONAL)
+                self._personal_memories[user_id] = memory
+                # 尝试从数据库加载，找到时会替换掉上面的空记忆
+                self._load_memory_from_db(user_id, MemoryType.PERSONAL)
+                memory = self._personal_memories.peek(user_id, memory)
+            return memory
 
     def get_general_memory(self) -> ConversationMemory:
         """获取全局记忆"""
@@ -291,20 +458,21 @@ class UserManager:
         memory = self.get_personal_memory(user_id)
         if memory:
             with self._memory_lock:
-                memory.add_message(message)
+                seq = memory.add_message(message)
                 # 清理旧消息
                 memory.clear_old_messages(self.max_personal_messages)
-                # 异步保存到数据库
-                asyncio.create_task(self._save_memory_to_db_async(memory))
+                self._personal_memories.refresh(user_id)
+                # 交给后台写线程追加到数据库
+                self._append_message_to_db(memory, seq, message)
 
     def add_message_to_general(self, message: BaseMessage) -> None:
         """添加消息到全局记忆"""
         with self._memory_lock:
-            self._general_memory.add_message(message)
+            seq = self._general_memory.add_message(message)
             # 清理旧消息
             self._general_memory.clear_old_messages(self.max_general_messages)
-            # 异步保存到数据库
-            asyncio.create_task(self._save_memory_to_db_async(self._general_memory))
+            # 交给后台写线程追加到数据库
+            self._append_message_to_db(self._general_memory, seq, message)
 
     def add_message_to_both(
         self, 
@@ -318,20 +486,21 @@ class UserManager:
     def get_active_users(self, limit: int = 50) -> List[User]:
         """获取活跃用户列表"""
         threshold = datetime.now() - self.inactive_threshold
+        # 索引已按最后活跃时间排序，只取前 limit 个
+        user_ids = self._activity.most_recent(limit, threshold.timestamp())
         with self._user_lock:
-            active_users = [
-                user for user in self._users.values()
-                if user.status == UserStatus.ACTIVE and user.last_active > threshold
-            ]
-            # 按最后活跃时间排序
-            active_users.sort(key=lambda u: u.last_active, reverse=True)
-            return active_users[:limit]
+            users = [self.get_user(user_id) for user_id in user_ids]
+        return [user for user in users if user]
 
     def update_user_activity(self, user_id: str) -> None:
         """更新用户活跃时间"""
         user = self.get_user(user_id)
         if user:
             user.last_active = datetime.now()
+            # 被标记为非活跃的老观众重新发言时恢复活跃
+            if user.status == UserStatus.INACTIVE:
+                user.status = UserStatus.ACTIVE
+            self._track_activity(user)
             self._save_user_to_db(user)
 
     def ban_user(self, user_id: str) -> bool:
@@ -339,6 +508,7 @@ class UserManager:
         user = self.get_user(user_id)
         if user:
             user.status = UserStatus.BANNED
+            self._track_activity(user)
             self._save_user_to_db(user)
             return True
         return False
@@ -348,102 +518,128 @@ class UserManager:
         user = self.get_user(user_id)
         if user:
             user.status = UserStatus.ACTIVE
+            self._track_activity(user)
             self._save_user_to_db(user)
             return True
         return False
 
     def _save_user_to_db(self, user: User) -> None:
-        """保存用户到数据库"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
-                    INSERT OR REPLACE INTO users 
-                    (user_id, username, created_at, last_active, status, metadata)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    user.user_id,
-                    user.username,
-                    user.created_at.isoformat(),
-                    user.last_active.isoformat(),
-                    user.status.value,
-                    json.dumps(user.metadata)
-                ))
-                conn.commit()
-        except Exception as e:
-            print(f"[UserManager] Error saving user {user.user_id}: {e}")
+        """保存用户到数据库（write-behind，由 UserStore 合并后批量写入）"""
+        self._store.save_user(user.to_row())
 
     def _load_user_from_db(self, user_id: str) -> Optional[User]:
         """从数据库加载用户"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute(
-                    "SELECT * FROM users WHERE user_id = ?", (user_id,)
-                )
-                row = cursor.fetchone()
-                if row:
-                    user_data = {
-                        "user_id": row[0],
-                        "username": row[1],
-                        "created_at": row[2],
-                        "last_active": row[3],
-                        "status": row[4],
-                        "metadata": row[5]
-                    }
-                    user = User.from_dict(user_data)
-                    self._users[user_id] = user
-                    return user
+            row = self._store.load_user(user_id)
+            if row:
+                user_data = {
+                    "user_id": row[0],
+                    "username": row[1],
+                    "created_at": row[2],
+                    "last_active": row[3],
+                    "status": row[4],
+                    "metadata": row[5]
+                }
+                user = User.from_dict(user_data)
+                self._users[user_id] = user
+                return user
         except Exception as e:
             print(f"[UserManager] Error loading user {user_id}: {e}")
         return None
 
-    async def _save_memory_to_db_async(self, memory: ConversationMemory) -> None:
-        """异步保存记忆到数据库"""
+    def _max_messages(self, memory_type: MemoryType) -> int:
+        if memory_type == MemoryType.GENERAL:
+            return self.max_general_messages
+        return self.max_personal_messages
+
+    def _append_message_to_db(
+        self,
+        memory: ConversationMemory,
+        seq: int,
+        message: BaseMessage
+    ) -> None:
+        """追加一条消息；每 trim_interval 条做一次区间删除清掉窗口外的旧消息
+        写入由 UserStore 的写线程完成，队列满时这里会阻塞（背压）"""
+        data = ConversationMemory._message_to_dict(message)
+        content = data["content"]
+        row: MessageRow = (
+            memory.user_id,
+            memory.memory_type.value,
+            seq,
+            data["type"],
+            content if isinstance(content, str) else json.dumps(content),
+            data["timestamp"]
+        )
         try:
-            await asyncio.get_event_loop().run_in_executor(
-                None, self._save_memory_to_db, memory
-            )
+            self._store.append_message(row)
+            if seq % self.trim_interval == 0:
+                self._store.trim_messages(
+                    memory.user_id,
+                    memory.memory_type.value,
+                    seq - self._max_messages(memory.memory_type)
+                )
         except Exception as e:
-            print(f"[UserManager] Error saving memory async: {e}")
+            print(f"[UserManager] Error appending message: {e}")
 
     def _save_memory_to_db(self, memory: ConversationMemory) -> None:
-        """保存记忆到数据库"""
+        """保存记忆的元数据到数据库，消息本身在 messages 表里"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
-                    INSERT OR REPLACE INTO memories 
-                    (user_id, memory_type, data, created_at, last_updated)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    memory.user_id,
-                    memory.memory_type.value,
-                    json.dumps(memory.to_dict()),
-                    memory.created_at.isoformat(),
-                    memory.last_updated.isoformat()
-                ))
-                conn.commit()
+            self._store.save_memory((
+                memory.user_id,
+                memory.memory_type.value,
+                json.dumps(memory.to_dict(include_messages=False)),
+                memory.created_at.isoformat(),
+                memory.last_updated.isoformat()
+            ))
         except Exception as e:
             print(f"[UserManager] Error saving memory: {e}")
 
     def _load_memory_from_db(self, user_id: str, memory_type: MemoryType) -> None:
-        """从数据库加载记忆"""
+        """从数据库加载记忆的元数据，消息在第一次访问时分页读取"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute(
+            # 等写线程把这份记忆排队中的写入写完，被淘汰后重新加载才能拿到正确的 seq；
+            # 只等这个 key，没有排队的写入时不阻塞
+            self._store.flush_memory(user_id, memory_type.value)
+            with self._store.connection() as conn:
+                row = conn.execute(
                     "SELECT data FROM memories WHERE user_id = ? AND memory_type = ?",
                     (user_id, memory_type.value)
-                )
-                row = cursor.fetchone()
-                if row:
-                    memory_data = json.loads(row[0])
-                    memory = ConversationMemory.from_dict(memory_data)
-                    
-                    if memory_type == MemoryType.GENERAL:
-                        self._general_memory = memory
-                    else:
-                        self._personal_memories[user_id] = memory
+                ).fetchone()
+            stored_count = self._store.max_seq(user_id, memory_type.value)
+
+            if row:
+                memory = ConversationMemory.from_dict(json.loads(row[0]))
+            elif stored_count:
+                memory = ConversationMemory(user_id, memory_type)
+            else:
+                return
+            memory.message_count = max(memory.message_count, stored_count)
+            memory.attach_loader(
+                partial(self._load_messages, user_id, memory_type),
+                stored_count,
+                self._max_messages(memory_type)
+            )
+
+            if memory_type == MemoryType.GENERAL:
+                self._general_memory = memory
+            else:
+                self._personal_memories[user_id] = memory
         except Exception as e:
             print(f"[UserManager] Error loading memory {user_id}/{memory_type}: {e}")
 
+    def _load_messages(
+        self,
+        user_id: str,
+        memory_type: MemoryType,
+        limit: int,
+        upto_seq: int
+    ) -> List[BaseMessage]:
+        rows = self._store.load_messages(user_id, memory_type.value, limit, upto_seq)
+        return [
+            ConversationMemory._dict_to_message({"type": msg_type, "content": content})
+            for msg_type, content in rows
+        ]
+
     def _start_cleanup_task(self) -> None:
         """启动后台清理任务"""
         def cleanup_worker():
@@ -459,35 +655,34 @@ class UserManager:
         cleanup_thread.start()
 
     def _cleanup_inactive_users(self) -> None:
-        """清理非活跃用户"""
+        """将超过 inactive_threshold 未发言的用户标记为非活跃，但不删除记忆"""
         threshold = datetime.now() - self.inactive_threshold
-        inactive_users = []
-        
+        expired = self._activity.expire(threshold.timestamp())
+
         with self._user_lock:
-            for user_id, user in self._users.items():
-                if user.last_active < threshold and user.status == UserStatus.ACTIVE:
-                    inactive_users.append(user_id)
-        
-        for user_id in inactive_users:
-            # 将用户标记为非活跃，但不删除记忆
-            if user_id in self._users:
-                self._users[user_id].status = UserStatus.INACTIVE
-                self._save_user_to_db(self._users[user_id])
+            for user_id in expired:
+                user = self._users.peek(user_id)
+                if user and user.status == UserStatus.ACTIVE:
+                    user.status = UserStatus.INACTIVE
+
+        # 先让缓冲里的用户行排在前面写入，再用一条 UPDATE 批量改状态
+        self._store.flush()
+        self._store.mark_inactive(threshold.isoformat())
 
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
         with self._user_lock, self._memory_lock:
-            active_count = sum(
-                1 for user in self._users.values() 
-                if user.status == UserStatus.ACTIVE
-            )
+            active_count = len(self._activity)
             
             return {
                 "total_users": len(self._users),
                 "active_users": active_count,
                 "personal_memories": len(self._personal_memories),
+                "user_cache": self._users.stats(),
+                "memory_cache": self._personal_memories.stats(),
                 "general_messages": len(self._general_memory.messages) if self._general_memory else 0,
-                "db_path": str(self.db_path)
+                "db_path": str(self.db_path),
+                "persistence": self._store.stats()
             }
 
     async def close(self) -> None:
@@ -505,5 +700,7 @@ class UserManager:
         with self._user_lock:
             for user in self._users.values():
                 self._save_user_to_db(user)
+        # 等写线程把队列写完，不阻塞事件循环
+        await asyncio.to_thread(self._store.close)
         
         print("[UserManager] Shutdown complete.") 
\ No newline at end of file
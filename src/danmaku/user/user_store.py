@@ -0,0 +1,314 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.danmaku.user.persistence_worker import PersistenceWorker
+
+# users 表一行：(user_id, username, created_at, last_active, status, metadata)
+UserRow = Tuple[str, str, str, str, str, str]
+
+UPSERT_USER_SQL = """
+    INSERT OR REPLACE INTO users
+    (user_id, username, created_at, last_active, status, metadata)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+SELECT_USER_SQL = "SELECT * FROM users WHERE user_id = ?"
+ACTIVE_USERS_SQL = "SELECT user_id, last_active FROM users WHERE status = 'active' AND last_active >= ?"
+MARK_INACTIVE_SQL = "UPDATE users SET status = 'inactive' WHERE status = 'active' AND last_active < ?"
+
+# messages 表一行：(user_id, memory_type, seq, type, content, timestamp)
+MessageRow = Tuple[str, str, int, str, str, str]
+
+INSERT_MESSAGE_SQL = """
+    INSERT OR REPLACE INTO messages
+    (user_id, memory_type, seq, type, content, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+TRIM_MESSAGES_SQL = "DELETE FROM messages WHERE user_id = ? AND memory_type = ? AND seq <= ?"
+SELECT_MESSAGES_SQL = """
+    SELECT type, content FROM messages
+    WHERE user_id = ? AND memory_type = ? AND seq <= ?
+    ORDER BY seq DESC LIMIT ?
+"""
+MAX_SEQ_SQL = "SELECT MAX(seq) FROM messages WHERE user_id = ? AND memory_type = ?"
+
+# memories 表一行：(user_id, memory_type, data, created_at, last_updated)
+MemoryRow = Tuple[str, str, str, str, str]
+
+SAVE_MEMORY_SQL = """
+    INSERT OR REPLACE INTO memories
+    (user_id, memory_type, data, created_at, last_updated)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+class UserStore:
+    """
+    UserManager 的 SQLite 持久层。
+    每个线程复用一条长连接（WAL 模式 + 语句缓存），不再每次操作都重新 connect。
+    用户行走 write-behind：同一用户的多次更新在内存里合并成一行，
+    按时间间隔或积压数量成批交给写线程。
+    所有写操作（用户、消息追加、清理、记忆元数据）都经由同一个有界的 PersistenceWorker，
+    读操作用调用线程自己的连接。
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        flush_interval: float = 1.0,
+        max_pending: int = 256,
+        max_queue: int = 1000,
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+        self._pending: Dict[str, UserRow] = {}
+        # 已交给写线程、还没提交的批次，读的时候也要算上
+        self._inflight: List[Dict[str, UserRow]] = []
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        # journal_mode 会持久化在库文件里，在这里切换一次；改 journal_mode 不等 busy timeout，
+        # 放到各线程的连接里和写线程同时执行会偶发 "database is locked"
+        self.connection().execute("PRAGMA journal_mode=WAL")
+        self.worker = PersistenceWorker(self.connection, max_queue=max_queue)
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的长连接；用 `with store.connection() as conn:` 包一个事务。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, cached_statements=64)
+            # WAL 下 NORMAL 只在 checkpoint 时 fsync，断电最多丢最后几个事务
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def save_user(self, row: UserRow) -> None:
+        """登记一行待写入的用户数据；同一用户只保留最新的一行。"""
+        with self._pending_lock:
+            self._pending[row[0]] = row
+            backlog = len(self._pending)
+        if backlog >= self.max_pending:
+            self._wake.set()
+
+    def load_user(self, user_id: str) -> Optional[UserRow]:
+        # 还没落盘的更新优先，保证读到自己刚写的数据
+        with self._pending_lock:
+            row = self._pending.get(user_id)
+            for batch in reversed(self._inflight):
+                if row is not None:
+                    break
+                row = batch.get(user_id)
+        if row is not None:
+            return row
+        return self.connection().execute(SELECT_USER_SQL, (user_id,)).fetchone()
+
+    def active_users_since(self, since: str) -> List[Tuple[str, str]]:
+        """status 为 active 且 last_active >= since 的 (user_id, last_active)"""
+        return self.connection().execute(ACTIVE_USERS_SQL, (since,)).fetchall()
+
+    def mark_inactive(self, before: str) -> None:
+        """一条 UPDATE 把 last_active 早于 before 的活跃用户批量标记为非活跃"""
+        self.worker.submit(lambda conn: conn.execute(MARK_INACTIVE_SQL, (before,)))
+
+    def append_message(self, row: MessageRow) -> None:
+        self.worker.submit(lambda conn: conn.execute(INSERT_MESSAGE_SQL, row), key=(row[0], row[1]))
+
+    def trim_messages(self, user_id: str, memory_type: str, upto_seq: int) -> None:
+        """区间删除 seq <= upto_seq 的旧消息"""
+        if upto_seq <= 0:
+            return
+        self.worker.submit(
+            lambda conn: conn.execute(TRIM_MESSAGES_SQL, (user_id, memory_type, upto_seq)),
+            key=(user_id, memory_type),
+        )
+
+    def save_memory(self, row: MemoryRow) -> None:
+        self.worker.submit(lambda conn: conn.execute(SAVE_MEMORY_SQL, row), key=(row[0], row[1]))
+
+    def flush_memory(self, user_id: str, memory_type: str) -> None:
+        """等这个用户这类记忆排队中的写操作落盘；没有排队的直接返回"""
+        self.worker.flush(key=(user_id, memory_type))
+
+    def load_messages(
+        self,
+        user_id: str,
+        memory_type: str,
+        limit: int,
+        upto_seq: int,
+    ) -> List[Tuple[str, str]]:
+        """seq <= upto_seq 的最近 limit 条 (type, content)，按 seq 升序"""
+        rows = self.connection().execute(
+            SELECT_MESSAGES_SQL, (user_id, memory_type, upto_seq, limit)
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    def max_seq(self, user_id: str, memory_type: str) -> int:
+        row = self.connection().execute(MAX_SEQ_SQL, (user_id, memory_type)).fetchone()
+        return row[0] or 0
+
+    def pending_count(self) -> int:
+        with self._pending_lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """把合并后的用户行作为一批交给写线程，返回行数。"""
+        with self._pending_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._inflight.append(batch)
+        rows = list(batch.values())
+
+        def done(ok: bool) -> None:
+            with self._pending_lock:
+                self._inflight.remove(batch)
+                if not ok:
+                    # 放回去下次重试，期间有更新的以新数据为准
+                    for user_id, row in batch.items():
+                        self._pending.setdefault(user_id, row)
+
+        self.worker.submit(lambda conn: conn.executemany(UPSERT_USER_SQL, rows), on_done=done)
+        return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending_users": self.pending_count(), **self.worker.stats()}
+
+    def close(self) -> None:
+        """停止定时刷新，把缓冲和队列里的写操作全部落盘后关闭连接。"""
+        self._closed = True
+        self._wake.set()
+        self._flusher.join(timeout=5.0)
+        self.flush()
+        self.worker.close()
+        with self._conns_lock:
+            for conn in self._conns:
+                try:
+                    conn.close()
+                except sqlite3.ProgrammingError:
+                    # 其他线程创建的连接，进程退出时由解释器回收
+                    pass
+            self._conns.clear()
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+_USERS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        last_active TEXT NOT NULL,
+        status TEXT NOT NULL,
+        metadata TEXT
+    )
+"""
+
+
+def _benchmark_users(updates: int = 2000, users: int = 50) -> None:
+    """对比旧写法（每次 connect + commit）和 UserStore 的用户更新吞吐。"""
+    import tempfile
+    from datetime import datetime
+
+    def row(i: int) -> UserRow:
+        now = datetime.now().isoformat()
+        return (f"user_{i % users}", f"user_{i % users}", now, now, "active", "{}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path = Path(tmp) / "old.db"
+        with sqlite3.connect(old_path) as conn:
+            conn.execute(_USERS_SCHEMA)
+
+        start = time.perf_counter()
+        for i in range(updates):
+            with sqlite3.connect(old_path) as conn:
+                conn.execute(UPSERT_USER_SQL, row(i))
+                conn.commit()
+        old_elapsed = time.perf_counter() - start
+
+        store = UserStore(Path(tmp) / "new.db")
+        with store.connection() as conn:
+            conn.execute(_USERS_SCHEMA)
+
+        start = time.perf_counter()
+        for i in range(updates):
+            store.save_user(row(i))
+        store.flush()
+        store.worker.flush()
+        new_elapsed = time.perf_counter() - start
+        store.close()
+
+    print(f"[before] per-op connect/commit: {updates / old_elapsed:,.0f} updates/s")
+    print(f"[after ] WAL + write-behind:    {updates / new_elapsed:,.0f} updates/s")
+
+
+def _benchmark_messages(count: int = 2000, window: int = 200, trim_interval: int = 50) -> None:
+    """对比每条消息重写整块 JSON 和追加一行的写入量与速度（同一个 WAL 连接）。"""
+    import json
+    import tempfile
+    from datetime import datetime
+
+    def message(i: int) -> dict:
+        return {"type": "HumanMessage", "content": f"弹幕消息 number {i}", "timestamp": datetime.now().isoformat()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = UserStore(Path(tmp) / "bench.db")
+        with store.connection() as conn:
+            conn.execute("CREATE TABLE blobs (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            conn.execute("""
+                CREATE TABLE messages (
+                    user_id TEXT NOT NULL, memory_type TEXT NOT NULL, seq INTEGER NOT NULL,
+                    type TEXT NOT NULL, content TEXT NOT NULL, timestamp TEXT NOT NULL,
+                    PRIMARY KEY (user_id, memory_type, seq)
+                ) WITHOUT ROWID
+            """)
+
+        history: list = []
+        blob_bytes = 0
+        start = time.perf_counter()
+        for i in range(count):
+            history.append(message(i))
+            history = history[-window:]
+            data = json.dumps({"user_id": "u", "messages": history})
+            blob_bytes += len(data.encode())
+            with store.connection() as conn:
+                conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?)", ("u", data))
+        blob_elapsed = time.perf_counter() - start
+
+        row_bytes = 0
+        start = time.perf_counter()
+        for seq in range(1, count + 1):
+            msg = message(seq)
+            row: MessageRow = ("u", "personal", seq, msg["type"], msg["content"], msg["timestamp"])
+            row_bytes += sum(len(str(v).encode()) for v in row)
+            store.append_message(row)
+            if seq % trim_interval == 0:
+                store.trim_messages("u", "personal", seq - window)
+        store.worker.flush()
+        append_elapsed = time.perf_counter() - start
+        store.close()
+
+    print(f"[before] blob rewrite: {blob_bytes / count:,.0f} bytes/msg, {count / blob_elapsed:,.0f} msgs/s")
+    print(f"[after ] append row:   {row_bytes / count:,.0f} bytes/msg, {count / append_elapsed:,.0f} msgs/s")
+
+
+if __name__ == "__main__":
+    _benchmark_users()
+    _benchmark_messages()
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.utils.lru_cache import BoundedLRU
+from src.utils.path import find_project_root
+
+_INITIAL_ROWS = 1024
+
+
+class _VectorFile:
+    """
+    磁盘上的向量表：vectors.f32 是按行存放的 float32 矩阵（memmap），
+    index.tsv 是追加写的 "内容哈希\\t行号" 日志，启动时读进字典。
+    先写向量再追加索引行，进程中途崩溃也不会留下指向未写完数据的索引。
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = directory / "vectors.f32"
+        self._index_path = directory / "index.tsv"
+        self._meta_path = directory / "meta.json"
+
+        self.dim: Optional[int] = None
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self._capacity = 0
+
+        if self._meta_path.exists():
+            self.dim = json.loads(self._meta_path.read_text())["dim"]
+            self._load_index()
+            self._open(max(_INITIAL_ROWS, self._file_rows()))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._matrix[row])
+
+    def put_many(self, items: List[tuple]) -> None:
+        """写入一批 (key, 向量)"""
+        items = [(key, vector) for key, vector in items if key not in self._rows]
+        if not items:
+            return
+        if self.dim is None:
+            self.dim = len(items[0][1])
+            self._meta_path.write_text(json.dumps({"dim": self.dim}))
+            self._open(_INITIAL_ROWS)
+
+        first = len(self._rows)
+        needed = first + len(items)
+        if needed > self._capacity:
+            capacity = self._capacity
+            while capacity < needed:
+                capacity *= 2
+            self._open(capacity)
+
+        self._matrix[first:needed] = np.asarray([vector for _, vector in items], dtype=np.float32)
+        self._matrix.flush()
+        with open(self._index_path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{key}\t{first + i}\n" for i, (key, _) in enumerate(items)))
+        for i, (key, _) in enumerate(items):
+            self._rows[key] = first + i
+
+    def close(self) -> None:
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+
+    def _file_rows(self) -> int:
+        if not self._vectors_path.exists():
+            return 0
+        return self._vectors_path.stat().st_size // (4 * self.dim)
+
+    def _load_index(self) -> None:
+        if not self._index_path.exists():
+            return
+        with open(self._index_path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                # 最后一行可能写了一半
+                if len(parts) == 2 and parts[1].isdigit():
+                    self._rows[parts[0]] = int(parts[1])
+
+    def _open(self, capacity: int) -> None:
+        """按 capacity 行打开（必要时扩大文件）"""
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        size = capacity * self.dim * 4
+        with open(self._vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._capacity = capacity
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    按内容哈希缓存向量的 Embeddings 包装，可以替换任何 LangChain Embeddings。
+    查找顺序：内存 LRU → 磁盘向量表 → 底层模型；一次调用里所有未命中的文本合并成一次 embed_documents。
+    share_query_cache=True 时 embed_query 和 embed_documents 共用缓存（OpenAI 这类查询和文档
+    用同一种向量的模型适用）；否则查询单独缓存，未命中时调用底层的 embed_query。
+    向量以 float32 落盘。同一个缓存目录只能由一个进程写，进程内请通过 cached_embeddings() 共享实例。
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache_dir: Path,
+        namespace: Optional[str] = None,
+        max_memory_entries: int = 10000,
+        share_query_cache: bool = True,
+    ):
+        self.embeddings = embeddings
+        self.namespace = namespace or _default_namespace(embeddings)
+        self.share_query_cache = share_query_cache
+        self._memory: BoundedLRU[str, np.ndarray] = BoundedLRU(max_memory_entries)
+        self._disk = _VectorFile(Path(cache_dir) / _safe_name(self.namespace))
+        self._lock = threading.Lock()
+
+        # 指标
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.embed_calls = 0
+        self.embed_seconds = 0.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "doc")
+
+    def embed_query(self, text: str) -> List[float]:
+        kind = "doc" if self.share_query_cache else "query"
+        return self._embed([text], kind)[0]
+
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "namespace": self.namespace,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+            "embed_calls": self.embed_calls,
+            "embed_seconds": round(self.embed_seconds, 3),
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._disk),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._disk.close()
+
+    def _key(self, text: str, kind: str) -> str:
+        return hashlib.sha1(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        keys = [self._key(text, kind) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        missing: Dict[str, str] = {}
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in found or key in missing:
+                    continue
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self.memory_hits += 1
+                    found[key] = vector
+                    continue
+                vector = self._disk.get(key)
+                if vector is not None:
+                    self.disk_hits += 1
+                    self._memory.put(key, vector)
+                    found[key] = vector
+                    continue
+                self.misses += 1
+                missing[key] = text
+
+        if missing:
+            # 模型调用不持锁，别的线程的命中不用等
+            start = time.perf_counter()
+            if kind == "query":
+                vectors = [self.embeddings.embed_query(text) for text in missing.values()]
+            else:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.embed_seconds += time.perf_counter() - start
+            self.embed_calls += 1
+
+            new_items = [
+                (key, np.asarray(vector, dtype=np.float32))
+                for key, vector in zip(missing.keys(), vectors)
+            ]
+            with self._lock:
+                self._disk.put_many(new_items)
+                for key, vector in new_items:
+                    self._memory.put(key, vector)
+                    found[key] = vector
+
+        return [found[key].tolist() for key in keys]
+
+
+_shared: Dict[tuple, CachedEmbeddings] = {}
+_shared_lock = threading.Lock()
+
+
+def cached_embeddings(
+    embeddings: Embeddings,
+    namespace: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+) -> CachedEmbeddings:
+    """
+    进程内按 (缓存目录, namespace) 共享的 CachedEmbeddings。
+    各个向量记忆都从这里拿，用同一个模型的就共用一份内存 LRU 和磁盘文件。
+    """
+    cache_dir = Path(cache_dir or find_project_root() / "src/runtime/storage/embedding_cache")
+    namespace = namespace or _default_namespace(embeddings)
+    key = (str(cache_dir.resolve()), namespace)
+    with _shared_lock:
+        instance = _shared.get(key)
+        if instance is None:
+            instance = _shared[key] = CachedEmbeddings(embeddings, cache_dir, namespace)
+        return instance
+
+
+def _default_namespace(embeddings: Embeddings) -> str:
+    model = getattr(embeddings, "model", None)
+    return f"{type(embeddings).__name__}-{model}" if model else type(embeddings).__name__
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", name)
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    class _SlowEmbeddings(Embeddings):
+        """模拟一次网络往返 50ms 的嵌入模型"""
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            time.sleep(0.05)
+            return [np.random.default_rng(abs(hash(t)) % 2**32).random(256).tolist() for t in texts]
+
+        def embed_query(self, text: str) -> List[float]:
+            return self.embed_documents([text])[0]
+
+    queries = ["你叫什么名字", "你多大了", "what's your name", "今天吃什么"] * 50
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        for q in queries:
+            _SlowEmbeddings().embed_query(q)
+        print(f"[before] uncached: {(time.perf_counter() - start) / len(queries) * 1000:.2f} ms/query")
+
+        cached = CachedEmbeddings(_SlowEmbeddings(), Path(tmp))
+        start = time.perf_counter()
+        for q in queries:
+            cached.embed_query(q)
+        print(f"[after ] cached:   {(time.perf_counter() - start) / len(queries) * 1000:.2f} ms/query")
+        cached.close()
+
+        # 重启后从磁盘命中
+        reopened = CachedEmbeddings(_SlowEmbeddings(), Path(tmp))
+        reopened.embed_documents(queries[:4])
+        print(reopened.stats())
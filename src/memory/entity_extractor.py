@@ -0,0 +1,243 @@
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.utils.metrics import DurationStats
+
+# 提取结果的回调：(user_id, 合并后的新字段)
+ApplyCallback = Callable[[str, Dict[str, Any]], None]
+
+ENTITY_PROMPT = """
+从以下用户和{vtuber_name}的多轮对话中，如果能提取到用户的个人信息，请以JSON形式给出：
+可能的字段包括 name, preference, birthday, background, relationship。
+同一字段出现多次时以最后一次为准。如果没有新信息，返回空JSON。
+
+{dialogue}
+"""
+
+
+@dataclass
+class Cadence:
+    """某个用户多久提取一次：攒够 turns 轮，或者最早一轮等了 max_delay 秒"""
+    turns: int = 5
+    max_delay: float = 30.0
+
+
+@dataclass
+class _Pending:
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    first_at: float = 0.0
+    attempts: int = 0  # 这批已经失败过几次
+    retry_at: float = 0.0  # 失败后退避，到这个时间之前不重试
+
+
+class EntityExtractor:
+    """
+    后台批量提取用户实体信息，不占回复路径。
+    submit() 只把一轮对话记到该用户的待处理列表里；后台线程按用户的节奏（Cadence）
+    把攒下的多轮对话拼成一次 LLM 调用，解析出的 JSON 合并后通过 apply 回调一次性写回。
+    提取按批次串行执行，同一用户的结果按对话顺序写回；提取期间新来的对话留到下一批。
+    LLM 调用失败时这批对话原样放进该用户的重试槽，按指数退避重试，最多 max_retries 次；
+    新来的对话不并进去（不继承它的失败次数），而是等重试的这批有了结果（成功或丢弃）再提取，
+    保证较早的对话先写回。close() 会反复 flush 直到没有待处理的对话，返回最终丢弃的轮数。
+    """
+
+    def __init__(
+        self,
+        llm: Any,
+        vtuber_name: str,
+        apply: ApplyCallback,
+        default_cadence: Optional[Cadence] = None,
+        poll_interval: float = 1.0,
+        max_retries: int = 3,
+        retry_delay: float = 5.0,
+    ):
+        self.llm = llm
+        self.vtuber_name = vtuber_name
+        self._apply = apply
+        self.default_cadence = default_cadence or Cadence()
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._cadences: Dict[str, Cadence] = {}
+        self._pending: Dict[str, _Pending] = {}
+        self._retries: Dict[str, _Pending] = {}  # 失败待重试的批次，每个用户最多一批
+        self._lock = threading.Lock()
+        self._extract_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        # 指标（计数器在 self._lock 下更新，后台线程和 flush() 的调用方都会写）
+        self.lag = DurationStats()  # 一批里最早一轮对话到结果写回的耗时
+        self.call_latency = DurationStats()
+        self.calls = 0
+        self.failed_calls = 0
+        self.dropped_turns = 0
+        self.turns_extracted = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def set_cadence(self, user_id: str, turns: int, max_delay: float) -> None:
+        with self._lock:
+            self._cadences[user_id] = Cadence(turns, max_delay)
+        self._wake.set()
+
+    def submit(self, user_id: str, user_input: str, response: str) -> None:
+        with self._lock:
+            pending = self._pending.get(user_id)
+            if pending is None:
+                pending = self._pending[user_id] = _Pending(first_at=time.monotonic())
+            pending.turns.append((user_input, response))
+            due = len(pending.turns) >= self._cadence(user_id).turns
+        if due:
+            self._wake.set()
+
+    def pending_turns(self) -> int:
+        with self._lock:
+            return self._pending_turns()
+
+    def flush(self) -> None:
+        """在当前线程把所有待处理的对话立刻提取一轮（不等重试的退避时间）"""
+        with self._extract_lock:
+            for user_id, pending in self._take(force=True):
+                self._extract(user_id, pending)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending_turns = self._pending_turns()
+            calls = self.calls
+            counters = {
+                "failed_calls": self.failed_calls,
+                "dropped_turns": self.dropped_turns,
+                "turns_extracted": self.turns_extracted,
+                "turns_per_call": round(self.turns_extracted / calls, 2) if calls else 0.0,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+        return {
+            "pending_turns": pending_turns,
+            "calls": calls,
+            **counters,
+            "lag_s_avg": round(self.lag.mean(), 2),
+            "lag_s_p95": round(self.lag.percentile(95), 2),
+            "call_latency_s_avg": round(self.call_latency.mean(), 2),
+        }
+
+    def close(self) -> int:
+        """
+        停止后台线程，反复 flush 直到没有待处理的对话：失败的批次会立即重试，
+        用完 max_retries 次就丢弃。返回关闭过程中丢弃的轮数，并打印出来。
+        """
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            dropped_before = self.dropped_turns
+        while self.pending_turns():
+            self.flush()
+        with self._lock:
+            lost = self.dropped_turns - dropped_before
+        if lost:
+            print(f"[EntityExtractor] {lost} turns could not be extracted before close")
+        return lost
+
+    def _cadence(self, user_id: str) -> Cadence:
+        return self._cadences.get(user_id, self.default_cadence)
+
+    def _pending_turns(self) -> int:
+        return (
+            sum(len(p.turns) for p in self._pending.values())
+            + sum(len(p.turns) for p in self._retries.values())
+        )
+
+    def _take(self, force: bool = False) -> List[Tuple[str, _Pending]]:
+        """取出到期的批次，每个用户最多一批：有待重试的先重试，重试有结果之前不取新对话"""
+        now = time.monotonic()
+        with self._lock:
+            batches = [
+                (user_id, self._retries.pop(user_id))
+                for user_id, retry in list(self._retries.items())
+                if force or now >= retry.retry_at
+            ]
+            due = [
+                user_id for user_id, pending in self._pending.items()
+                if user_id not in self._retries
+                and not any(user_id == taken for taken, _ in batches)
+                and (
+                    force
+                    or len(pending.turns) >= self._cadence(user_id).turns
+                    or now - pending.first_at >= self._cadence(user_id).max_delay
+                )
+            ]
+            return batches + [(user_id, self._pending.pop(user_id)) for user_id in due]
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._extract_lock:
+                for user_id, pending in self._take():
+                    self._extract(user_id, pending)
+
+    def _extract(self, user_id: str, pending: _Pending) -> None:
+        dialogue = "\n".join(
+            f"用户: {user_input}\n{self.vtuber_name}: {response}"
+            for user_input, response in pending.turns
+        )
+        prompt = ENTITY_PROMPT.format(vtuber_name=self.vtuber_name, dialogue=dialogue)
+
+        start = time.monotonic()
+        try:
+            result = self.llm.invoke(prompt)
+        except Exception as e:
+            print(f"[EntityExtractor] Extraction failed for {user_id}: {e}")
+            self._requeue(user_id, pending)
+            return
+        finally:
+            self.call_latency.record(time.monotonic() - start)
+
+        usage = getattr(result, "usage_metadata", None) or {}
+        with self._lock:
+            self.calls += 1
+            self.turns_extracted += len(pending.turns)
+            self.prompt_tokens += usage.get("input_tokens", 0)
+            self.completion_tokens += usage.get("output_tokens", 0)
+
+        data = self._parse(getattr(result, "content", result))
+        if data:
+            try:
+                self._apply(user_id, data)
+            except Exception as e:
+                print(f"[EntityExtractor] Apply failed for {user_id}: {e}")
+        self.lag.record(time.monotonic() - pending.first_at)
+
+    def _requeue(self, user_id: str, pending: _Pending) -> None:
+        """失败的批次原样放进重试槽，新来的对话留在 _pending 里不受影响；超过重试次数就丢弃"""
+        with self._lock:
+            self.failed_calls += 1
+            attempts = pending.attempts + 1
+            if attempts > self.max_retries:
+                self.dropped_turns += len(pending.turns)
+                print(f"[EntityExtractor] Dropped {len(pending.turns)} turns for {user_id} after {self.max_retries} retries")
+                return
+            pending.attempts = attempts
+            pending.retry_at = time.monotonic() + self.retry_delay * 2 ** (attempts - 1)
+            self._retries[user_id] = pending
+
+    @staticmethod
+    def _parse(text: str) -> Dict[str, Any]:
+        start_idx = text.find("{")
+        end_idx = text.rfind("}") + 1
+        if start_idx < 0 or end_idx <= start_idx:
+            return {}
+        try:
+            data = json.loads(text[start_idx:end_idx])
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
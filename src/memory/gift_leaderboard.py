@@ -0,0 +1,149 @@
+import heapq
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+# 金额是浮点数，窗口过期减回去以后可能剩一点误差，低于它就算清零
+_EPSILON = 1e-9
+
+
+class Leaderboard:
+    """
+    增量维护的礼物排行榜。
+    _scores 记录每个用户当前的金额，_heap 是懒删除的最大堆（存负金额）：
+    金额每变一次就压一条新记录，取榜时和 _scores 对不上的旧记录直接丢弃，
+    旧记录太多时整体重建。单次更新 O(log n)，取前 k 名摊还 O(k log n)。
+    """
+
+    def __init__(self):
+        self._scores: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._scores
+
+    def load(self, entries: Iterable[Tuple[str, float]]) -> None:
+        """批量载入 (user_id, 金额)，金额为 0 的不上榜"""
+        with self._lock:
+            for user_id, amount in entries:
+                if amount:
+                    self.total += amount - self._scores.get(user_id, 0)
+                    self._scores[user_id] = amount
+            self._rebuild()
+
+    def add(self, user_id: str, amount: float) -> float:
+        """给用户加 amount（可为负），返回新的金额"""
+        with self._lock:
+            return self._add(user_id, amount)
+
+    def get(self, user_id: str) -> float:
+        return self._scores.get(user_id, 0)
+
+    def top(self, count: int) -> List[Tuple[str, float]]:
+        """金额最高的前 count 个 (user_id, 金额)"""
+        with self._lock:
+            picked: List[Tuple[float, str]] = []
+            seen = set()
+            while self._heap and len(picked) < count:
+                entry = heapq.heappop(self._heap)
+                # 金额变回之前的值时堆里会有两条一样的记录，只留一条
+                if entry[1] not in seen and self._scores.get(entry[1]) == -entry[0]:
+                    seen.add(entry[1])
+                    picked.append(entry)
+            for entry in picked:
+                heapq.heappush(self._heap, entry)
+            return [(user_id, -neg_amount) for neg_amount, user_id in picked]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scores.clear()
+            self._heap.clear()
+            self.total = 0
+
+    def _add(self, user_id: str, amount: float) -> float:
+        score = self._scores.get(user_id, 0) + amount
+        self.total += amount
+        if score > _EPSILON:
+            self._scores[user_id] = score
+            heapq.heappush(self._heap, (-score, user_id))
+            if len(self._heap) > 2 * len(self._scores) + 64:
+                self._rebuild()
+        else:
+            # 堆里的记录留到弹出时再丢
+            self._scores.pop(user_id, None)
+        return score
+
+    def _rebuild(self) -> None:
+        self._heap = [(-score, user_id) for user_id, score in self._scores.items()]
+        heapq.heapify(self._heap)
+
+
+class WindowedLeaderboard(Leaderboard):
+    """
+    只统计最近 window_seconds 秒内礼物的排行榜（上播时点名感谢用）。
+    礼物按时间顺序进队列，过期时从用户金额里减掉，减完同样压一条新堆记录。
+    每条礼物只进出队列各一次，摊还 O(log n)。
+    """
+
+    def __init__(self, window_seconds: float = 600):
+        super().__init__()
+        self.window_seconds = window_seconds
+        self._events: Deque[Tuple[float, str, float]] = deque()
+
+    def add(self, user_id: str, amount: float, ts: Optional[float] = None) -> float:
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self._expire(ts)
+            self._events.append((ts, user_id, amount))
+            return self._add(user_id, amount)
+
+    def top(self, count: int, now: Optional[float] = None) -> List[Tuple[str, float]]:
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+        return super().top(count)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events.clear()
+        super().clear()
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._events and self._events[0][0] < cutoff:
+            _, user_id, amount = self._events.popleft()
+            self._add(user_id, -amount)
+
+
+def _benchmark(users: int = 5000, gifts: int = 20000) -> None:
+    """对比每个礼物全量求和 + 排序取前 10 和维护排行榜的耗时"""
+    import random
+
+    gift_memory = {f"user_{i}": {"current_livestream_money": 0} for i in range(users)}
+    events = [(f"user_{random.randrange(users)}", random.choice([1, 10, 100])) for _ in range(gifts)]
+
+    start = time.perf_counter()
+    for user_id, value in events:
+        gift_memory[user_id]["current_livestream_money"] += value
+        sum(g["current_livestream_money"] for g in gift_memory.values())
+        sorted(gift_memory.items(), key=lambda kv: kv[1]["current_livestream_money"], reverse=True)[:10]
+    scan_elapsed = time.perf_counter() - start
+
+    board = Leaderboard()
+    start = time.perf_counter()
+    for user_id, value in events:
+        board.add(user_id, value)
+        board.top(10)
+    board_elapsed = time.perf_counter() - start
+
+    print(f"[before] sum + sort ({users} users): {gifts / scan_elapsed:,.0f} gifts/s")
+    print(f"[after ] leaderboard:               {gifts / board_elapsed:,.0f} gifts/s")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -1,8 +1,15 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import Hashable, List, Dict, Optional
 
 
 class MemoryRetriever(ABC):
     @abstractmethod
     def retrieve(self, query: str, k: int = 3) -> List[Dict]:
         ...
+
+    def corpus_version(self) -> Optional[Hashable]:
+        """
+        检索语料的版本，语料变了（save() 追加、重建索引）返回值就跟着变，供缓存判断是否失效。
+        语料建好后不再变化的检索器用默认的 None。
+        """
+        return None
@@ -4,6 +4,7 @@ import hashlib
 from elasticsearch import Elasticsearch
 from langchain_openai import OpenAIEmbeddings
 from langchain_elasticsearch import ElasticsearchStore
+from src.memory.embedding_cache import cached_embeddings
 from src.memory.long_term.memory_documents import docs
 from src.memory.long_term.base import MemoryRetriever
 from src.utils.dev_modes import is_dev
@@ -26,11 +27,12 @@ class LongTermMemoryES(MemoryRetriever):
     ):
         self.threshold = threshold
         self.index_name = index_name
+        self._version = 0  # 本进程里写入/重建索引的次数
         self.es = Elasticsearch(
             es_url,
             basic_auth=(es_user, es_password)
         )
-        self.embeddings = OpenAIEmbeddings(model=embedding_model)
+        self.embeddings = cached_embeddings(OpenAIEmbeddings(model=embedding_model))
         self.vector_store = ElasticsearchStore(
             es_url=es_url,
             index_name=index_name,
@@ -55,6 +57,7 @@ class LongTermMemoryES(MemoryRetriever):
     def _init_index(self):
         ids = [self._get_id(doc.page_content) for doc in docs]
         self.vector_store.add_documents(docs, ids=ids)
+        self._version += 1
         print(f"[向量库] 已写入 {len(docs)} 条文档到索引 '{self.index_name}'")
 
     def reset_index(self):
@@ -63,6 +66,9 @@ class LongTermMemoryES(MemoryRetriever):
             print(f"[向量库] 已删除索引 '{self.index_name}'")
         self._init_index()
 
+    def corpus_version(self) -> int:
+        return self._version
+
     def retrieve(self, query: str, k=3):
         results = self.vector_store.similarity_search_with_score(query, k=k)
         res = [
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.memory.long_term.base import MemoryRetriever
+from src.memory.long_term.memory_documents import docs_en
+from src.utils.docs_change_detect import get_docs_fingerprint
+from src.utils.path import find_project_root
+
+Tokenizer = Callable[[str], List[str]]
+
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+_CJK_RUN_RE = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+")
+_CJK_CHAR_RE = re.compile(rf"[{_CJK}]")
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def whitespace_tokenizer(text: str) -> List[str]:
+    """按空白和标点切词，转小写"""
+    return _WORD_RE.findall(text.lower())
+
+
+def cjk_bigram_tokenizer(text: str) -> List[str]:
+    """
+    中日韩文字切成相邻两字的 bigram（单字成段时保留单字），其余按单词切。
+    和 ES 的 cjk 分析器思路一样，不需要词典，中英混排也能用。
+    """
+    tokens: List[str] = []
+    for run in _CJK_RUN_RE.findall(text.lower()):
+        if _CJK_CHAR_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+TOKENIZERS: Dict[str, Tokenizer] = {
+    "cjk_bigram": cjk_bigram_tokenizer,
+    "whitespace": whitespace_tokenizer,
+}
+
+
+class BM25Memory(MemoryRetriever):
+    """
+    进程内的 BM25 长期记忆，可以替代走 Elasticsearch 的 FastLongTermMemory。
+    建索引时把每个词的倒排表（文档号 + 预先算好的 BM25 权重）拼成 CSR 形式的三个数组，
+    查询时每个词只做一次切片加到分数向量上，再用 argpartition 取 top-k。
+    索引按文档指纹持久化到 npz，文档没变时启动直接加载。
+    save() 追加的文档（内容和 metadata）也存在同一个 npz 里，重启时先补回 documents 再校验指纹，
+    所以调用方传入的语料变了、索引需要重建时，之前追加的文档也不会丢。
+    每条结果带 coverage：查询里按 idf 加权后有多大比例的词出现在这篇文档里，0~1，
+    语料里没有的词按 df=0 的 idf 计入分母。BM25 分数没有上限、随语料大小变化，
+    coverage 可以跨语料比较，min_coverage 给词法结果一个相关度下限。
+    """
+
+    def __init__(
+            self,
+            documents: Optional[List[Document]] = None,
+            index_name: str = "chat_memory",
+            tokenizer: str = "cjk_bigram",
+            k1: float = 1.2,
+            b: float = 0.75,
+            min_score: float = 0.0,
+            min_coverage: float = 0.0,
+            index_path: Optional[Path] = None,
+    ):
+        self.documents = list(docs_en if documents is None else documents)
+        self.tokenizer_name = tokenizer
+        self.tokenize = TOKENIZERS[tokenizer]
+        self.k1 = k1
+        self.b = b
+        self.min_score = min_score
+        self.min_coverage = min_coverage
+        self.index_path = Path(
+            index_path or find_project_root() / f"src/runtime/storage/bm25_{index_name}.npz"
+        )
+
+        self._saved: List[Document] = []  # save() 追加的文档，和索引一起持久化
+        self._version = 0  # 每次重建索引加一
+        self._vocab: Dict[str, int] = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._doc_ids = np.zeros(0, dtype=np.int32)
+        self._weights = np.zeros(0, dtype=np.float32)
+        if not self._load():
+            self._build()
+            self._persist()
+
+    def retrieve(self, query: str, k: int = 3) -> List[Dict]:
+        if not self.documents:
+            return []
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        matched = np.zeros(len(self.documents), dtype=np.float32)
+        n_docs = len(self.documents)
+        total_idf = 0.0
+        for term, qtf in Counter(self.tokenize(query)).items():
+            term_id = self._vocab.get(term)
+            df = 0 if term_id is None else int(self._indptr[term_id + 1] - self._indptr[term_id])
+            idf = qtf * float(np.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+            total_idf += idf
+            if term_id is None:
+                continue
+            start, end = self._indptr[term_id], self._indptr[term_id + 1]
+            # 同一个词的倒排表里文档号不重复，可以直接按下标累加
+            doc_ids = self._doc_ids[start:end]
+            scores[doc_ids] += qtf * self._weights[start:end]
+            matched[doc_ids] += idf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if score <= self.min_score:
+                break
+            coverage = float(matched[i]) / total_idf
+            if coverage < self.min_coverage:
+                continue
+            doc = self.documents[int(i)]
+            results.append({
+                "score": round(score, 4),
+                "coverage": round(coverage, 4),
+                "content": doc.page_content,
+                "metadata": doc.metadata
+            })
+        return results
+
+    def save(self, docs: List[Document]):
+        """追加文档（内容重复的跳过）、重建索引并落盘，接口和 FastLongTermMemory.save 一致"""
+        seen = {doc.page_content for doc in self.documents}
+        new_docs = []
+        for doc in docs:
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                new_docs.append(doc)
+        if not new_docs:
+            return
+        self.documents.extend(new_docs)
+        self._saved.extend(new_docs)
+        self._build()
+        self._persist()
+
+    def reload_index(self):
+        self._build()
+        self._persist()
+
+    def corpus_version(self) -> int:
+        return self._version
+
+    def _build(self) -> None:
+        self._version += 1
+        postings: Dict[str, List[tuple]] = {}
+        lengths = np.zeros(len(self.documents), dtype=np.float32)
+        for doc_id, doc in enumerate(self.documents):
+            counts = Counter(self.tokenize(doc.page_content))
+            lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        n_docs = len(self.documents)
+        avgdl = float(lengths.mean()) if n_docs else 0.0
+        self._vocab = {term: i for i, term in enumerate(postings)}
+        indptr = [0]
+        doc_ids: List[int] = []
+        weights: List[float] = []
+        for term, entries in postings.items():
+            df = len(entries)
+            idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in entries:
+                norm = self.k1 * (1 - self.b + self.b * lengths[doc_id] / avgdl)
+                doc_ids.append(doc_id)
+                weights.append(idf * tf * (self.k1 + 1) / (tf + norm))
+            indptr.append(len(doc_ids))
+
+        self._indptr = np.asarray(indptr, dtype=np.int64)
+        self._doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        self._weights = np.asarray(weights, dtype=np.float32)
+
+    def _signature(self) -> str:
+        """文档内容、顺序和建索引参数都一致时才能复用持久化的索引"""
+        order = "\n".join(doc.page_content for doc in self.documents)
+        return json.dumps({
+            "fingerprint": get_docs_fingerprint(self.documents),
+            "order": hashlib.md5(order.encode("utf-8")).hexdigest(),
+            "tokenizer": self.tokenizer_name,
+            "k1": self.k1,
+            "b": self.b,
+        }, sort_keys=True)
+
+    def _load(self) -> bool:
+        if not self.index_path.exists():
+            return False
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                if "saved_texts" in data.files:
+                    self._restore_saved(data["saved_texts"].tolist(), data["saved_metadata"].tolist())
+                if str(data["signature"]) != self._signature():
+                    return False
+                self._vocab = {term: i for i, term in enumerate(data["vocab"].tolist())}
+                self._indptr = data["indptr"]
+                self._doc_ids = data["doc_ids"]
+                self._weights = data["weights"]
+        except Exception as e:
+            print(f"[BM25Memory] Failed to load index, rebuilding: {e}")
+            return False
+        return True
+
+    def _restore_saved(self, texts: List[str], metadata: List[str]) -> None:
+        """补回上次 save() 追加的文档；已经在调用方语料里的跳过"""
+        seen = {doc.page_content for doc in self.documents}
+        for text, meta in zip(texts, metadata):
+            if text in seen:
+                continue
+            seen.add(text)
+            doc = Document(page_content=text, metadata=json.loads(meta))
+            self.documents.append(doc)
+            self._saved.append(doc)
+
+    def _persist(self) -> None:
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        # np.savez 会自动补 .npz 后缀，先写到同目录的临时文件再替换
+        tmp_path = self.index_path.with_name(self.index_path.stem + ".tmp.npz")
+        np.savez(
+            tmp_path,
+            signature=np.array(self._signature()),
+            vocab=np.array(list(self._vocab), dtype=str),
+            indptr=self._indptr,
+            doc_ids=self._doc_ids,
+            weights=self._weights,
+            saved_texts=np.array([doc.page_content for doc in self._saved], dtype=str),
+            saved_metadata=np.array(
+                [json.dumps(doc.metadata, ensure_ascii=False, default=str) for doc in self._saved], dtype=str
+            ),
+        )
+        tmp_path.replace(self.index_path)
+
+
+if __name__ == "__main__":
+    from src.memory.long_term.memory_documents import docs
+
+    for name, corpus, tokenizer, query in (
+        ("chat_memory", docs_en, "whitespace", "what's your name"),
+        ("chat_memory_zh", docs, "cjk_bigram", "你叫什么名字"),
+    ):
+        start = time.perf_counter()
+        memory = BM25Memory(documents=corpus, index_name=name, tokenizer=tokenizer)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            results = memory.retrieve(query, k=3)
+        per_query = (time.perf_counter() - start) / 1000
+        print(f"[{name}] startup {build * 1000:.1f} ms, retrieve {per_query * 1000:.3f} ms/query")
+        print("results", results)
@@ -12,6 +12,7 @@ class FastLongTermMemory(MemoryRetriever):
     def __init__(self, index_name="chat_memory", es_url="http://localhost:9200"):
         self.index_name = index_name
         self.es = Elasticsearch(es_url)
+        self._version = 0  # 本进程里 save()/reload_index() 改动索引的次数
         self._create_index_if_needed()
 
     def _create_index_if_needed(self):
@@ -44,6 +45,7 @@ class FastLongTermMemory(MemoryRetriever):
                     "metadata": doc.metadata
                 }
             )
+            self._version += 1
 
     def retrieve(self, query: str, k: int = 3) -> List[dict]:
         body = {
@@ -73,6 +75,10 @@ class FastLongTermMemory(MemoryRetriever):
         if self.es.indices.exists(index=self.index_name):
             self.es.indices.delete(index=self.index_name)
         self._create_index_if_needed()
+        self._version += 1
+
+    def corpus_version(self) -> int:
+        return self._version
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+import hashlib
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+from src.memory.long_term.base import MemoryRetriever
+
+
+class HybridRetriever(MemoryRetriever):
+    """
+    词法 + 向量的混合检索。
+    两路检索并发执行，各取 candidates 条，用倒数排名融合（RRF）合并：
+    rrf_score = Σ 1 / (rrf_k + rank)，同一内容（按内容哈希）在两路里的得分相加，按它排序。
+    返回的 "score" 仍是相关度：有向量一路的结果时用余弦分数（和其他后端同一量纲），
+    只有词法命中时用 BM25 分数；各路原始分数在 "leg_scores" 里。
+    设置了 short_circuit_score 时先给词法一路 lexical_wait 秒：
+    它已经返回且第一名足够确定，就不再启动向量一路，省掉一次 embedding 调用；否则两路照常并发。
+    "足够确定"看的是词法结果的 coverage（BM25Memory 给出的 0~1 查询覆盖率，不随语料大小漂移）
+    不低于 short_circuit_score，并且 BM25 分数是第二名的 short_circuit_margin 倍以上。
+    只有一条命中时没有第二名可比，要求 coverage 达到 short_circuit_margin 倍的门槛（最高 1.0）；
+    没有 coverage 的词法后端不会短路。
+    """
+
+    def __init__(
+            self,
+            lexical: MemoryRetriever,
+            vector: MemoryRetriever,
+            rrf_k: int = 60,
+            candidates: int = 10,
+            short_circuit_score: Optional[float] = None,
+            short_circuit_margin: float = 1.5,
+            lexical_wait: float = 0.05,
+    ):
+        self.lexical = lexical
+        self.vector = vector
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        self.short_circuit_score = short_circuit_score
+        self.short_circuit_margin = short_circuit_margin
+        self.lexical_wait = lexical_wait
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-ltm")
+
+        self.queries = 0
+        self.short_circuits = 0
+
+    def retrieve(self, query: str, k: int = 3) -> List[Dict]:
+        self.queries += 1
+        lexical_future = self._pool.submit(self.lexical.retrieve, query, self.candidates)
+        lexical_hits: Optional[List[Dict]] = None
+
+        if self.short_circuit_score is not None:
+            wait([lexical_future], timeout=self.lexical_wait)
+            if lexical_future.done():
+                lexical_hits = self._result(lexical_future, "lexical")
+                if self._is_confident(lexical_hits):
+                    self.short_circuits += 1
+                    return self._fuse([("lexical", lexical_hits)], k)
+
+        vector_future = self._pool.submit(self.vector.retrieve, query, self.candidates)
+        if lexical_hits is None:
+            lexical_hits = self._result(lexical_future, "lexical")
+        return self._fuse([
+            ("lexical", lexical_hits),
+            ("vector", self._result(vector_future, "vector")),
+        ], k)
+
+    def corpus_version(self):
+        return self.lexical.corpus_version(), self.vector.corpus_version()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queries": self.queries,
+            "short_circuits": self.short_circuits,
+            "short_circuit_rate": round(self.short_circuits / self.queries, 4) if self.queries else 0.0,
+        }
+
+    def _is_confident(self, hits: List[Dict]) -> bool:
+        if not hits:
+            return False
+        coverage = hits[0].get("coverage", 0.0)
+        if len(hits) < 2:
+            return coverage >= min(1.0, self.short_circuit_margin * self.short_circuit_score)
+        if coverage < self.short_circuit_score:
+            return False
+        return hits[0]["score"] >= self.short_circuit_margin * hits[1]["score"]
+
+    @staticmethod
+    def _result(future: Future, leg: str) -> List[Dict]:
+        # 一路失败时用另一路的结果
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"[HybridRetriever] {leg} retrieval failed: {e}")
+            return []
+
+    def _fuse(self, legs: List[tuple], k: int) -> List[Dict]:
+        fused: Dict[str, Dict] = {}
+        for leg, hits in legs:
+            for rank, hit in enumerate(hits, start=1):
+                key = hashlib.md5(hit["content"].encode("utf-8")).hexdigest()
+                entry = fused.get(key)
+                if entry is None:
+                    entry = fused[key] = {
+                        "score": 0.0,
+                        "rrf_score": 0.0,
+                        "content": hit["content"],
+                        "metadata": hit["metadata"],
+                        "leg_scores": {},
+                    }
+                # 同一路里重复的内容只记最靠前的那次
+                if leg in entry["leg_scores"]:
+                    continue
+                entry["leg_scores"][leg] = hit["score"]
+                entry["rrf_score"] += 1.0 / (self.rrf_k + rank)
+
+        ranked = sorted(fused.values(), key=lambda entry: entry["rrf_score"], reverse=True)[:k]
+        for entry in ranked:
+            leg_scores = entry["leg_scores"]
+            entry["score"] = leg_scores.get("vector", leg_scores.get("lexical", 0.0))
+            entry["rrf_score"] = round(entry["rrf_score"], 4)
+        return ranked
+
+
+if __name__ == "__main__":
+    from src.memory.long_term.fast_search.bm25_search import BM25Memory
+    from src.memory.long_term.memory_documents import docs
+    from src.memory.long_term.vector_search.vector_search import LocalVectorMemory
+
+    hybrid = HybridRetriever(
+        BM25Memory(documents=docs, index_name="ltm_docs"),
+        LocalVectorMemory(threshold=0.6),
+        short_circuit_score=0.6,
+    )
+    for q in ["你叫什么名字", "你的创造者Whisper", "今天天气怎么样", "有什么好吃的推荐吗"]:
+        start = time.perf_counter()
+        results = hybrid.retrieve(q, k=3)
+        print(f"{q}: {(time.perf_counter() - start) * 1000:.1f} ms")
+        print(results)
+    print(hybrid.stats())
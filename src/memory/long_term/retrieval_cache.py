@@ -0,0 +1,110 @@
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from src.memory.long_term.base import MemoryRetriever
+from src.utils.docs_change_detect import get_docs_fingerprint
+from src.utils.lru_cache import BoundedLRU
+
+
+def normalize_query(query: str) -> str:
+    """
+    缓存键用的查询归一化：NFKC 统一全角/半角，casefold 忽略大小写，
+    去掉所有标点、符号和空白。"你叫什么名字？" 和 "你叫什么名字" 算同一个问题。
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    return "".join(
+        ch for ch in text
+        if not ch.isspace() and unicodedata.category(ch)[0] not in ("P", "S")
+    )
+
+
+class CachedRetriever(MemoryRetriever):
+    """
+    放在任意 MemoryRetriever 前面的检索结果缓存。
+    键是 (归一化后的查询, k)，条目有 TTL，总数按 LRU 限制。
+    每隔 fingerprint_interval 秒看一次被包装的检索器的语料有没有变，变了就清空缓存：
+    检索器实现了 corpus_version() 就比较它（BM25Memory.save()、写 ES 都会改变它）；
+    否则对 documents（没传时取 retriever.documents）算指纹（和 has_docs_changed 用的是同一个
+    get_docs_fingerprint，但不读写它的指纹文件）。两者都没有时只靠 TTL 过期。
+    """
+
+    def __init__(
+            self,
+            retriever: MemoryRetriever,
+            ttl: float = 600.0,
+            max_entries: int = 2048,
+            documents: Optional[List[Document]] = None,
+            fingerprint_interval: float = 5.0,
+    ):
+        self.retriever = retriever
+        self.ttl = ttl
+        # 列表按引用保存，原地追加的文档也会反映到指纹里
+        if documents is None:
+            documents = getattr(retriever, "documents", None)
+        self.documents = documents
+        self.fingerprint_interval = fingerprint_interval
+
+        self._cache: BoundedLRU[Tuple[str, int], Tuple[float, List[Dict]]] = BoundedLRU(max_entries)
+        self._fingerprint = self._corpus_state()
+        self._checked_at = time.monotonic()
+        self.expired = 0
+        self.invalidations = 0
+
+    def retrieve(self, query: str, k: int = 3) -> List[Dict]:
+        self._check_fingerprint()
+        key = (normalize_query(query), k)
+        now = time.monotonic()
+
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires_at, results = entry
+            if expires_at > now:
+                return [dict(result) for result in results]
+            self.expired += 1
+            self._cache.pop(key)
+
+        results = self.retriever.retrieve(query, k=k)
+        self._cache.put(key, (now + self.ttl, [dict(result) for result in results]))
+        return results
+
+    def invalidate(self) -> None:
+        for key in self._cache.keys():
+            self._cache.pop(key)
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        # 过期的条目在 LRU 里记成了命中，这里按未命中算
+        hits = self._cache.hits - self.expired
+        misses = self._cache.misses + self.expired
+        total = hits + misses
+        return {
+            "entries": len(self._cache),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "evictions": self._cache.evictions,
+            "expired": self.expired,
+            "invalidations": self.invalidations,
+        }
+
+    def _check_fingerprint(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.fingerprint_interval:
+            return
+        self._checked_at = now
+        fingerprint = self._corpus_state()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.invalidate()
+            print("[CachedRetriever] 记忆文档有变更，已清空检索缓存")
+
+    def _corpus_state(self) -> Any:
+        version = self.retriever.corpus_version()
+        if version is not None:
+            return version
+        if self.documents is not None:
+            return get_docs_fingerprint(self.documents)
+        return None
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from src.memory.embedding_cache import cached_embeddings
+from src.memory.long_term.base import MemoryRetriever
+from src.memory.long_term.memory_documents import docs
+from src.utils.docs_change_detect import get_docs_fingerprint
+from src.utils.path import find_project_root
+
+load_dotenv()
+
+
+class _IVFIndex:
+    """
+    粗聚类倒排索引（IVF）：用几轮 k-means 把向量分到 n_lists 个簇，
+    查询时只在离查询最近的 n_probe 个簇里精确打分。语料很大时才启用，结果是近似的。
+    """
+
+    def __init__(self, matrix: np.ndarray, n_lists: int, n_probe: int, iterations: int = 8, seed: int = 0):
+        self.n_probe = min(n_probe, n_lists)
+        rng = np.random.default_rng(seed)
+        centroids = matrix[rng.choice(len(matrix), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(matrix @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = matrix[assign == i]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[i] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self.centroids = centroids
+        assign = np.argmax(matrix @ centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assign == i) for i in range(n_lists)]
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        nearest = np.argpartition(-(self.centroids @ query), self.n_probe - 1)[:self.n_probe]
+        return np.concatenate([self.lists[i] for i in nearest])
+
+
+class LocalVectorMemory(MemoryRetriever):
+    """
+    进程内的向量长期记忆，不需要 Elasticsearch。
+    文档向量归一化后存成 memmap 的 float32 矩阵，top-k 就是一次矩阵乘向量加 argpartition。
+    分数和 ElasticsearchStore 的余弦相似度一致：(1 + cos) / 2，所以 threshold 可以直接沿用。
+    文档指纹、顺序和 embedding 模型都没变时直接打开上次的矩阵，否则重新嵌入（经过共享的 embedding 缓存）；
+    查询向量的维度和矩阵对不上（同名模型换了输出维度）时也会重建。
+    文档数超过 ivf_min_docs 时额外建一个 IVF 近似索引。
+    """
+
+    def __init__(
+            self,
+            threshold: float,
+            documents: Optional[List[Document]] = None,
+            embeddings: Optional[Embeddings] = None,
+            embedding_model: str = "text-embedding-3-large",
+            index_dir: Optional[Path] = None,
+            ivf_min_docs: int = 20000,
+            ivf_probe: int = 8,
+    ):
+        self.threshold = threshold
+        self.documents = docs if documents is None else documents
+        self.embeddings = embeddings or cached_embeddings(OpenAIEmbeddings(model=embedding_model))
+        self.index_dir = Path(index_dir or find_project_root() / "src/runtime/storage/vector_memory")
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.ivf_min_docs = ivf_min_docs
+        self.ivf_probe = ivf_probe
+
+        self._matrix = self._load_or_build()
+        self._ivf = self._build_ivf()
+
+    def retrieve(self, query: str, k: int = 3) -> List[Dict]:
+        if not self.documents:
+            return []
+        q = self._normalize(np.asarray(self.embeddings.embed_query(query), dtype=np.float32))
+        if q.shape[0] != self._matrix.shape[1]:
+            print(f"[LocalVectorMemory] 查询向量维度 {q.shape[0]} 和索引的 {self._matrix.shape[1]} 不一致，重建索引")
+            self._matrix = self._load_or_build(force=True)
+            self._ivf = self._build_ivf()
+        return self.search_vector(q, k)
+
+    def search_vector(self, query_vector: np.ndarray, k: int = 3) -> List[Dict]:
+        """用已经归一化的查询向量检索"""
+        if self._ivf is not None:
+            rows = self._ivf.candidates(query_vector)
+            sims = self._matrix[rows] @ query_vector
+        else:
+            rows = None
+            sims = self._matrix @ query_vector
+
+        k = min(k, len(sims))
+        if k <= 0:
+            return []
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+
+        res = []
+        for i in top:
+            score = (1.0 + float(sims[i])) / 2
+            if score < self.threshold:
+                break
+            doc = self.documents[int(rows[i]) if rows is not None else int(i)]
+            res.append({
+                "score": round(score, 4),
+                "content": doc.page_content,
+                "metadata": doc.metadata
+            })
+        return res
+
+    def _build_ivf(self) -> Optional[_IVFIndex]:
+        if len(self.documents) < self.ivf_min_docs:
+            return None
+        n_lists = int(np.sqrt(len(self.documents)))
+        return _IVFIndex(np.asarray(self._matrix), n_lists, self.ivf_probe)
+
+    def _model_id(self) -> str:
+        """embedding 模型的标识：CachedEmbeddings 的 namespace，否则用类名 + model"""
+        namespace = getattr(self.embeddings, "namespace", None)
+        if namespace:
+            return namespace
+        model = getattr(self.embeddings, "model", None)
+        return f"{type(self.embeddings).__name__}-{model}" if model else type(self.embeddings).__name__
+
+    def _load_or_build(self, force: bool = False) -> np.ndarray:
+        meta_path = self.index_dir / "meta.json"
+        matrix_path = self.index_dir / "vectors.f32"
+        fingerprint = get_docs_fingerprint(self.documents)
+        # 指纹按内容排序计算，矩阵的行和文档按位置对应，所以顺序也要一致
+        order = [doc.page_content for doc in self.documents]
+        order_hash = hashlib.md5("\n".join(order).encode("utf-8")).hexdigest()
+        model = self._model_id()
+
+        if not force and meta_path.exists() and matrix_path.exists():
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            # 换了模型的旧矩阵不能用；dim 还要和文件大小对得上，防止读到写了一半的矩阵
+            if (
+                meta.get("fingerprint") == fingerprint
+                and meta.get("order") == order_hash
+                and meta.get("model") == model
+                and meta.get("dim")
+                and matrix_path.stat().st_size == meta["rows"] * meta["dim"] * 4
+            ):
+                return np.memmap(matrix_path, dtype=np.float32, mode="r", shape=(meta["rows"], meta["dim"]))
+
+        if not self.documents:
+            return np.zeros((0, 1), dtype=np.float32)
+
+        print(f"[LocalVectorMemory] 文档或模型有变更，正在用 {model} 嵌入 {len(self.documents)} 条文档...")
+        vectors = np.asarray(self.embeddings.embed_documents(order), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        matrix = np.memmap(matrix_path, dtype=np.float32, mode="w+", shape=vectors.shape)
+        matrix[:] = vectors
+        matrix.flush()
+        meta_path.write_text(json.dumps({
+            "fingerprint": fingerprint,
+            "order": order_hash,
+            "model": model,
+            "rows": vectors.shape[0],
+            "dim": vectors.shape[1],
+        }, ensure_ascii=False), encoding="utf-8")
+        return np.memmap(matrix_path, dtype=np.float32, mode="r", shape=vectors.shape)
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def _benchmark(queries: List[str], threshold: float = 0.68) -> None:
+    """对比 LongTermMemoryES 和 LocalVectorMemory 的单次检索延迟（需要 ES 和 OpenAI key）"""
+    from src.memory.long_term.elastic_search import LongTermMemoryES
+
+    for name, retriever in (
+        ("LongTermMemoryES", LongTermMemoryES(threshold=threshold)),
+        ("LocalVectorMemory", LocalVectorMemory(threshold=threshold)),
+    ):
+        # 第一轮把查询向量放进缓存，第二轮只比检索本身
+        for q in queries:
+            retriever.retrieve(q, k=3)
+        start = time.perf_counter()
+        for q in queries:
+            retriever.retrieve(q, k=3)
+        elapsed = (time.perf_counter() - start) / len(queries)
+        print(f"[{name}] {elapsed * 1000:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    time1 = time.time()
+    ltm = LocalVectorMemory(threshold=0.68)
+    result = ltm.retrieve("你叫什么名字", k=3)
+    time2 = time.time()
+    print(result)
+    print(time2 - time1)
+    _benchmark(["你叫什么名字", "你多大了", "你喜欢吃什么", "你的创造者是谁"])
@@ -0,0 +1,312 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.danmaku.user.persistence_worker import PersistenceWorker
+
+# 库版本（PRAGMA user_version），低于它说明旧的 JSON 文件还没导入
+STORE_SCHEMA_VERSION = 1
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS gifts (
+        user_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS entities (
+        user_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS streams (
+        stream_id TEXT PRIMARY KEY,
+        start_time TEXT NOT NULL,
+        data TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        start_time TEXT NOT NULL,
+        is_active INTEGER NOT NULL,
+        data TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_events_start_time ON events(start_time)",
+    "CREATE INDEX IF NOT EXISTS idx_events_active ON events(start_time) WHERE is_active = 1",
+]
+
+UPSERT_GIFT_SQL = "INSERT OR REPLACE INTO gifts (user_id, data) VALUES (?, ?)"
+UPSERT_ENTITY_SQL = "INSERT OR REPLACE INTO entities (user_id, data) VALUES (?, ?)"
+UPSERT_STREAM_SQL = "INSERT OR REPLACE INTO streams (stream_id, start_time, data) VALUES (?, ?, ?)"
+UPSERT_EVENT_SQL = """
+    INSERT OR REPLACE INTO events (id, name, start_time, is_active, data)
+    VALUES (?, ?, ?, ?, ?)
+"""
+RESET_STREAM_GIFTS_SQL = """
+    UPDATE gifts SET data = json_set(data, '$.current_livestream_money', 0)
+    WHERE json_extract(data, '$.current_livestream_money') != 0
+"""
+SELECT_EVENT_SQL = "SELECT data FROM events WHERE id = ?"
+SELECT_EVENTS_BETWEEN_SQL = """
+    SELECT data FROM events WHERE start_time >= ? AND start_time < ?
+    ORDER BY start_time DESC LIMIT ?
+"""
+SELECT_ACTIVE_EVENTS_SQL = "SELECT data FROM events WHERE is_active = 1 ORDER BY start_time DESC"
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+class VTuberMemoryStore:
+    """
+    VTuberMemorySystem 的 SQLite 持久层，替代每个事件整文件重写的 JSON。
+    礼物、用户实体、直播场次、事件各一张表，每个事件只 upsert 变化的那一行，
+    写操作经由 PersistenceWorker 在后台线程成批提交（WAL，事务保证不会写坏）。
+    数据在调用线程序列化好再入队，后续对内存字典的修改不会影响已入队的写入。
+    snapshot() 用 SQLite 的在线备份导出一份完整副本，VTuberMemorySystem 每场直播结束时调用。
+    """
+
+    def __init__(self, root_dir: Path, max_queue: int = 1000, keep_snapshots: int = 5):
+        self.root_dir = Path(root_dir)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root_dir / "memory.db"
+        self.keep_snapshots = keep_snapshots
+
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+        # journal_mode 会持久化在库文件里，在这里切换一次；改 journal_mode 不等 busy timeout，
+        # 放到各线程的连接里和写线程同时执行会偶发 "database is locked"
+        self.connection().execute("PRAGMA journal_mode=WAL")
+        with self.connection() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        self._migrate_json()
+
+        self.worker = PersistenceWorker(self.connection, max_queue=max_queue)
+
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的长连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, cached_statements=64)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    # ---- 写入 ----
+
+    def save_gift(self, user_id: str, data: Dict[str, Any]) -> None:
+        row = (user_id, _dumps(data))
+        self.worker.submit(lambda conn: conn.execute(UPSERT_GIFT_SQL, row))
+
+    def save_gifts(self, gifts: Dict[str, Dict[str, Any]]) -> None:
+        rows = [(user_id, _dumps(data)) for user_id, data in gifts.items()]
+        self.worker.submit(lambda conn: conn.executemany(UPSERT_GIFT_SQL, rows))
+
+    def reset_stream_gifts(self) -> None:
+        """新一场直播开始，把所有用户的本场礼物金额清零（一条 UPDATE）"""
+        self.worker.submit(lambda conn: conn.execute(RESET_STREAM_GIFTS_SQL))
+
+    def save_entity(self, user_id: str, data: Dict[str, Any]) -> None:
+        row = (user_id, _dumps(data))
+        self.worker.submit(lambda conn: conn.execute(UPSERT_ENTITY_SQL, row))
+
+    def save_entities(self, entities: Dict[str, Dict[str, Any]]) -> None:
+        rows = [(user_id, _dumps(data)) for user_id, data in entities.items()]
+        self.worker.submit(lambda conn: conn.executemany(UPSERT_ENTITY_SQL, rows))
+
+    def save_stream(self, stream_id: str, data: Dict[str, Any]) -> None:
+        row = (stream_id, data.get("start_time") or "", _dumps(data))
+        self.worker.submit(lambda conn: conn.execute(UPSERT_STREAM_SQL, row))
+
+    def save_streams(self, streams: Dict[str, Dict[str, Any]]) -> None:
+        rows = [
+            (stream_id, data.get("start_time") or "", _dumps(data))
+            for stream_id, data in streams.items()
+        ]
+        self.worker.submit(lambda conn: conn.executemany(UPSERT_STREAM_SQL, rows))
+
+    def save_event(self, event: Dict[str, Any]) -> None:
+        row = self._event_row(event)
+        self.worker.submit(lambda conn: conn.execute(UPSERT_EVENT_SQL, row))
+
+    # ---- 读取 ----
+
+    def load_gifts(self) -> Dict[str, Dict[str, Any]]:
+        return self._load_table("SELECT user_id, data FROM gifts")
+
+    def load_entities(self) -> Dict[str, Dict[str, Any]]:
+        return self._load_table("SELECT user_id, data FROM entities")
+
+    def load_streams(self) -> Dict[str, Dict[str, Any]]:
+        return self._load_table("SELECT stream_id, data FROM streams ORDER BY start_time")
+
+    def load_event(self, event_id: str) -> Optional[Dict[str, Any]]:
+        """按 id 取事件，主键查找"""
+        self.worker.flush()
+        row = self.connection().execute(SELECT_EVENT_SQL, (event_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def events_between(self, start: str, end: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """start_time 落在 [start, end) 内的事件，最新的在前；走 start_time 索引"""
+        self.worker.flush()
+        rows = self.connection().execute(SELECT_EVENTS_BETWEEN_SQL, (start, end, limit))
+        return [json.loads(data) for (data,) in rows]
+
+    def active_events(self) -> List[Dict[str, Any]]:
+        self.worker.flush()
+        return [json.loads(data) for (data,) in self.connection().execute(SELECT_ACTIVE_EVENTS_SQL)]
+
+    def _load_table(self, sql: str) -> Dict[str, Dict[str, Any]]:
+        return {key: json.loads(data) for key, data in self.connection().execute(sql)}
+
+    # ---- 快照与关闭 ----
+
+    def snapshot(self) -> Optional[Path]:
+        """把当前库在线备份到 snapshots/ 下，只保留最近 keep_snapshots 份"""
+        snapshot_dir = self.root_dir / "snapshots"
+        snapshot_dir.mkdir(exist_ok=True)
+        path = snapshot_dir / f"memory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+        try:
+            self.worker.flush()
+            target = sqlite3.connect(path)
+            try:
+                self.connection().backup(target)
+            finally:
+                target.close()
+        except Exception as e:
+            print(f"[VTuberMemoryStore] Snapshot failed: {e}")
+            return None
+
+        for old in sorted(snapshot_dir.glob("memory_*.db"))[:-self.keep_snapshots]:
+            old.unlink(missing_ok=True)
+        return path
+
+    def flush(self) -> None:
+        self.worker.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.worker.stats()
+
+    def close(self) -> None:
+        """把队列里的写操作全部落盘后关闭连接"""
+        self.worker.close()
+        with self._conns_lock:
+            for conn in self._conns:
+                try:
+                    conn.close()
+                except sqlite3.ProgrammingError:
+                    pass
+            self._conns.clear()
+
+    # ---- 旧数据迁移 ----
+
+    @staticmethod
+    def _event_row(event: Dict[str, Any]) -> tuple:
+        return (
+            event["id"], event.get("name", ""), event.get("start_time") or "",
+            int(bool(event.get("is_active"))), _dumps(event)
+        )
+
+    def _migrate_json(self) -> None:
+        """
+        把旧版的 gift_memory.json / entities.json / stream_history.json / events/*.json
+        在一个事务里导入，只执行一次。导入后的文件改名为 *.migrated 留作备份。
+        """
+        conn = self.connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= STORE_SCHEMA_VERSION:
+            return
+
+        migrated: List[Path] = []
+        with conn:
+            for filename, sql in (
+                ("gift_memory.json", UPSERT_GIFT_SQL),
+                ("entities.json", UPSERT_ENTITY_SQL),
+            ):
+                path = self.root_dir / filename
+                if path.exists():
+                    data = json.loads(path.read_text(encoding="utf-8"))
+                    conn.executemany(sql, [(key, _dumps(value)) for key, value in data.items()])
+                    migrated.append(path)
+
+            path = self.root_dir / "stream_history.json"
+            if path.exists():
+                streams = json.loads(path.read_text(encoding="utf-8"))
+                conn.executemany(UPSERT_STREAM_SQL, [
+                    (stream_id, data.get("start_time") or "", _dumps(data))
+                    for stream_id, data in streams.items()
+                ])
+                migrated.append(path)
+
+            events_dir = self.root_dir / "events"
+            if events_dir.is_dir():
+                for path in sorted(events_dir.glob("*.json")):
+                    try:
+                        event = json.loads(path.read_text(encoding="utf-8"))
+                        conn.execute(UPSERT_EVENT_SQL, self._event_row(event))
+                    except (ValueError, KeyError) as e:
+                        print(f"[VTuberMemoryStore] Skipping unreadable event file {path.name}: {e}")
+                migrated.append(events_dir)
+
+            conn.execute(f"PRAGMA user_version = {STORE_SCHEMA_VERSION}")
+
+        for path in migrated:
+            path.rename(path.with_name(path.name + ".migrated"))
+        if migrated:
+            print(f"[VTuberMemoryStore] Migrated {', '.join(p.name for p in migrated)} into {self.db_path.name}")
+
+
+def _benchmark(gifts: int = 2000, users: int = 5000) -> None:
+    """对比每个礼物整文件重写两个 JSON 和 upsert 两行的耗时"""
+    import tempfile
+
+    gift_memory = {
+        f"user_{i}": {"current_livestream_money": 0, "total_money": i, "小心心": i % 7}
+        for i in range(users)
+    }
+    stream_history = {"stream_0": {"start_time": datetime.now().isoformat(), "total_gifts": 0}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        start = time.perf_counter()
+        for i in range(gifts):
+            gift_memory[f"user_{i % users}"]["total_money"] += 1
+            with open(root / "gift_memory.json", "w", encoding="utf-8") as f:
+                json.dump(gift_memory, f, ensure_ascii=False, indent=2)
+            with open(root / "stream_history.json", "w", encoding="utf-8") as f:
+                json.dump(stream_history, f, ensure_ascii=False, indent=2)
+        json_elapsed = time.perf_counter() - start
+        (root / "gift_memory.json").unlink()
+        (root / "stream_history.json").unlink()
+
+        store = VTuberMemoryStore(root)
+        start = time.perf_counter()
+        for i in range(gifts):
+            user_id = f"user_{i % users}"
+            gift_memory[user_id]["total_money"] += 1
+            store.save_gift(user_id, gift_memory[user_id])
+            store.save_stream("stream_0", stream_history["stream_0"])
+        store.flush()
+        store_elapsed = time.perf_counter() - start
+        store.close()
+
+    print(f"[before] JSON rewrite ({users} users): {gifts / json_elapsed:,.0f} gifts/s")
+    print(f"[after ] row upsert:               {gifts / store_elapsed:,.0f} gifts/s")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -7,18 +7,27 @@ from langchain_openai.chat_models import ChatOpenAI
 from langchain.chains import ConversationChain
 
 from langchain.prompts import PromptTemplate
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
+import hashlib
 import json
-import os
+import threading
+import time
 import uuid
 
+from src.memory.embedding_cache import cached_embeddings
+from src.memory.entity_extractor import EntityExtractor
+from src.memory.gift_leaderboard import Leaderboard, WindowedLeaderboard
+from src.memory.memory_store import VTuberMemoryStore
+
 
 class VTuberMemorySystem:
     def __init__(self, vtuber_name, llm_model="gpt-4o"):
         # 基础信息
         self.vtuber_name = vtuber_name
         self.llm = ChatOpenAI(model_name=llm_model)
-        self.embeddings = OpenAIEmbeddings()
+        self.embeddings = cached_embeddings(OpenAIEmbeddings())
         self.stream_id = self._generate_stream_id()
 
         # 短期记忆 - 最近 50 条对话
@@ -60,18 +69,45 @@ class VTuberMemorySystem:
             embedding_function=self.embeddings,
             persist_directory=f"./memory_db/{vtuber_name}/users"
         )
+        # 用户向量按 user_id upsert，同一用户至少隔这么久才重新写一次
+        self.user_vector_refresh_seconds = 300
+        self._user_vector_state = {}  # user_id -> (上次写入时间, 内容哈希)
+        self._user_vector_timers = {}  # user_id -> 窗口结束时补写的定时器
+        self._user_vector_lock = threading.Lock()
+        self._user_vector_deduped = set()
+
+        # 多个向量库并发检索、用户向量后台写入共用的线程池
+        self._vector_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="vtuber-vector")
+
+        # 礼物、实体、直播场次、事件的持久化（SQLite，按行更新）
+        self.store = VTuberMemoryStore(Path(f"./memory_db/{vtuber_name}"))
 
         # 礼物记忆
         self.gift_memory = {}
         self.load_gift_memory()
 
+        # 礼物排行榜：全部历史、本场直播、最近 10 分钟，每个礼物 O(log n) 更新
+        self.all_time_gift_board = Leaderboard()
+        self.all_time_gift_board.load(
+            (uid, data.get("total_money", 0)) for uid, data in self.gift_memory.items()
+        )
+        self.stream_gift_board = Leaderboard()
+        self.stream_gift_board.load(
+            (uid, data.get("current_livestream_money", 0)) for uid, data in self.gift_memory.items()
+        )
+        self.recent_gift_board = WindowedLeaderboard(window_seconds=600)
+
         # 事件记忆（仅一个活跃事件）
         self.active_event_id = None  # 当前活跃事件 ID（如果有的话）
-        # 不再维护一个大的 event_memory 字典，而是每个事件单独存文件
+        # 不再维护一个大的 event_memory 字典，事件按 id 存在 store 的 events 表里
+        self._restore_active_event()
 
         # 用户实体记忆
         self.entity_memory = {}
         self.load_entity_memory()
+        self._entity_lock = threading.Lock()
+        # 实体信息由后台按批提取，不占回复路径
+        self.entity_extractor = EntityExtractor(self.llm, vtuber_name, self._apply_entity_update)
 
         # 直播场次记录
         self.stream_history = {}
@@ -151,29 +187,22 @@ class VTuberMemorySystem:
                 "top_gifters": [],
                 "summary": ""
             }
-            self.save_stream_history()
+            self.save_stream_history(self.stream_id)
 
             # 重置当前直播用户送礼金额
             for user_id in self.gift_memory:
                 self.gift_memory[user_id]["current_livestream_money"] = 0
-            self.save_gift_memory()
+            self.store.reset_stream_gifts()
+            self.stream_gift_board.clear()
 
     def end_stream(self):
         """结束当前直播并生成简单总结。"""
         # 更新直播结束时间
         self.stream_history[self.stream_id]["end_time"] = datetime.now().isoformat()
 
-        # 计算本场礼物总额和前三名
-        total_gifts = 0
-        gifters = []
-        for user_id, data in self.gift_memory.items():
-            current_stream_money = data.get("current_livestream_money", 0)
-            total_gifts += current_stream_money
-            if current_stream_money > 0:
-                gifters.append({"user_id": user_id, "amount": current_stream_money})
-
-        gifters.sort(key=lambda x: x["amount"], reverse=True)
-        top_gifters = gifters[:3]
+        # 本场礼物总额和前三名
+        total_gifts = self.stream_gift_board.total
+        top_gifters = self.get_top_gifters(3, time_period="current")
 
         self.stream_history[self.stream_id]["total_gifts"] = total_gifts
         self.stream_history[self.stream_id]["top_gifters"] = top_gifters
@@ -193,8 +222,9 @@ class VTuberMemorySystem:
         summary = self.llm.predict(summary_prompt)
         self.stream_history[self.stream_id]["summary"] = summary
 
-        # 保存
-        self.save_stream_history()
+        # 保存，并给整个记忆库留一份快照
+        self.save_stream_history(self.stream_id)
+        self.store.snapshot()
 
         # 重置中期记忆，为下一场做准备
         self.mid_term_memory = ConversationSummaryBufferMemory(
@@ -210,19 +240,16 @@ class VTuberMemorySystem:
 
         return summary
 
-    def save_stream_history(self):
-        """保存直播历史记录"""
-        os.makedirs(f"./memory_db/{self.vtuber_name}", exist_ok=True)
-        with open(f"./memory_db/{self.vtuber_name}/stream_history.json", "w", encoding="utf-8") as f:
-            json.dump(self.stream_history, f, ensure_ascii=False, indent=2)
+    def save_stream_history(self, stream_id=None):
+        """保存直播历史记录；传入 stream_id 时只写这一场"""
+        if stream_id is not None:
+            self.store.save_stream(stream_id, self.stream_history[stream_id])
+        else:
+            self.store.save_streams(self.stream_history)
 
     def load_stream_history(self):
         """加载直播历史记录"""
-        try:
-            with open(f"./memory_db/{self.vtuber_name}/stream_history.json", "r", encoding="utf-8") as f:
-                self.stream_history = json.load(f)
-        except FileNotFoundError:
-            self.stream_history = {}
+        self.stream_history = self.store.load_streams()
 
     # =========== 对话处理 ===========
 
@@ -232,11 +259,11 @@ class VTuberMemorySystem:
         self.short_term_memory.save_context({"input": f"[{user_id}] {user_input}"}, {"output": ""})
         self.mid_term_memory.save_context({"input": f"[{user_id}] {user_input}"}, {"output": ""})
 
-        # 检索长期记忆（角色、梗）
-        character_docs = self.character_retriever.get_relevant_documents(user_input)
+        # 检索长期记忆（角色、梗）：只算一次 embedding，两个库并发检索
+        character_docs, memes_docs = self.search_collections(
+            user_input, [self.character_vectordb, self.memes_vectordb]
+        )
         character_info_str = "\n".join([doc.page_content for doc in character_docs])
-
-        memes_docs = self.memes_retriever.get_relevant_documents(user_input)
         relevant_memes_str = "\n".join([doc.page_content for doc in memes_docs])
 
         # 获取用户实体信息
@@ -267,7 +294,7 @@ class VTuberMemorySystem:
 
         # 直播互动计数
         self.stream_history[self.stream_id]["interaction_count"] += 1
-        self.save_stream_history()
+        self.save_stream_history(self.stream_id)
 
         return response
 
@@ -289,47 +316,42 @@ class VTuberMemorySystem:
             self.add_user_to_vector_memory(user_id)
 
     def _update_entity_memory(self, user_id, user_input, response):
-        """从对话中提取用户信息，更新到实体记忆。"""
-        # 让LLM解析用户信息的示例
-        entity_prompt = f"""
-        从以下对话中，如果能提取到用户的个人信息，请以JSON形式给出：
-        可能的字段包括 name, preference, birthday, background, relationship。
-        如果没有新信息，返回空JSON。
-
-        用户: {user_input}
-        {self.vtuber_name}: {response}
-        """
-        entity_result = self.llm.predict(entity_prompt)
-
-        # 初始化用户实体
-        if user_id not in self.entity_memory:
-            self.entity_memory[user_id] = {
-                "first_interaction": datetime.now().isoformat(),
-                "interaction_count": 0,
-                "streams_attended": [self.stream_id],
-                "last_interaction": datetime.now().isoformat()
-            }
-        else:
-            # 若当前直播未在列表里，添加
-            if self.stream_id not in self.entity_memory[user_id].get("streams_attended", []):
-                self.entity_memory[user_id]["streams_attended"].append(self.stream_id)
-
-        # 解析并更新
-        try:
-            start_idx = entity_result.find("{")
-            end_idx = entity_result.rfind("}") + 1
-            if start_idx >= 0 and end_idx > start_idx:
-                data_json = json.loads(entity_result[start_idx:end_idx])
-                self.entity_memory[user_id].update(data_json)
-        except:
-            pass
-
-        # 交互次数+1
-        self.entity_memory[user_id]["interaction_count"] = \
-            self.entity_memory[user_id].get("interaction_count", 0) + 1
-        self.entity_memory[user_id]["last_interaction"] = datetime.now().isoformat()
-
-        self.save_entity_memory()
+        """更新交互统计，并把这轮对话交给后台提取用户信息。"""
+        with self._entity_lock:
+            # 初始化用户实体
+            if user_id not in self.entity_memory:
+                self.entity_memory[user_id] = {
+                    "first_interaction": datetime.now().isoformat(),
+                    "interaction_count": 0,
+                    "streams_attended": [self.stream_id],
+                    "last_interaction": datetime.now().isoformat()
+                }
+            else:
+                # 若当前直播未在列表里，添加
+                if self.stream_id not in self.entity_memory[user_id].get("streams_attended", []):
+                    self.entity_memory[user_id]["streams_attended"].append(self.stream_id)
+
+            # 交互次数+1
+            self.entity_memory[user_id]["interaction_count"] = \
+                self.entity_memory[user_id].get("interaction_count", 0) + 1
+            self.entity_memory[user_id]["last_interaction"] = datetime.now().isoformat()
+
+            self.save_entity_memory(user_id)
+
+        self.entity_extractor.submit(user_id, user_input, response)
+
+    def _apply_entity_update(self, user_id, data):
+        """后台提取到的用户信息合并进实体记忆（整体替换，读到的不会是半新半旧的数据）"""
+        # 统计字段以本地计数为准，不让 LLM 的输出覆盖
+        for key in ("first_interaction", "interaction_count", "streams_attended", "last_interaction"):
+            data.pop(key, None)
+        with self._entity_lock:
+            entity = {**self.entity_memory.get(user_id, {}), **data}
+            self.entity_memory[user_id] = entity
+            self.save_entity_memory(user_id)
+        # 已经进了向量库的用户，把新提取到的信息也同步过去（受刷新间隔限制，窗口结束时补写）
+        if user_id in self._user_vector_state:
+            self.add_user_to_vector_memory(user_id)
 
     def get_entity_info(self, user_id):
         """返回某个用户的实体信息"""
@@ -339,17 +361,88 @@ class VTuberMemorySystem:
             "streams_attended": [self.stream_id]
         })
 
-    def add_user_to_vector_memory(self, user_id):
+    def search_collections(self, query, vectordbs, k=3):
+        """对同一个 query 只调用一次 embedding，然后在多个向量库里并发检索，按顺序返回各库结果"""
+        query_vector = self.embeddings.embed_query(query)
+        futures = [
+            self._vector_pool.submit(db.similarity_search_by_vector, query_vector, k=k)
+            for db in vectordbs
+        ]
+        return [future.result() for future in futures]
+
+    def add_user_to_vector_memory(self, user_id, force=False):
         """
-        将用户信息加入长期向量库（如果需要的话）。
-        这里简单示例：将 entity_memory[user_id] 转成字符串存储。
+        将用户信息写入长期向量库，以 user_id 作为文档 id upsert，每个用户只保留一条。
+        同一用户在 user_vector_refresh_seconds 内、或内容没变时不重复写（force=True 跳过间隔限制）；
+        间隔内的变更不会丢，窗口结束时用当时最新的内容补写一次。
+        写入（包括 embedding）放到后台线程，不占回复路径。
         """
-        user_info = self.entity_memory.get(user_id, {})
-        content_str = json.dumps(user_info, ensure_ascii=False)
+        with self._entity_lock:
+            user_info = self.entity_memory.get(user_id, {})
+            content_str = json.dumps(user_info, ensure_ascii=False)
+
+        # 交互计数和时间每轮都变，不算内容变化
+        stable_info = {
+            key: value for key, value in user_info.items()
+            if key not in ("interaction_count", "last_interaction")
+        }
+        content_hash = hashlib.sha1(
+            json.dumps(stable_info, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        now = time.monotonic()
+        with self._user_vector_lock:
+            last_written, last_hash = self._user_vector_state.get(user_id, (None, None))
+            if last_hash == content_hash:
+                return
+            if not force and last_written is not None and now - last_written < self.user_vector_refresh_seconds:
+                if user_id not in self._user_vector_timers:
+                    delay = last_written + self.user_vector_refresh_seconds - now
+                    timer = threading.Timer(delay, self._flush_user_vector, args=(user_id,))
+                    timer.daemon = True
+                    self._user_vector_timers[user_id] = timer
+                    timer.start()
+                return
+            self._user_vector_state[user_id] = (now, content_hash)
+
         # 可以加更多上下文/描述
         doc = Document(page_content=content_str, metadata={"user_id": user_id})
-        self.user_vectordb.add_documents([doc])
-        self.user_vectordb.persist()
+        try:
+            self._vector_pool.submit(self._upsert_user_vector, user_id, doc)
+        except RuntimeError as e:
+            # 线程池已关闭（close 之后才到的定时补写）
+            print(f"[VTuberMemorySystem] Skipped user vector for {user_id}: {e}")
+
+    def _flush_user_vector(self, user_id):
+        """定时器回调：刷新间隔结束，补写这期间的变更"""
+        with self._user_vector_lock:
+            # 已经被 flush_user_vectors 处理过
+            if self._user_vector_timers.pop(user_id, None) is None:
+                return
+        self.add_user_to_vector_memory(user_id, force=True)
+
+    def flush_user_vectors(self):
+        """不等刷新间隔，立即补写所有还在等待的用户向量"""
+        with self._user_vector_lock:
+            timers, self._user_vector_timers = self._user_vector_timers, {}
+        for user_id, timer in timers.items():
+            timer.cancel()
+            self.add_user_to_vector_memory(user_id, force=True)
+
+    def _upsert_user_vector(self, user_id, doc):
+        doc_id = f"user_{user_id}"
+        try:
+            self.user_vectordb.add_documents([doc], ids=[doc_id])
+            if user_id not in self._user_vector_deduped:
+                # 旧版本每轮都追加一条，第一次 upsert 时顺手清掉这个用户的旧文档
+                stale = [i for i in self.user_vectordb.get(where={"user_id": user_id})["ids"] if i != doc_id]
+                if stale:
+                    self.user_vectordb.delete(ids=stale)
+                self._user_vector_deduped.add(user_id)
+        except Exception as e:
+            # 下次交互时重试
+            with self._user_vector_lock:
+                self._user_vector_state.pop(user_id, None)
+            print(f"[VTuberMemorySystem] Failed to upsert user vector for {user_id}: {e}")
 
     # =========== 礼物记忆系统 ===========
 
@@ -368,14 +461,14 @@ class VTuberMemorySystem:
         self.gift_memory[user_id]["current_livestream_money"] += gift_value
         self.gift_memory[user_id]["total_money"] += gift_value
 
-        self.save_gift_memory()
+        self.save_gift_memory(user_id)
 
-        # 同步更新直播统计
-        total_stream_gifts = sum(
-            [g.get("current_livestream_money", 0) for g in self.gift_memory.values()]
-        )
-        self.stream_history[self.stream_id]["total_gifts"] = total_stream_gifts
-        self.save_stream_history()
+        # 更新排行榜，同步直播统计
+        self.all_time_gift_board.add(user_id, gift_value)
+        self.stream_gift_board.add(user_id, gift_value)
+        self.recent_gift_board.add(user_id, gift_value)
+        self.stream_history[self.stream_id]["total_gifts"] = self.stream_gift_board.total
+        self.save_stream_history(self.stream_id)
 
     def get_gift_info(self, user_id):
         """获取用户礼物信息"""
@@ -385,51 +478,38 @@ class VTuberMemorySystem:
         })
 
     def get_top_gifters(self, count=10, time_period=None):
-        """获取礼物排行榜，可扩展 time_period 逻辑"""
-        all_gifters = []
-
+        """
+        获取礼物排行榜。
+        time_period: "current" 当前直播，"recent" 最近 10 分钟，其他为总排行
+        """
         if time_period == "current":
-            # 当前直播
-            for uid, data in self.gift_memory.items():
-                all_gifters.append({
-                    "user_id": uid,
-                    "amount": data.get("current_livestream_money", 0)
-                })
+            board = self.stream_gift_board
+        elif time_period == "recent":
+            board = self.recent_gift_board
+        else:
+            board = self.all_time_gift_board
+        return [{"user_id": uid, "amount": amount} for uid, amount in board.top(count)]
+
+    def save_gift_memory(self, user_id=None):
+        """保存礼物信息；传入 user_id 时只写这个用户"""
+        if user_id is not None:
+            self.store.save_gift(user_id, self.gift_memory[user_id])
         else:
-            # 总排行
-            for uid, data in self.gift_memory.items():
-                all_gifters.append({
-                    "user_id": uid,
-                    "amount": data.get("total_money", 0)
-                })
-
-        all_gifters.sort(key=lambda x: x["amount"], reverse=True)
-        return all_gifters[:count]
-
-    def save_gift_memory(self):
-        """保存礼物信息"""
-        os.makedirs(f"./memory_db/{self.vtuber_name}", exist_ok=True)
-        with open(f"./memory_db/{self.vtuber_name}/gift_memory.json", "w", encoding="utf-8") as f:
-            json.dump(self.gift_memory, f, ensure_ascii=False, indent=2)
+            self.store.save_gifts(self.gift_memory)
 
     def load_gift_memory(self):
         """加载礼物信息"""
-        try:
-            with open(f"./memory_db/{self.vtuber_name}/gift_memory.json", "r", encoding="utf-8") as f:
-                self.gift_memory = json.load(f)
-        except FileNotFoundError:
-            self.gift_memory = {}
+        self.gift_memory = self.store.load_gifts()
 
     # =========== 事件记忆系统（单活跃事件） ===========
 
     def create_event(self, event_name, description, duration_minutes=30):
-        """创建一个新事件，并写入单独文件。只允许一个活跃事件，若已有则结束之前的。"""
+        """创建一个新事件并写入 store。只允许一个活跃事件，若已有则结束之前的。"""
         # 如果已有活跃事件，先结束
         if self.active_event_id:
             self.end_event(self.active_event_id, results={"info": "创建新事件时，自动结束之前的事件。"})
 
         now = datetime.now()
-        timestamp_str = now.strftime("%Y%m%d_%H%M%S")
         event_id = f"event_{uuid.uuid4().hex[:8]}"
 
         event_data = {
@@ -444,58 +524,69 @@ class VTuberMemorySystem:
         # 设置当前活跃事件ID
         self.active_event_id = event_id
 
-        # 将事件信息写入文件
-        filename = f"{event_name}_{timestamp_str}.json"
-        filepath = os.path.join(f"./memory_db/{self.vtuber_name}/events", filename)
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(event_data, f, ensure_ascii=False, indent=2)
+        self.store.save_event(event_data)
 
         return event_id
 
     def end_event(self, event_id, results=None):
         """
-        结束某个事件（如果文件存在则更新 is_active = False）。
-        若传入 results，则写入事件文件。
+        结束某个事件（如果存在且仍活跃则更新 is_active = False）。
+        若传入 results，则写入事件记录。
         """
-        # 在目录中找到对应事件文件（此处为示例做法，实际可维护 event_id->filepath 的映射）
-        events_dir = os.path.join(f"./memory_db/{self.vtuber_name}", "events")
-        if not os.path.exists(events_dir):
+        event_data = self.store.load_event(event_id)
+        if not event_data or not event_data.get("is_active", False):
             return
 
-        for fname in os.listdir(events_dir):
-            if fname.startswith(event_id) or event_id in fname:
-                filepath = os.path.join(events_dir, fname)
-                try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        event_data = json.load(f)
-                    if event_data["id"] == event_id and event_data.get("is_active", False):
-                        # 更新
-                        event_data["is_active"] = False
-                        event_data["end_time"] = datetime.now().isoformat()
-                        if results:
-                            event_data["results"] = results
-                        # 写回
-                        with open(filepath, "w", encoding="utf-8") as f:
-                            json.dump(event_data, f, ensure_ascii=False, indent=2)
-                        # 如果正好是当前活跃事件，清空
-                        if self.active_event_id == event_id:
-                            self.active_event_id = None
-                        break
-                except:
-                    continue
+        event_data["is_active"] = False
+        event_data["end_time"] = datetime.now().isoformat()
+        if results:
+            event_data["results"] = results
+        self.store.save_event(event_data)
+
+        # 如果正好是当前活跃事件，清空
+        if self.active_event_id == event_id:
+            self.active_event_id = None
+
+    def get_events(self, start_time=None, end_time=None, limit=50):
+        """
+        按开始时间查询事件，最新的在前（用于"之前的直播发生过什么"之类的提示）。
+        start_time / end_time 为 datetime，不传表示不限。
+        """
+        start = start_time.isoformat() if start_time else ""
+        end = end_time.isoformat() if end_time else "9999"
+        return self.store.events_between(start, end, limit)
+
+    def get_stream_events(self, stream_id, limit=50):
+        """某一场直播期间开始的事件"""
+        stream = self.stream_history.get(stream_id)
+        if not stream:
+            return []
+        return self.store.events_between(stream["start_time"], stream.get("end_time") or "9999", limit)
+
+    def _restore_active_event(self):
+        """重启后恢复活跃事件：保留最新的一个，其余的结束掉（同一时间只允许一个活跃事件）"""
+        active = self.store.active_events()
+        if not active:
+            return
+        self.active_event_id = active[0]["id"]
+        for event in active[1:]:
+            self.end_event(event["id"], results={"info": "重启时发现多个活跃事件，自动结束较早的事件。"})
 
     # =========== 实体记忆 ===========
 
-    def save_entity_memory(self):
-        os.makedirs(f"./memory_db/{self.vtuber_name}", exist_ok=True)
-        with open(f"./memory_db/{self.vtuber_name}/entities.json", "w", encoding="utf-8") as f:
-            json.dump(self.entity_memory, f, ensure_ascii=False, indent=2)
+    def save_entity_memory(self, user_id=None):
+        """保存实体信息；传入 user_id 时只写这个用户"""
+        if user_id is not None:
+            self.store.save_entity(user_id, self.entity_memory[user_id])
+        else:
+            self.store.save_entities(self.entity_memory)
 
     def load_entity_memory(self):
-        try:
-            with open(f"./memory_db/{self.vtuber_name}/entities.json", "r", encoding="utf-8") as f:
-                self.entity_memory = json.load(f)
-        except FileNotFoundError:
-            self.entity_memory = {}
+        self.entity_memory = self.store.load_entities()
+
+    def close(self):
+        """提取完剩下的用户信息，补写等待中的用户向量，把还没落盘的记忆写完并关闭存储"""
+        self.entity_extractor.close()
+        self.flush_user_vectors()
+        self._vector_pool.shutdown(wait=True)
+        self.store.close()
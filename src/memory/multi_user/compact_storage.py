@@ -0,0 +1,497 @@
+"""
+列式紧凑的多用户记忆存储
+每条消息不再是一个 MemoryMessage 对象，而是若干个定长数组里的一行：
+用户 id / 用户名做字符串驻留，时间戳存 int64 微秒，正文统一放在一块 UTF-8 字节区里，
+消息 id（uuid4）存 16 字节。只有在读取时才还原成 MemoryMessage 或 LangChain 消息。
+"""
+
+import asyncio
+import heapq
+import time
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from src.memory.multi_user.user_memory_manager import (
+    CompactionHook,
+    InMemoryStorage,
+    MemoryMessage,
+    MemoryStorage,
+    MemoryType,
+    MessagePriority,
+)
+
+_MESSAGE_TYPES = ["human", "ai", "system"]
+_MESSAGE_TYPE_INDEX = {name: i for i, name in enumerate(_MESSAGE_TYPES)}
+# 优先级从低到高，淘汰时从前往后找
+_PRIORITIES = sorted(MessagePriority, key=lambda p: p.value)
+_PRIORITY_INDEX = {p: i for i, p in enumerate(_PRIORITIES)}
+
+_PERSONAL, _GENERAL = 0, 1
+_ID_BYTES = 16
+
+# id 索引的键：uuid 格式的 id 用 16 字节，其他 id 用原字符串
+_IdKey = Union[bytes, str]
+
+
+def _id_key(message_id: str) -> _IdKey:
+    try:
+        parsed = uuid.UUID(message_id)
+    except ValueError:
+        return message_id
+    return parsed.bytes if str(parsed) == message_id else message_id
+
+
+def _last_inversion(queue: array, ts: array) -> int:
+    """queue 里最后一处时间戳比前一行小的位置，整条有序时为 0"""
+    for i in range(len(queue) - 1, 0, -1):
+        if ts[queue[i]] < ts[queue[i - 1]]:
+            return i
+    return 0
+
+
+class _Scope:
+    """
+    一个记忆范围（某用户的个人记忆或全局记忆）：每个优先级一条按追加顺序排列的行号队列，
+    以及消息 id 到行号的索引（按 id 删除和同 id 覆盖用）。
+    unsorted_at 记录每条队列里最后一处时间戳倒退的位置，不在队头之后时这条队列可以按时间 bisect；
+    倒退的消息被淘汰出队头或压缩时重新计算后，队列自动恢复有序
+    """
+
+    __slots__ = ("queues", "heads", "unsorted_at", "live", "ids")
+
+    def __init__(self):
+        self.queues = [array("q") for _ in _PRIORITIES]
+        self.heads = [0] * len(_PRIORITIES)
+        self.unsorted_at = [0] * len(_PRIORITIES)
+        self.live = 0
+        self.ids: Dict[_IdKey, int] = {}
+
+
+class CompactStorage(MemoryStorage):
+    """
+    列式内存存储，语义与 InMemoryStorage 一致：同样的条数上限，先淘汰低优先级、再淘汰最旧的。
+    每个优先级一条队列，淘汰就是从最低非空队列的队头取一行，O(1)；
+    按时间查询时在各队列里 bisect，再按行号归并。
+    删除/淘汰只打标记，死行多于活行时整体压缩一次。同一范围里重复的 id 会覆盖旧消息。
+    和 InMemoryStorage 一样支持 compaction_hook：被淘汰的消息每攒够 compaction_batch 条折叠进摘要。
+    除了调用 compaction_hook，所有操作都不含 await，在事件循环里天然是原子的，不需要锁。
+    """
+
+    def __init__(
+        self,
+        max_messages_per_user: int = 1000,
+        max_general_messages: int = 5000,
+        compaction_hook: Optional[CompactionHook] = None,
+        compaction_batch: int = 20
+    ):
+        self.max_messages_per_user = max_messages_per_user
+        self.max_general_messages = max_general_messages
+        self.compaction_hook = compaction_hook
+        self.compaction_batch = compaction_batch
+
+        # 摘要和待压缩的淘汰消息，key 为 (memory_type, user_id)，全局记忆的 user_id 为 None
+        self._summaries: Dict[Tuple[str, Optional[str]], str] = {}
+        self._evicted: Dict[Tuple[str, Optional[str]], List[MemoryMessage]] = {}
+        self._compaction_lock = asyncio.Lock()
+
+        # 字符串驻留表（用户 id 和用户名）
+        self._strings: List[str] = []
+        self._string_index: Dict[str, int] = {}
+
+        # 每行一条消息
+        self._user = array("i")
+        self._username = array("i")
+        self._ts = array("q")
+        self._priority = array("b")
+        self._type = array("b")
+        self._kind = array("b")  # _PERSONAL / _GENERAL
+        self._content_off = array("q")
+        self._content_len = array("i")
+        self._arena = bytearray()
+        self._ids = bytearray()
+        self._dead = bytearray()
+        self._dead_count = 0
+        # 稀疏列：非 uuid 格式的 id、非空的 metadata
+        self._odd_ids: Dict[int, str] = {}
+        self._metadata: Dict[int, Dict[str, Any]] = {}
+
+        self._personal: Dict[int, _Scope] = {}
+        self._general = _Scope()
+        self._personal_total = 0
+
+        # 同一条消息连续写进个人记忆和全局记忆时，正文只存一份
+        self._last_content: Optional[str] = None
+        self._last_content_ref: Tuple[int, int] = (0, 0)
+
+    # ---- MemoryStorage ----
+
+    async def store_message(self, memory_type: MemoryType, message: MemoryMessage) -> bool:
+        """存储消息"""
+        try:
+            evicted = self._append(memory_type, message)
+        except Exception as e:
+            print(f"[CompactStorage] Error storing message: {e}")
+            return False
+        if evicted:
+            user_id = message.user_id if memory_type == MemoryType.PERSONAL else None
+            await self._compact((memory_type.value, user_id), evicted)
+        return True
+
+    async def get_summary(self, memory_type: MemoryType, user_id: Optional[str] = None) -> str:
+        """被淘汰消息折叠成的摘要，没有设置 compaction_hook 时为空"""
+        key = (memory_type.value, user_id if memory_type == MemoryType.PERSONAL else None)
+        return self._summaries.get(key, "")
+
+    async def retrieve_messages(
+        self,
+        memory_type: MemoryType,
+        user_id: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None
+    ) -> List[MemoryMessage]:
+        """检索消息，按追加顺序"""
+        rows = self._select(memory_type, user_id, limit, offset, start_time, end_time)
+        return [self._to_memory_message(row) for row in rows]
+
+    async def retrieve_langchain_messages(
+        self,
+        memory_type: MemoryType,
+        user_id: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0
+    ) -> List[BaseMessage]:
+        """直接从列数据构造 LangChain 消息，不经过 MemoryMessage"""
+        rows = self._select(memory_type, user_id, limit, offset, None, None)
+        return [self._to_langchain_message(row) for row in rows]
+
+    async def delete_messages(
+        self,
+        memory_type: MemoryType,
+        user_id: Optional[str] = None,
+        message_ids: Optional[List[str]] = None
+    ) -> int:
+        """删除消息"""
+        scope = self._scope(memory_type, user_id)
+        if scope is None:
+            return 0
+
+        kind = _PERSONAL if memory_type == MemoryType.PERSONAL else _GENERAL
+        deleted = 0
+        if message_ids:
+            for message_id in set(message_ids):
+                row = scope.ids.get(_id_key(message_id))
+                if row is not None:
+                    self._kill(row, scope)
+                    deleted += 1
+        else:
+            for queue, head in zip(scope.queues, scope.heads):
+                for row in islice(queue, head, None):
+                    if not self._dead[row]:
+                        self._kill(row, scope)
+                        deleted += 1
+            scope.queues = [array("q") for _ in _PRIORITIES]
+            scope.heads = [0] * len(_PRIORITIES)
+            scope.unsorted_at = [0] * len(_PRIORITIES)
+            # 删除全部消息时连同摘要一起清掉
+            key = (memory_type.value, user_id if kind == _PERSONAL else None)
+            self._summaries.pop(key, None)
+            self._evicted.pop(key, None)
+
+        scope.live -= deleted
+        if kind == _PERSONAL:
+            self._personal_total -= deleted
+        self._maybe_compact()
+        return deleted
+
+    async def get_message_count(self, memory_type: MemoryType, user_id: Optional[str] = None) -> int:
+        """获取消息数量，O(1)"""
+        if memory_type == MemoryType.GENERAL:
+            return self._general.live
+        if not user_id:
+            return self._personal_total
+        scope = self._scope(memory_type, user_id)
+        return scope.live if scope is not None else 0
+
+    # ---- 写入与淘汰 ----
+
+    def _append(self, memory_type: MemoryType, message: MemoryMessage) -> List[MemoryMessage]:
+        """追加一行，返回因超出上限被淘汰的消息（只在设置了 compaction_hook 时收集）"""
+        row = len(self._ts)
+        ts = int(message.timestamp.timestamp() * 1_000_000)
+
+        user = self._intern(message.user_id)
+        self._user.append(user)
+        self._username.append(self._intern(message.username))
+        self._ts.append(ts)
+        self._priority.append(_PRIORITY_INDEX[message.priority])
+        self._type.append(_MESSAGE_TYPE_INDEX[message.message_type])
+        kind = _PERSONAL if memory_type == MemoryType.PERSONAL else _GENERAL
+        self._kind.append(kind)
+        self._dead.append(0)
+
+        if message.content == self._last_content:
+            off, length = self._last_content_ref
+        else:
+            data = message.content.encode("utf-8")
+            off, length = len(self._arena), len(data)
+            self._arena += data
+            self._last_content = message.content
+            self._last_content_ref = (off, length)
+        self._content_off.append(off)
+        self._content_len.append(length)
+
+        key = _id_key(message.id)
+        if isinstance(key, str):
+            self._odd_ids[row] = message.id
+            self._ids += bytes(_ID_BYTES)
+        else:
+            self._ids += key
+        if message.metadata:
+            self._metadata[row] = message.metadata
+
+        if kind == _PERSONAL:
+            scope = self._personal.get(user)
+            if scope is None:
+                scope = self._personal[user] = _Scope()
+            limit = self.max_messages_per_user
+        else:
+            scope = self._general
+            limit = self.max_general_messages
+        # 同一范围里 id 重复时新消息覆盖旧消息，和 InMemoryStorage 一致
+        old = scope.ids.get(key)
+        if old is not None:
+            self._kill(old, scope)
+            scope.live -= 1
+            if kind == _PERSONAL:
+                self._personal_total -= 1
+        scope.ids[key] = row
+        priority = _PRIORITY_INDEX[message.priority]
+        queue = scope.queues[priority]
+        if len(queue) > scope.heads[priority] and ts < self._ts[queue[-1]]:
+            scope.unsorted_at[priority] = len(queue)
+        queue.append(row)
+        scope.live += 1
+        if kind == _PERSONAL:
+            self._personal_total += 1
+
+        evicted: List[MemoryMessage] = []
+        collect = evicted if self.compaction_hook is not None else None
+        while scope.live > limit:
+            self._evict(scope, collect)
+            if kind == _PERSONAL:
+                self._personal_total -= 1
+        self._maybe_compact()
+        return evicted
+
+    def _evict(self, scope: _Scope, collect: Optional[List[MemoryMessage]] = None) -> None:
+        """淘汰优先级最低的队列里最旧的一行；collect 不为 None 时把被淘汰的消息放进去"""
+        for i, queue in enumerate(scope.queues):
+            head = scope.heads[i]
+            while head < len(queue) and self._dead[queue[head]]:
+                head += 1
+            if head < len(queue):
+                row = queue[head]
+                if collect is not None:
+                    collect.append(self._to_memory_message(row))
+                self._kill(row, scope)
+                scope.heads[i] = head + 1
+                scope.live -= 1
+                return
+            scope.heads[i] = head
+
+    def _kill(self, row: int, scope: _Scope) -> None:
+        self._dead[row] = 1
+        self._dead_count += 1
+        self._metadata.pop(row, None)
+        odd = self._odd_ids.get(row)
+        scope.ids.pop(odd if odd is not None else bytes(self._ids[row * _ID_BYTES:(row + 1) * _ID_BYTES]), None)
+
+    async def _compact(self, key: Tuple[str, Optional[str]], evicted: List[MemoryMessage]) -> None:
+        pending = self._evicted.setdefault(key, [])
+        pending.extend(evicted)
+        if len(pending) < self.compaction_batch:
+            return
+        self._evicted[key] = []
+        # 钩子可能是协程，同一时间只跑一个，摘要不会互相覆盖
+        async with self._compaction_lock:
+            summary = self.compaction_hook(self._summaries.get(key, ""), pending)
+            if asyncio.iscoroutine(summary):
+                summary = await summary
+            self._summaries[key] = summary
+
+    # ---- 读取 ----
+
+    def _scope(self, memory_type: MemoryType, user_id: Optional[str]) -> Optional[_Scope]:
+        if memory_type == MemoryType.GENERAL:
+            return self._general
+        user = self._string_index.get(user_id) if user_id else None
+        return self._personal.get(user) if user is not None else None
+
+    def _select(
+        self,
+        memory_type: MemoryType,
+        user_id: Optional[str],
+        limit: int,
+        offset: int,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime]
+    ) -> List[int]:
+        scope = self._scope(memory_type, user_id)
+        if scope is None:
+            return []
+        start = int(start_time.timestamp() * 1_000_000) if start_time else None
+        end = int(end_time.timestamp() * 1_000_000) if end_time else None
+        return list(islice(self._live_rows(scope, start, end), offset, offset + limit))
+
+    def _live_rows(self, scope: _Scope, start: Optional[int], end: Optional[int]) -> Iterator[int]:
+        ts = self._ts
+        ranges = []
+        for queue, head, unsorted_at in zip(scope.queues, scope.heads, scope.unsorted_at):
+            if unsorted_at <= head:
+                lo = bisect_left(queue, start, head, key=ts.__getitem__) if start is not None else head
+                hi = bisect_right(queue, end, lo, key=ts.__getitem__) if end is not None else len(queue)
+                if lo < hi:
+                    ranges.append(queue[lo:hi])
+            elif start is None and end is None:
+                ranges.append(queue[head:])
+            else:
+                # 这条队列里有时间戳倒退的消息，只能逐行过滤
+                lo = start if start is not None else -(1 << 63)
+                hi = end if end is not None else (1 << 63) - 1
+                ranges.append(array("q", (row for row in islice(queue, head, None) if lo <= ts[row] <= hi)))
+
+        rows = heapq.merge(*ranges) if len(ranges) > 1 else iter(ranges[0] if ranges else ())
+        for row in rows:
+            if not self._dead[row]:
+                yield row
+
+    def _content(self, row: int) -> str:
+        off = self._content_off[row]
+        return self._arena[off:off + self._content_len[row]].decode("utf-8")
+
+    def _message_id(self, row: int) -> str:
+        odd = self._odd_ids.get(row)
+        if odd is not None:
+            return odd
+        return str(uuid.UUID(bytes=bytes(self._ids[row * _ID_BYTES:(row + 1) * _ID_BYTES])))
+
+    def _to_memory_message(self, row: int) -> MemoryMessage:
+        return MemoryMessage(
+            id=self._message_id(row),
+            user_id=self._strings[self._user[row]],
+            username=self._strings[self._username[row]],
+            content=self._content(row),
+            message_type=_MESSAGE_TYPES[self._type[row]],
+            timestamp=datetime.fromtimestamp(self._ts[row] / 1_000_000, tz=timezone.utc),
+            priority=_PRIORITIES[self._priority[row]],
+            metadata=dict(self._metadata.get(row, {})),
+        )
+
+    def _to_langchain_message(self, row: int) -> BaseMessage:
+        message_type = _MESSAGE_TYPES[self._type[row]]
+        if message_type == "human":
+            return HumanMessage(content=self._content(row))
+        elif message_type == "ai":
+            return AIMessage(content=self._content(row))
+        else:
+            raise ValueError(f"Unsupported message type: {message_type}")
+
+    # ---- 内部 ----
+
+    def _intern(self, value: str) -> int:
+        idx = self._string_index.get(value)
+        if idx is None:
+            idx = self._string_index[value] = len(self._strings)
+            self._strings.append(value)
+        return idx
+
+    def _maybe_compact(self) -> None:
+        live = len(self._ts) - self._dead_count
+        if self._dead_count <= 1024 or self._dead_count <= live:
+            return
+
+        keep = [row for row in range(len(self._ts)) if not self._dead[row]]
+        remap = {old: new for new, old in enumerate(keep)}
+
+        for name in ("_user", "_username", "_ts", "_priority", "_type", "_kind"):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, (column[row] for row in keep)))
+
+        # 正文区重建，原来共享的正文继续共享
+        arena = bytearray()
+        moved: Dict[int, int] = {}
+        offsets = array("q")
+        for row in keep:
+            off = self._content_off[row]
+            if off not in moved:
+                moved[off] = len(arena)
+                arena += self._arena[off:off + self._content_len[row]]
+            offsets.append(moved[off])
+        self._content_len = array("i", (self._content_len[row] for row in keep))
+        self._content_off = offsets
+        self._arena = arena
+
+        self._ids = bytearray().join(
+            self._ids[row * _ID_BYTES:(row + 1) * _ID_BYTES] for row in keep
+        )
+        self._odd_ids = {remap[row]: value for row, value in self._odd_ids.items() if row in remap}
+        self._metadata = {remap[row]: value for row, value in self._metadata.items() if row in remap}
+        self._dead = bytearray(len(keep))
+        self._dead_count = 0
+        self._last_content = None
+
+        for scope in [self._general, *self._personal.values()]:
+            scope.queues = [
+                array("q", (remap[row] for row in islice(queue, head, None) if row in remap))
+                for queue, head in zip(scope.queues, scope.heads)
+            ]
+            scope.heads = [0] * len(_PRIORITIES)
+            scope.unsorted_at = [_last_inversion(queue, self._ts) for queue in scope.queues]
+            scope.ids = {key: remap[row] for key, row in scope.ids.items()}
+
+
+def _benchmark(messages: int = 100_000, users: int = 1000) -> None:
+    """对比 InMemoryStorage 和 CompactStorage 存同样消息时的内存占用，换算成每百万条"""
+    import asyncio
+    import tracemalloc
+    from datetime import timedelta
+
+    async def fill(storage: MemoryStorage) -> None:
+        base = datetime.now(timezone.utc)
+        for i in range(messages):
+            msg = MemoryMessage(
+                user_id=f"user_{i % users}",
+                username=f"观众{i % users}",
+                content=f"主播今天唱的第{i % 50}首歌真好听！",
+                timestamp=base + timedelta(milliseconds=i),
+            )
+            await storage.store_message(MemoryType.PERSONAL, msg)
+            await storage.store_message(MemoryType.GENERAL, msg)
+
+    for name, factory in (
+        ("InMemoryStorage", lambda: InMemoryStorage(messages, messages)),
+        ("CompactStorage", lambda: CompactStorage(messages, messages)),
+    ):
+        tracemalloc.start()
+        start = time.perf_counter()
+        storage = factory()
+        asyncio.run(fill(storage))
+        elapsed = time.perf_counter() - start
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # 每条消息同时写进个人和全局记忆，按存储的行数换算
+        per_million = used / (2 * messages) * 1_000_000 / 1024 / 1024
+        print(f"[{name}] {per_million:,.0f} MB per million messages, fill {elapsed:.1f}s")
+        del storage
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,421 @@
+"""
+SQLite 持久化的多用户记忆存储
+实现 MemoryStorage 协议：写入先进缓冲区，按条数或时间间隔批量提交；
+每个用户的消息数在内存里计数（只算真正新增的行），get_message_count 为 O(1)。
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.memory.multi_user.user_memory_manager import (
+    InMemoryStorage,
+    MemoryMessage,
+    MemoryStorage,
+    MemoryType,
+    MessagePriority,
+)
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS memory_messages (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT NOT NULL,
+        memory_type TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        username TEXT NOT NULL,
+        content TEXT NOT NULL,
+        message_type TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        priority INTEGER NOT NULL,
+        metadata TEXT NOT NULL,
+        -- 同一条消息可以同时存在于个人记忆和全局记忆
+        UNIQUE(memory_type, id)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_memory_messages_user_ts
+    ON memory_messages(memory_type, user_id, ts)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_memory_messages_type_ts
+    ON memory_messages(memory_type, ts)
+    """,
+]
+
+_INSERT_SQL = """
+    INSERT OR IGNORE INTO memory_messages
+    (id, memory_type, user_id, username, content, message_type, ts, priority, metadata)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# 同一 id 再次写入时原地更新，不新增行，也不改变 seq 和所属用户
+_UPDATE_SQL = """
+    UPDATE memory_messages
+    SET username = ?, content = ?, message_type = ?, ts = ?, priority = ?, metadata = ?
+    WHERE id = ? AND memory_type = ?
+"""
+_COLUMNS = "id, user_id, username, content, message_type, ts, priority, metadata"
+
+# 计数的 key：(memory_type, user_id)，全局记忆不按用户计，user_id 为 None
+_CountKey = Tuple[str, Optional[str]]
+
+
+def _to_micros(ts: datetime) -> int:
+    return int(ts.timestamp() * 1_000_000)
+
+
+def _from_micros(us: int) -> datetime:
+    return datetime.fromtimestamp(us / 1_000_000, tz=timezone.utc)
+
+
+class SQLiteStorage(MemoryStorage):
+    """SQLite 存储实现，语义与 InMemoryStorage 一致（同样的条数上限，超出时先丢低优先级、再丢最旧的）"""
+
+    def __init__(
+        self,
+        db_path: Path,
+        max_messages_per_user: int = 1000,
+        max_general_messages: int = 5000,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        max_retries: int = 3,
+    ):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_messages_per_user = max_messages_per_user
+        self.max_general_messages = max_general_messages
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.dropped_messages = 0
+
+        # 所有 SQLite 操作都在这一个线程上执行，连接只在这个线程里用
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._open).result()
+
+        # (memory_type, 消息, 已失败的写入次数)
+        self._buffer: List[Tuple[str, MemoryMessage, int]] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # 计数只在数据库线程上、事务提交之后修改，和表里的行数一致
+        self._counts: Dict[_CountKey, int] = self._executor.submit(self._load_counts).result()
+        self._personal_total = sum(
+            count for (mtype, _), count in self._counts.items() if mtype == MemoryType.PERSONAL.value
+        )
+
+    # ---- MemoryStorage ----
+
+    async def store_message(self, memory_type: MemoryType, message: MemoryMessage) -> bool:
+        """存储消息（进入缓冲区，批量写入；写入失败的消息留在缓冲区里重试，次数有上限）"""
+        self._buffer.append((memory_type.value, message, 0))
+
+        if len(self._buffer) >= self.batch_size:
+            return await self.flush()
+        self._schedule_flush()
+        return True
+
+    async def retrieve_messages(
+        self,
+        memory_type: MemoryType,
+        user_id: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None
+    ) -> List[MemoryMessage]:
+        """检索消息，按时间升序；时间范围和分页都走索引"""
+        if memory_type == MemoryType.PERSONAL and not user_id:
+            return []
+        await self.flush()
+
+        where = ["memory_type = ?"]
+        params: List[Any] = [memory_type.value]
+        if memory_type == MemoryType.PERSONAL:
+            where.append("user_id = ?")
+            params.append(user_id)
+        if start_time:
+            where.append("ts >= ?")
+            params.append(_to_micros(start_time))
+        if end_time:
+            where.append("ts <= ?")
+            params.append(_to_micros(end_time))
+        sql = (
+            f"SELECT {_COLUMNS} FROM memory_messages WHERE {' AND '.join(where)} "
+            "ORDER BY ts, seq LIMIT ? OFFSET ?"
+        )
+        params.extend([limit, offset])
+
+        rows = await self._run(lambda conn: conn.execute(sql, params).fetchall())
+        return [self._row_to_message(row) for row in rows]
+
+    async def delete_messages(
+        self,
+        memory_type: MemoryType,
+        user_id: Optional[str] = None,
+        message_ids: Optional[List[str]] = None
+    ) -> int:
+        """删除消息"""
+        if memory_type == MemoryType.PERSONAL and not user_id:
+            return 0
+        await self.flush()
+
+        where = ["memory_type = ?"]
+        params: List[Any] = [memory_type.value]
+        if memory_type == MemoryType.PERSONAL:
+            where.append("user_id = ?")
+            params.append(user_id)
+        if message_ids:
+            where.append(f"id IN ({', '.join('?' * len(message_ids))})")
+            params.extend(message_ids)
+        sql = f"DELETE FROM memory_messages WHERE {' AND '.join(where)}"
+
+        key = self._count_key(memory_type, user_id)
+
+        def delete(conn: sqlite3.Connection) -> int:
+            with conn:
+                deleted = conn.execute(sql, params).rowcount
+            self._add_count(key, -deleted)
+            return deleted
+
+        return await self._run(delete)
+
+    async def get_message_count(self, memory_type: MemoryType, user_id: Optional[str] = None) -> int:
+        """获取已提交的消息数量，O(1)；缓冲区里还没写入的消息不计入"""
+        if memory_type == MemoryType.PERSONAL and not user_id:
+            return self._personal_total
+        return self._counts.get(self._count_key(memory_type, user_id), 0)
+
+    # ---- 批量写入 ----
+
+    async def flush(self) -> bool:
+        """
+        把缓冲区写入数据库，并裁掉超出上限的旧消息。
+        整批失败时逐条重试：写不进去的消息放回缓冲区，累计失败 max_retries 次后丢弃并记日志；
+        序列化失败的消息直接丢弃。全部写入时返回 True。
+        """
+        async with self._flush_lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            if not self._buffer:
+                return True
+            batch, self._buffer = self._buffer, []
+
+            rows: List[Tuple[_CountKey, Tuple]] = []
+            entries: List[Tuple[str, MemoryMessage, int]] = []
+            for memory_type, msg, attempts in batch:
+                try:
+                    rows.append((self._count_key(MemoryType(memory_type), msg.user_id), self._to_row(memory_type, msg)))
+                    entries.append((memory_type, msg, attempts))
+                except Exception as e:
+                    self.dropped_messages += 1
+                    print(f"[SQLiteStorage] Dropped message {msg.id}: cannot serialize: {e}")
+            ok = len(entries) == len(batch)
+            if not rows:
+                return ok
+
+            try:
+                await self._run(lambda conn: self._write_rows(conn, rows))
+                return ok
+            except Exception as e:
+                print(f"[SQLiteStorage] Error flushing {len(rows)} messages, retrying one by one: {e}")
+
+            # 逐条写，坏掉的那条不拖累其他消息
+            def write_each(conn: sqlite3.Connection) -> List[Optional[Exception]]:
+                errors: List[Optional[Exception]] = []
+                for row in rows:
+                    try:
+                        self._write_rows(conn, [row])
+                        errors.append(None)
+                    except Exception as row_error:
+                        errors.append(row_error)
+                return errors
+
+            try:
+                errors = await self._run(write_each)
+            except Exception as e:
+                errors = [e] * len(rows)
+            retry = []
+            for (memory_type, msg, attempts), error in zip(entries, errors):
+                if error is None:
+                    continue
+                if attempts + 1 >= self.max_retries:
+                    self.dropped_messages += 1
+                    print(f"[SQLiteStorage] Dropped message {msg.id} after {attempts + 1} failed writes: {error}")
+                else:
+                    retry.append((memory_type, msg, attempts + 1))
+            if retry:
+                # store_message 已经返回成功，放回缓冲区最前面，稍后重试
+                self._buffer[:0] = retry
+                self._schedule_flush()
+            return ok and not any(errors)
+
+    async def close(self) -> None:
+        """写完缓冲区再关闭；有消息最终没能写入时抛出 RuntimeError"""
+        dropped_before = self.dropped_messages
+        # 失败的消息最多重试 max_retries 次，这个循环一定会结束
+        while self._buffer:
+            await self.flush()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self._run(lambda conn: conn.close())
+        self._executor.shutdown(wait=True)
+        lost = self.dropped_messages - dropped_before
+        if lost:
+            raise RuntimeError(f"[SQLiteStorage] {lost} buffered messages could not be written before close")
+
+    def _write_rows(self, conn: sqlite3.Connection, rows: List[Tuple[_CountKey, Tuple]]) -> None:
+        """在数据库线程上把一组行写进同一个事务；只有真正新增的行才计数，已存在的 id 原地更新"""
+        inserted: Dict[_CountKey, int] = {}
+        trimmed: Dict[_CountKey, int] = {}
+        with conn:
+            for key, row in rows:
+                if conn.execute(_INSERT_SQL, row).rowcount:
+                    inserted[key] = inserted.get(key, 0) + 1
+                else:
+                    conn.execute(_UPDATE_SQL, (*row[3:], row[0], row[1]))
+            for key, added in inserted.items():
+                extra = self._counts.get(key, 0) + added - self._limit(key)
+                if extra <= 0:
+                    continue
+                mtype, uid = key
+                scope = "memory_type = ? AND user_id = ?" if uid is not None else "memory_type = ?"
+                params = (mtype, uid) if uid is not None else (mtype,)
+                trimmed[key] = conn.execute(
+                    f"DELETE FROM memory_messages WHERE seq IN ("
+                    f"SELECT seq FROM memory_messages WHERE {scope} "
+                    f"ORDER BY priority, ts, seq LIMIT ?)",
+                    (*params, extra),
+                ).rowcount
+        # 事务提交之后再改计数，回滚时计数保持不变
+        for key, added in inserted.items():
+            self._add_count(key, added - trimmed.get(key, 0))
+
+    @staticmethod
+    def _to_row(memory_type: str, msg: MemoryMessage) -> Tuple:
+        return (
+            msg.id, memory_type, msg.user_id, msg.username, msg.content,
+            msg.message_type, _to_micros(msg.timestamp), msg.priority.value,
+            json.dumps(msg.metadata, ensure_ascii=False),
+        )
+
+    # ---- 内部 ----
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self.flush_interval, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, self._conn)
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+
+    def _add_count(self, key: _CountKey, delta: int) -> None:
+        """只在数据库线程上调用"""
+        if not delta:
+            return
+        count = max(0, self._counts.get(key, 0) + delta)
+        if key[0] == MemoryType.PERSONAL.value:
+            self._personal_total += count - self._counts.get(key, 0)
+        self._counts[key] = count
+
+    def _load_counts(self) -> Dict[_CountKey, int]:
+        counts: Dict[_CountKey, int] = {}
+        rows = self._conn.execute(
+            "SELECT memory_type, user_id, COUNT(*) FROM memory_messages GROUP BY memory_type, user_id"
+        ).fetchall()
+        for mtype, uid, count in rows:
+            key = self._count_key(MemoryType(mtype), uid)
+            counts[key] = counts.get(key, 0) + count
+        return counts
+
+    @staticmethod
+    def _count_key(memory_type: MemoryType, user_id: Optional[str]) -> _CountKey:
+        if memory_type == MemoryType.PERSONAL:
+            return (memory_type.value, user_id)
+        return (memory_type.value, None)
+
+    def _limit(self, key: _CountKey) -> int:
+        if key[0] == MemoryType.PERSONAL.value:
+            return self.max_messages_per_user
+        return self.max_general_messages
+
+    @staticmethod
+    def _row_to_message(row: Tuple) -> MemoryMessage:
+        msg_id, user_id, username, content, message_type, ts, priority, metadata = row
+        return MemoryMessage(
+            id=msg_id,
+            user_id=user_id,
+            username=username,
+            content=content,
+            message_type=message_type,
+            timestamp=_from_micros(ts),
+            priority=MessagePriority(priority),
+            metadata=json.loads(metadata),
+        )
+
+
+async def _benchmark(messages: int = 20000, users: int = 200) -> None:
+    """对比 InMemoryStorage 和 SQLiteStorage 的写入、时间范围检索和计数"""
+    import tempfile
+    from datetime import timedelta
+
+    async def run(name: str, storage: MemoryStorage) -> None:
+        base = datetime.now(timezone.utc) - timedelta(hours=1)
+        start = time.perf_counter()
+        for i in range(messages):
+            msg = MemoryMessage(
+                user_id=f"user_{i % users}",
+                content=f"弹幕 {i}",
+                timestamp=base + timedelta(milliseconds=i * 100),
+            )
+            await storage.store_message(MemoryType.PERSONAL, msg)
+            await storage.store_message(MemoryType.GENERAL, msg)
+        write_s = time.perf_counter() - start
+
+        window_start = base + timedelta(minutes=10)
+        window_end = base + timedelta(minutes=20)
+        start = time.perf_counter()
+        for i in range(500):
+            await storage.retrieve_messages(
+                MemoryType.PERSONAL, f"user_{i % users}", 50, 0, window_start, window_end
+            )
+        read_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(10000):
+            await storage.get_message_count(MemoryType.PERSONAL, f"user_{i % users}")
+        count_s = time.perf_counter() - start
+
+        print(
+            f"[{name}] write {2 * messages / write_s:,.0f} msg/s | "
+            f"range query avg {read_s / 500 * 1000:.3f} ms | "
+            f"count avg {count_s / 10000 * 1e6:.2f} us"
+        )
+
+    await run("memory", InMemoryStorage())
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(Path(tmp) / "bench.db")
+        await run("sqlite", storage)
+        await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_benchmark())
@@ -7,14 +7,18 @@ Date: 2025-01-10
 """
 
 import asyncio
+import heapq
 import json
 import threading
+import time
 from abc import ABC, abstractmethod
-from collections import defaultdict, deque
+from bisect import bisect_left, bisect_right
+from collections import deque
 from dataclasses import dataclass, field
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Any, Dict, List, Optional, Protocol, Union
+from itertools import islice
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Protocol, Tuple, Union
 from uuid import uuid4
 
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
@@ -136,30 +140,213 @@ class MemoryStorage(Protocol):
         ...
 
 
+# 压缩钩子：(已有摘要, 被淘汰的消息) -> 新摘要，可以是同步函数也可以是协程
+CompactionHook = Callable[[str, List[MemoryMessage]], Union[str, Awaitable[str]]]
+
+
+def fold_into_summary(summary: str, evicted: List[MemoryMessage], max_chars: int = 2000) -> str:
+    """默认压缩：把被淘汰的消息按「用户名: 内容」接在摘要后面，超长时丢掉最早的部分"""
+    lines = [f"{msg.username or msg.user_id}: {msg.content}" for msg in evicted]
+    return "\n".join(filter(None, [summary, *lines]))[-max_chars:]
+
+
+class _MessageLog:
+    """
+    单个记忆范围（某个用户的个人记忆，或全局记忆）的消息序列。
+    按追加顺序存放消息，并行保存时间戳供 bisect 做时间范围查找；
+    按 id 删除只打墓碑（置 None）并移出 id 索引，墓碑过多时再整体压缩。
+    超出 maxlen 时按「优先级最低、其次最旧」淘汰：_evict_heap 是 (priority, 位置) 的最小堆，
+    位置即追加顺序，插入和淘汰都是 O(log n)；已成墓碑的堆条目在弹出时跳过。
+    """
+
+    __slots__ = ("maxlen", "_items", "_ts", "_index", "_head", "_live", "_unsorted_at", "_evict_heap")
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._items: List[Optional[MemoryMessage]] = []
+        self._ts: List[float] = []
+        self._index: Dict[str, int] = {}
+        self._head = 0  # _head 之前全是墓碑
+        self._live = 0
+        # 最后一处时间戳倒退的位置：不在 _head 之后时 [_head, 末尾) 有序，可以 bisect，
+        # 否则时间查询退化为线性扫描；倒退的消息被淘汰出 _head 或压缩后自动恢复
+        self._unsorted_at = 0
+        self._evict_heap: List[Tuple[int, int]] = []
+
+    def __len__(self) -> int:
+        return self._live
+
+    def append(self, message: MemoryMessage) -> List[MemoryMessage]:
+        """追加消息，返回因超出 maxlen 被淘汰的消息"""
+        if message.id in self._index:
+            self._tombstone(self._index[message.id])
+        ts = message.timestamp.timestamp()
+        if len(self._ts) > self._head and ts < self._ts[-1]:
+            self._unsorted_at = len(self._ts)
+        heapq.heappush(self._evict_heap, (message.priority.value, len(self._items)))
+        self._index[message.id] = len(self._items)
+        self._items.append(message)
+        self._ts.append(ts)
+        self._live += 1
+
+        evicted = []
+        while self._live > self.maxlen:
+            evicted.append(self._evict())
+        self._maybe_compact()
+        return evicted
+
+    def remove(self, message_ids: List[str]) -> int:
+        removed = 0
+        for message_id in set(message_ids):
+            pos = self._index.get(message_id)
+            if pos is not None:
+                self._tombstone(pos)
+                removed += 1
+        self._maybe_compact()
+        return removed
+
+    def clear(self) -> int:
+        removed = self._live
+        self._items, self._ts, self._index = [], [], {}
+        self._evict_heap = []
+        self._head = self._live = self._unsorted_at = 0
+        return removed
+
+    def query(
+        self,
+        limit: int,
+        offset: int = 0,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None
+    ) -> List[MemoryMessage]:
+        """按追加顺序返回时间范围内第 offset 条起的 limit 条，只拷贝结果本身"""
+        items = self._items
+        if self._unsorted_at > self._head:
+            start = start_time.timestamp() if start_time else float("-inf")
+            end = end_time.timestamp() if end_time else float("inf")
+            candidates = (
+                items[i] for i in range(self._head, len(items))
+                if items[i] is not None and start <= self._ts[i] <= end
+            )
+            return list(islice(candidates, offset, offset + limit))
+
+        lo = bisect_left(self._ts, start_time.timestamp(), self._head) if start_time else self._head
+        hi = bisect_right(self._ts, end_time.timestamp(), lo) if end_time else len(items)
+        if self._live == len(items) - self._head:
+            # 没有墓碑，直接切片
+            return items[lo + offset:min(hi, lo + offset + limit)]
+        live = (items[i] for i in range(lo, hi) if items[i] is not None)
+        return list(islice(live, offset, offset + limit))
+
+    def _evict(self) -> MemoryMessage:
+        """淘汰优先级最低的消息里最旧的一条"""
+        while True:
+            _, pos = heapq.heappop(self._evict_heap)
+            message = self._items[pos]
+            if message is not None:
+                self._tombstone(pos)
+                return message
+
+    def _tombstone(self, pos: int) -> None:
+        message = self._items[pos]
+        self._items[pos] = None
+        del self._index[message.id]
+        self._live -= 1
+        while self._head < len(self._items) and self._items[self._head] is None:
+            self._head += 1
+
+    def _maybe_compact(self) -> None:
+        dead = len(self._items) - self._live
+        if dead <= 64 or dead <= self._live:
+            return
+        keep = [i for i in range(self._head, len(self._items)) if self._items[i] is not None]
+        self._items = [self._items[i] for i in keep]
+        self._ts = [self._ts[i] for i in keep]
+        self._index = {msg.id: i for i, msg in enumerate(self._items)}
+        self._evict_heap = [(msg.priority.value, i) for i, msg in enumerate(self._items)]
+        heapq.heapify(self._evict_heap)
+        self._head = 0
+        self._unsorted_at = next(
+            (i for i in range(len(self._ts) - 1, 0, -1) if self._ts[i] < self._ts[i - 1]), 0
+        )
+
+
 class InMemoryStorage(MemoryStorage):
-    """内存存储实现"""
+    """内存存储实现
+
+    超出条数上限时先淘汰低优先级的消息（同优先级先淘汰旧的），SuperChat 等高优先级消息留得更久。
+    设置 compaction_hook 后，被淘汰的消息每攒够 compaction_batch 条就折叠进该用户的摘要。
+    """
     
-    def __init__(self, max_messages_per_user: int = 1000, max_general_messages: int = 5000):
+    def __init__(
+        self,
+        max_messages_per_user: int = 1000,
+        max_general_messages: int = 5000,
+        lock_stripes: int = 16,
+        compaction_hook: Optional[CompactionHook] = None,
+        compaction_batch: int = 20
+    ):
         self.max_messages_per_user = max_messages_per_user
         self.max_general_messages = max_general_messages
+        self.compaction_hook = compaction_hook
+        self.compaction_batch = compaction_batch
         
-        # 使用deque实现LRU行为
-        self._personal_memories: Dict[str, deque] = defaultdict(lambda: deque(maxlen=max_messages_per_user))
-        self._general_memory: deque = deque(maxlen=max_general_messages)
-        self._lock = asyncio.Lock()
+        # 摘要和待压缩的淘汰消息，key 为 (memory_type, user_id)，全局记忆的 user_id 为 None
+        self._summaries: Dict[Tuple[str, Optional[str]], str] = {}
+        self._evicted: Dict[Tuple[str, Optional[str]], List[MemoryMessage]] = {}
+        
+        self._personal_memories: Dict[str, _MessageLog] = {}
+        self._general_memory = _MessageLog(max_general_messages)
+        self._personal_total = 0
+        
+        # 锁分段：不同用户落在不同的锁上，互不争用；全局记忆单独一把锁
+        self._locks = [asyncio.Lock() for _ in range(lock_stripes)]
+        self._general_lock = asyncio.Lock()
+    
+    def _lock_for(self, memory_type: MemoryType, user_id: Optional[str]) -> asyncio.Lock:
+        if memory_type == MemoryType.GENERAL:
+            return self._general_lock
+        return self._locks[hash(user_id) % len(self._locks)]
     
     async def store_message(self, memory_type: MemoryType, message: MemoryMessage) -> bool:
         """存储消息"""
-        async with self._lock:
+        async with self._lock_for(memory_type, message.user_id):
             try:
                 if memory_type == MemoryType.PERSONAL:
-                    self._personal_memories[message.user_id].append(message)
+                    log = self._personal_memories.get(message.user_id)
+                    if log is None:
+                        log = self._personal_memories[message.user_id] = _MessageLog(
+                            self.max_messages_per_user
+                        )
+                    before = len(log)
+                    evicted = log.append(message)
+                    self._personal_total += len(log) - before
+                    await self._compact((memory_type.value, message.user_id), evicted)
                 elif memory_type == MemoryType.GENERAL:
-                    self._general_memory.append(message)
+                    evicted = self._general_memory.append(message)
+                    await self._compact((memory_type.value, None), evicted)
                 return True
             except Exception:
                 return False
     
+    async def _compact(self, key: Tuple[str, Optional[str]], evicted: List[MemoryMessage]) -> None:
+        if not evicted or self.compaction_hook is None:
+            return
+        pending = self._evicted.setdefault(key, [])
+        pending.extend(evicted)
+        if len(pending) < self.compaction_batch:
+            return
+        self._evicted[key] = []
+        summary = self.compaction_hook(self._summaries.get(key, ""), pending)
+        if asyncio.iscoroutine(summary):
+            summary = await summary
+        self._summaries[key] = summary
+    
+    async def get_summary(self, memory_type: MemoryType, user_id: Optional[str] = None) -> str:
+        """被淘汰消息折叠成的摘要，没有设置 compaction_hook 时为空"""
+        key = (memory_type.value, user_id if memory_type == MemoryType.PERSONAL else None)
+        return self._summaries.get(key, "")
+    
     async def retrieve_messages(
         self, 
         memory_type: MemoryType,
@@ -170,29 +357,14 @@ class InMemoryStorage(MemoryStorage):
         end_time: Optional[datetime] = None
     ) -> List[MemoryMessage]:
         """检索消息"""
-        async with self._lock:
+        async with self._lock_for(memory_type, user_id):
             if memory_type == MemoryType.PERSONAL:
-                if not user_id:
+                log = self._personal_memories.get(user_id) if user_id else None
+                if log is None:
                     return []
-                messages = list(self._personal_memories[user_id])
             else:
-                messages = list(self._general_memory)
-            
-            # 时间过滤
-            if start_time or end_time:
-                filtered_messages = []
-                for msg in messages:
-                    if start_time and msg.timestamp < start_time:
-                        continue
-                    if end_time and msg.timestamp > end_time:
-                        continue
-                    filtered_messages.append(msg)
-                messages = filtered_messages
-            
-            # 分页
-            start_idx = offset
-            end_idx = offset + limit
-            return messages[start_idx:end_idx]
+                log = self._general_memory
+            return log.query(limit, offset, start_time, end_time)
     
     async def delete_messages(
         self, 
@@ -201,50 +373,36 @@ class InMemoryStorage(MemoryStorage):
         message_ids: Optional[List[str]] = None
     ) -> int:
         """删除消息"""
-        async with self._lock:
-            deleted_count = 0
-            
-            if memory_type == MemoryType.PERSONAL and user_id:
-                if message_ids:
-                    # 删除指定ID的消息
-                    original_messages = list(self._personal_memories[user_id])
-                    self._personal_memories[user_id].clear()
-                    for msg in original_messages:
-                        if msg.id not in message_ids:
-                            self._personal_memories[user_id].append(msg)
-                        else:
-                            deleted_count += 1
-                else:
-                    # 删除用户的所有消息
-                    deleted_count = len(self._personal_memories[user_id])
-                    self._personal_memories[user_id].clear()
-            
-            elif memory_type == MemoryType.GENERAL:
+        async with self._lock_for(memory_type, user_id):
+            if memory_type == MemoryType.PERSONAL:
+                log = self._personal_memories.get(user_id) if user_id else None
+                if log is None:
+                    return 0
+                # 删除指定ID的消息，或删除用户的所有消息（连同摘要）
                 if message_ids:
-                    # 删除指定ID的消息
-                    original_messages = list(self._general_memory)
-                    self._general_memory.clear()
-                    for msg in original_messages:
-                        if msg.id not in message_ids:
-                            self._general_memory.append(msg)
-                        else:
-                            deleted_count += 1
+                    deleted_count = log.remove(message_ids)
                 else:
-                    # 删除所有一般消息
-                    deleted_count = len(self._general_memory)
-                    self._general_memory.clear()
+                    deleted_count = log.clear()
+                    self._summaries.pop((memory_type.value, user_id), None)
+                    self._evicted.pop((memory_type.value, user_id), None)
+                self._personal_total -= deleted_count
+                return deleted_count
             
-            return deleted_count
+            # 删除指定ID的消息，或删除所有一般消息
+            if message_ids:
+                return self._general_memory.remove(message_ids)
+            self._summaries.pop((memory_type.value, None), None)
+            self._evicted.pop((memory_type.value, None), None)
+            return self._general_memory.clear()
     
     async def get_message_count(self, memory_type: MemoryType, user_id: Optional[str] = None) -> int:
         """获取消息数量"""
-        async with self._lock:
-            if memory_type == MemoryType.PERSONAL:
-                if not user_id:
-                    return sum(len(messages) for messages in self._personal_memories.values())
-                return len(self._personal_memories[user_id])
-            else:
-                return len(self._general_memory)
+        if memory_type == MemoryType.PERSONAL:
+            if not user_id:
+                return self._personal_total
+            log = self._personal_memories.get(user_id)
+            return len(log) if log is not None else 0
+        return len(self._general_memory)
 
 
 @dataclass
@@ -260,6 +418,65 @@ class MemoryStats:
     last_updated: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+class _ActivityWindow:
+    """
+    按时间分桶的滑动窗口：最近 window_seconds 内每个用户发的消息数（同一条消息只记一次）。
+    桶过期时把它的计数从总表里减掉；消息最多的用户用懒删除的最大堆维护，
+    记录和查询都是均摊 O(log n)。用户的消息被删除时 forget() 把他从窗口里去掉。
+    """
+
+    def __init__(self, window_seconds: float = 24 * 3600, bucket_seconds: float = 300):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = max(1, int(window_seconds // bucket_seconds))
+        self._buckets: Deque[Tuple[int, Dict[str, int]]] = deque()
+        self._counts: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+
+    def record(self, user_id: str, now: float) -> None:
+        self._advance(now)
+        bucket_id = int(now // self.bucket_seconds)
+        if not self._buckets or self._buckets[-1][0] != bucket_id:
+            self._buckets.append((bucket_id, {}))
+        bucket = self._buckets[-1][1]
+        bucket[user_id] = bucket.get(user_id, 0) + 1
+        self._set(user_id, self._counts.get(user_id, 0) + 1)
+
+    def forget(self, user_id: str) -> None:
+        for _, bucket in self._buckets:
+            bucket.pop(user_id, None)
+        self._set(user_id, 0)
+
+    def active_users(self, now: float) -> int:
+        self._advance(now)
+        return len(self._counts)
+
+    def most_active(self, now: float) -> Optional[str]:
+        self._advance(now)
+        while self._heap:
+            neg_count, user_id = self._heap[0]
+            if self._counts.get(user_id) == -neg_count:
+                return user_id
+            heapq.heappop(self._heap)
+        return None
+
+    def _set(self, user_id: str, count: int) -> None:
+        if count > 0:
+            self._counts[user_id] = count
+            heapq.heappush(self._heap, (-count, user_id))
+        else:
+            self._counts.pop(user_id, None)
+        if len(self._heap) > 2 * len(self._counts) + 64:
+            self._heap = [(-c, uid) for uid, c in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    def _advance(self, now: float) -> None:
+        oldest = int(now // self.bucket_seconds) - self.bucket_count + 1
+        while self._buckets and self._buckets[0][0] < oldest:
+            _, bucket = self._buckets.popleft()
+            for user_id, count in bucket.items():
+                self._set(user_id, self._counts.get(user_id, 0) - count)
+
+
 class UserMemoryManager:
     """
     企业级多用户记忆管理器
@@ -288,13 +505,15 @@ class UserMemoryManager:
         self.auto_cleanup_enabled = auto_cleanup_enabled
         self.cleanup_interval_seconds = cleanup_interval_seconds
         
-        # 统计信息
+        # 统计信息：消息数直接读存储后端的 get_message_count（各后端都是 O(1)），
+        # 持久化后端重启后的历史消息和同 id 覆盖都以存储为准
         self._stats = MemoryStats()
         self._stats_lock = asyncio.Lock()
         
         # 用户活动跟踪
         self._user_last_activity: Dict[str, datetime] = {}
         self._activity_lock = asyncio.Lock()
+        self._activity_window = _ActivityWindow()
         
         # 清理任务
         self._cleanup_task: Optional[asyncio.Task] = None
@@ -326,7 +545,7 @@ class UserMemoryManager:
         """执行清理任务"""
         try:
             # 清理过期的用户活动记录（超过30天）
-            cutoff_time = datetime.now(timezone.utc).replace(day=datetime.now().day - 30)
+            cutoff_time = datetime.now(timezone.utc) - timedelta(days=30)
             
             async with self._activity_lock:
                 expired_users = [
@@ -337,9 +556,6 @@ class UserMemoryManager:
                 for user_id in expired_users:
                     del self._user_last_activity[user_id]
             
-            # 更新统计信息
-            await self._update_stats()
-            
         except Exception as e:
             print(f"[UserMemoryManager] Cleanup error: {e}")
     
@@ -352,13 +568,7 @@ class UserMemoryManager:
         metadata: Optional[Dict[str, Any]] = None
     ) -> bool:
         """添加个人记忆消息"""
-        if isinstance(message, BaseMessage):
-            memory_message = MemoryMessage.from_langchain_message(
-                message, user_id, username, priority, metadata
-            )
-        else:
-            memory_message = message
-            memory_message.user_id = user_id
+        memory_message = self._to_memory_message(user_id, message, username, priority, metadata)
         
         # 更新用户活动
         await self._update_user_activity(user_id)
@@ -375,13 +585,7 @@ class UserMemoryManager:
         metadata: Optional[Dict[str, Any]] = None
     ) -> bool:
         """添加全局记忆消息"""
-        if isinstance(message, BaseMessage):
-            memory_message = MemoryMessage.from_langchain_message(
-                message, user_id, username, priority, metadata
-            )
-        else:
-            memory_message = message
-            memory_message.user_id = user_id
+        memory_message = self._to_memory_message(user_id, message, username, priority, metadata)
         
         # 更新用户活动
         await self._update_user_activity(user_id)
@@ -397,14 +601,30 @@ class UserMemoryManager:
         priority: MessagePriority = MessagePriority.NORMAL,
         metadata: Optional[Dict[str, Any]] = None
     ) -> tuple[bool, bool]:
-        """同时添加到个人记忆和全局记忆"""
-        personal_success = await self.add_personal_message(
-            user_id, message, username, priority, metadata
+        """同时添加到个人记忆和全局记忆（活动只记一次：这是同一条消息）"""
+        await self._update_user_activity(user_id)
+        personal_success = await self.storage.store_message(
+            MemoryType.PERSONAL, self._to_memory_message(user_id, message, username, priority, metadata)
         )
-        general_success = await self.add_general_message(
-            user_id, message, username, priority, metadata
+        general_success = await self.storage.store_message(
+            MemoryType.GENERAL, self._to_memory_message(user_id, message, username, priority, metadata)
         )
         return personal_success, general_success
+
+    @staticmethod
+    def _to_memory_message(
+        user_id: str,
+        message: Union[BaseMessage, MemoryMessage],
+        username: str,
+        priority: MessagePriority,
+        metadata: Optional[Dict[str, Any]]
+    ) -> MemoryMessage:
+        if isinstance(message, BaseMessage):
+            return MemoryMessage.from_langchain_message(
+                message, user_id, username, priority, metadata
+            )
+        message.user_id = user_id
+        return message
     
     async def get_personal_messages(
         self,
@@ -438,6 +658,9 @@ class UserMemoryManager:
         offset: int = 0
     ) -> List[BaseMessage]:
         """获取用户个人记忆的Langchain消息格式"""
+        retrieve = getattr(self.storage, "retrieve_langchain_messages", None)
+        if retrieve is not None:
+            return await retrieve(MemoryType.PERSONAL, user_id, limit, offset)
         memory_messages = await self.get_personal_messages(user_id, limit, offset)
         return [msg.to_langchain_message() for msg in memory_messages]
     
@@ -447,12 +670,25 @@ class UserMemoryManager:
         offset: int = 0
     ) -> List[BaseMessage]:
         """获取全局记忆的Langchain消息格式"""
+        retrieve = getattr(self.storage, "retrieve_langchain_messages", None)
+        if retrieve is not None:
+            return await retrieve(MemoryType.GENERAL, None, limit, offset)
         memory_messages = await self.get_general_messages(limit, offset)
         return [msg.to_langchain_message() for msg in memory_messages]
     
+    async def get_personal_summary(self, user_id: str) -> str:
+        """用户早期低优先级消息被淘汰后折叠成的摘要（存储后端不支持时为空）"""
+        get_summary = getattr(self.storage, "get_summary", None)
+        if get_summary is None:
+            return ""
+        return await get_summary(MemoryType.PERSONAL, user_id)
+    
     async def delete_user_messages(self, user_id: str, memory_type: MemoryType) -> int:
-        """删除用户的所有消息"""
-        return await self.storage.delete_messages(memory_type, user_id)
+        """删除用户的所有消息，同时把他从 24 小时活跃窗口里去掉"""
+        deleted = await self.storage.delete_messages(memory_type, user_id)
+        async with self._activity_lock:
+            self._activity_window.forget(user_id)
+        return deleted
     
     async def clear_general_memory(self) -> int:
         """清空全局记忆"""
@@ -462,47 +698,25 @@ class UserMemoryManager:
         """更新用户活动时间"""
         async with self._activity_lock:
             self._user_last_activity[user_id] = datetime.now(timezone.utc)
+            self._activity_window.record(user_id, time.time())
     
-    async def _update_stats(self):
-        """更新统计信息"""
+    async def get_stats(self) -> MemoryStats:
+        """获取统计信息，O(1)：消息数由存储后端维护"""
+        now = time.time()
+        personal_total = await self.storage.get_message_count(MemoryType.PERSONAL)
+        general_total = await self.storage.get_message_count(MemoryType.GENERAL)
         async with self._stats_lock:
-            # 获取用户数量
             self._stats.total_users = len(self._user_last_activity)
-            
-            # 获取消息数量
-            self._stats.total_personal_messages = await self.storage.get_message_count(MemoryType.PERSONAL)
-            self._stats.total_general_messages = await self.storage.get_message_count(MemoryType.GENERAL)
-            
-            # 计算24小时内活跃用户
-            cutoff_time = datetime.now(timezone.utc).replace(hour=datetime.now().hour - 24)
-            active_users = [
-                user_id for user_id, last_activity in self._user_last_activity.items()
-                if last_activity >= cutoff_time
-            ]
-            self._stats.active_users_24h = len(active_users)
-            
-            # 找到最活跃用户
-            if active_users:
-                user_message_counts = {}
-                for user_id in active_users:
-                    count = await self.storage.get_message_count(MemoryType.PERSONAL, user_id)
-                    user_message_counts[user_id] = count
-                
-                if user_message_counts:
-                    self._stats.most_active_user = max(user_message_counts, key=user_message_counts.get)
-            
-            # 计算平均每用户消息数
+            self._stats.total_personal_messages = personal_total
+            self._stats.total_general_messages = general_total
+            # 24 小时滑动窗口内的活跃用户数，以及其中发消息最多的用户
+            self._stats.active_users_24h = self._activity_window.active_users(now)
+            self._stats.most_active_user = self._activity_window.most_active(now)
             if self._stats.total_users > 0:
                 self._stats.average_messages_per_user = (
                     self._stats.total_personal_messages / self._stats.total_users
                 )
-            
             self._stats.last_updated = datetime.now(timezone.utc)
-    
-    async def get_stats(self) -> MemoryStats:
-        """获取统计信息"""
-        await self._update_stats()
-        async with self._stats_lock:
             return self._stats
     
     async def get_user_message_count(self, user_id: str) -> Dict[str, int]:
@@ -523,6 +737,11 @@ class UserMemoryManager:
             except asyncio.TimeoutError:
                 self._cleanup_task.cancel()
         
+        # 持久化后端需要把缓冲区写完
+        close_storage = getattr(self.storage, "close", None)
+        if close_storage is not None:
+            await close_storage()
+        
         print("[UserMemoryManager] Closed successfully")
 
 
@@ -531,9 +750,33 @@ def create_user_memory_manager(
     storage_type: str = "memory",
     **kwargs
 ) -> UserMemoryManager:
-    """创建用户记忆管理器的工厂函数"""
+    """创建用户记忆管理器的工厂函数
+
+    storage_type: "memory"（进程内）、"compact"（进程内列式存储，长时间直播更省内存）
+    或 "sqlite"（持久化，可传 db_path）
+    """
     if storage_type == "memory":
         storage = InMemoryStorage(
+            max_messages_per_user=kwargs.get("max_personal_messages_per_user", 1000),
+            max_general_messages=kwargs.get("max_general_messages", 5000),
+            compaction_hook=kwargs.get("compaction_hook")
+        )
+    elif storage_type == "compact":
+        from src.memory.multi_user.compact_storage import CompactStorage
+
+        storage = CompactStorage(
+            max_messages_per_user=kwargs.get("max_personal_messages_per_user", 1000),
+            max_general_messages=kwargs.get("max_general_messages", 5000),
+            compaction_hook=kwargs.get("compaction_hook")
+        )
+    elif storage_type == "sqlite":
+        from src.memory.multi_user.sqlite_storage import SQLiteStorage
+        from src.utils.path import find_project_root
+
+        storage = SQLiteStorage(
+            db_path=kwargs.get("db_path") or (
+                find_project_root() / "src" / "runtime" / "users" / "multi_user_memory.db"
+            ),
             max_messages_per_user=kwargs.get("max_personal_messages_per_user", 1000),
             max_general_messages=kwargs.get("max_general_messages", 5000)
         )
@@ -9,6 +9,7 @@ from langchain_community.document_loaders import TextLoader
 from langgraph.prebuilt import ToolNode
 from langgraph.graph import START, StateGraph
 from dotenv import load_dotenv
+from src.memory.embedding_cache import cached_embeddings
 
 load_dotenv()
 
@@ -23,7 +24,7 @@ llm = ChatSambaNovaCloud(
     top_p=1,
 )
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
+embeddings = cached_embeddings(OpenAIEmbeddings(model="text-embedding-3-large"))
 
 URI = "./milvus_example.db"
 vector_store = Milvus(
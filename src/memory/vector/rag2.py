@@ -12,6 +12,7 @@ from langgraph.prebuilt import ToolNode, tools_condition
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from src.memory.embedding_cache import cached_embeddings
 
 load_dotenv()
 
@@ -28,7 +29,7 @@ llm = ChatSambaNovaCloud(
 #
 # llm = init_chat_model("gpt-4o-mini", model_provider="openai")
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
+embeddings = cached_embeddings(OpenAIEmbeddings(model="text-embedding-3-large"))
 
 URI = "./milvus_example.db"
 vector_store = Milvus(
@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+from typing import List
+
+from src.danmaku.message_queue.queue_types.danmu_queue import DANMU_PRIORITY
+from src.danmaku.models import Message, MessageType
+
+# 空闲时注入提示用的系统用户名，不参与合并
+SYSTEM_USER_NAME = "System"
+
+
+@dataclass
+class BatchConfig:
+    """弹幕合并回复配置"""
+    enabled: bool = False
+    max_batch_size: int = 5
+    # 每积压多少条弹幕，本轮多合并一条
+    backlog_per_slot: int = 2
+
+
+def is_batchable(message: Message) -> bool:
+    """只有普通弹幕能合并；礼物、关注、SuperChat 和系统提示都单独回复。"""
+    return (
+        message.type is MessageType.DANMU
+        and message.priority == DANMU_PRIORITY
+        and message.user.name != SYSTEM_USER_NAME
+    )
+
+
+def adaptive_batch_size(backlog: int, config: BatchConfig) -> int:
+    """根据队列积压决定本轮最多回复几条弹幕（含已取出的第一条）。"""
+    size = 1 + max(backlog, 0) // max(config.backlog_per_slot, 1)
+    return max(1, min(config.max_batch_size, size))
+
+
+def build_batch_prompt(messages: List[Message]) -> str:
+    """把多条弹幕渲染成一个结构化的 prompt，让主播一轮内逐个点名回复。"""
+    if len(messages) == 1:
+        return messages[0].prompt
+
+    lines = [
+        f"{len(messages)} viewers are chatting at the same time. "
+        "Answer all of them in this one reply, in the order listed. "
+        "Address each viewer by name and keep every answer short.",
+    ]
+    for i, msg in enumerate(messages, 1):
+        lines.append(f"{i}. {msg.user.name}: {msg.content}")
+    return "\n".join(lines)
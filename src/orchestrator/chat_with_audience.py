@@ -1,12 +1,23 @@
 import asyncio
 import threading
 import time
-from typing import Optional
+from typing import List, Optional
 
 from src.chatbot.llama.chat_engine import ChatEngine
+from src.chatbot.llama.utterance import Utterance
 from src.danmaku.message_queue.queue_manager import TotalMessageQueue
 from src.danmaku.models import Message, User
+from src.orchestrator.batching import (
+    SYSTEM_USER_NAME,
+    BatchConfig,
+    adaptive_batch_size,
+    build_batch_prompt,
+    is_batchable,
+)
+from src.orchestrator.response_length import LengthPolicy, ResponseLengthController
+from src.orchestrator.speculation import SpeculationConfig, should_preempt
 from src.prompt.builders.base import DialogueActor
+from src.utils.metrics import DurationStats, ThroughputMeter
 
 
 class ChatWithAudience:
@@ -15,8 +26,27 @@ class ChatWithAudience:
     当 talk_to = DialogueActor.AUDIENCE 时，处理观众弹幕消息
     """
     
-    def __init__(self, stream_id: str, connect_to_unity: bool = True):
+    def __init__(
+            self,
+            stream_id: str,
+            connect_to_unity: bool = True,
+            batch_config: Optional[BatchConfig] = None,
+            length_policy: Optional[LengthPolicy] = None,
+            speculation: Optional[SpeculationConfig] = None,
+    ):
         self.connect_to_unity = connect_to_unity
+        self.batch_config = batch_config or BatchConfig()
+        self.throughput = ThroughputMeter()
+        self.length_controller = ResponseLengthController(length_policy)
+        self._last_answered = 0
+        self._spoken_mark = 0.0
+        # 轮次之间的冷场（扬声器空闲 → 下一轮开口），按是否预生成分开统计
+        self.speculation = speculation or SpeculationConfig()
+        self.dead_air = DurationStats()
+        self.dead_air_speculative = DurationStats()
+        self._speaker_free_at: Optional[float] = None
+        self._last_turn_speculative = False
+        self._last_utterance: Optional[Utterance] = None
         self.chat_engine: Optional[ChatEngine] = None
         self.total_queue: Optional[TotalMessageQueue] = None
         self.running = False
@@ -111,7 +141,8 @@ class ChatWithAudience:
 
                 if message:
                     idle_since_speech = None
-                    await self._process_message(message)
+                    batch = await self._collect_batch(message)
+                    await self._process_messages(batch)
                     idle_since_speech = time.time()
                 else:
                     if idle_since_speech is not None:
@@ -139,32 +170,134 @@ class ChatWithAudience:
             print(f"[ChatWithAudience] Error getting message: {e}")
             return None
             
-    async def _process_message(self, message: Message):
-        """处理单条消息"""
-        print(f"[ChatWithAudience] Processing message: {message.user.name}: {message.content}")
+    async def _collect_batch(self, first: Message) -> List[Message]:
+        """批量模式下，把队首可合并的弹幕和 first 一起作为一轮回复"""
+        if not self.batch_config.enabled or not is_batchable(first):
+            return [first]
+
+        try:
+            backlog = await self.total_queue.danmu_backlog()
+            size = adaptive_batch_size(backlog, self.batch_config)
+            rest = await self.total_queue.get_danmu_batch_async(size - 1, is_batchable)
+        except Exception as e:
+            print(f"[ChatWithAudience] Error collecting batch: {e}")
+            return [first]
+
+        if rest:
+            print(f"[ChatWithAudience] Batched {len(rest) + 1} danmaku (backlog={backlog})")
+        return [first, *rest]
+
+    async def _process_messages(self, messages: List[Message]):
+        """处理一轮消息（单条或合并后的多条弹幕）"""
+        for message in messages:
+            print(f"[ChatWithAudience] Processing message: {message.user.name}: {message.content}")
+
+        if self.speculation.enabled and self.chat_engine.is_speaking():
+            await self._process_speculatively(messages)
+            return
         
         # 等待上一次 TTS 完成
         await self._wait_for_tts_completion()
+        self._on_speaker_free(speculative=False)
+        tier = await self._decide_length()
+        utterance = self.chat_engine.new_utterance()
+        self._last_utterance = utterance
         
         try:
-            response = await self.chat_engine.stream_chat(
-                user_id=self.stream_id,
-                msg=message.prompt,
-                language="English"
-            )
+            response = await self.chat_engine.stream_chat(utterance=utterance, **self._turn_kwargs(messages, tier))
             
         except Exception as e:
             print(f"[ChatWithAudience] Error processing message: {e}")
-            
-    async def _wait_for_tts_completion(self):
-        """等待 TTS 完成播放"""
-        if not self.chat_engine:
             return
-            
-        while self.chat_engine.is_speaking():
-            await asyncio.sleep(0.05)
 
-        await asyncio.sleep(0.2)
+        self._after_turn(messages)
+
+    async def _process_speculatively(self, messages: List[Message]):
+        """上一条回复还在播放：先生成这一轮并缓存句子，扬声器空闲后立刻放出"""
+        tier = await self._decide_length()
+        utterance = self.chat_engine.new_utterance(hold=True)
+        task = asyncio.create_task(
+            self.chat_engine.stream_chat(utterance=utterance, **self._turn_kwargs(messages, tier))
+        )
+
+        # 上一轮播完立即放出；等待期间定时看一眼有没有需要抢占的大额消息
+        speaker_free = asyncio.ensure_future(self._wait_for_tts_completion())
+        while not speaker_free.done():
+            pending = await self.total_queue.peek_next_message_async()
+            if should_preempt(pending, messages, self.speculation):
+                print(f"[ChatWithAudience] Speculation preempted by {pending.user.name}: {pending.content}")
+                speaker_free.cancel()
+                utterance.cancel()
+                task.cancel()
+                # stream_chat 在取消时撤回已写进 checkpoint 的输入，等它结束再放回队列
+                await asyncio.gather(task, return_exceptions=True)
+                await self.total_queue.requeue_async(messages)
+                return
+            await asyncio.wait({speaker_free}, timeout=self.speculation.poll_interval)
+
+        self._on_speaker_free(speculative=True)
+        self._last_utterance = utterance
+        released = utterance.release()
+        print(f"[ChatWithAudience] Speaker free, released {released} pre-generated sentence(s)")
+
+        try:
+            await task
+        except Exception as e:
+            print(f"[ChatWithAudience] Error processing message: {e}")
+            return
+
+        self._after_turn(messages)
+
+    def _turn_kwargs(self, messages: List[Message], tier) -> dict:
+        return dict(
+            user_id=self.stream_id,
+            msg=build_batch_prompt(messages),
+            language="English",
+            max_tokens=tier.max_tokens if tier else None,
+            prompt_additions=[tier.directive] if tier else None,
+        )
+
+    def _on_speaker_free(self, speculative: bool):
+        """扬声器空闲、这一轮即将开口：结算上一轮的冷场时间和说话时长"""
+        started = self.chat_engine.last_speech_started_at()
+        if self._speaker_free_at is not None and started > self._speaker_free_at:
+            stats = self.dead_air_speculative if self._last_turn_speculative else self.dead_air
+            stats.record(started - self._speaker_free_at)
+        self._speaker_free_at = time.monotonic()
+        self._last_turn_speculative = speculative
+        self._observe_last_turn()
+
+    def _after_turn(self, messages: List[Message]):
+        self._last_answered = len(messages)
+        self.throughput.record(len(messages))
+        print(f"[ChatWithAudience] Answered {len(messages)} message(s) "
+              f"— {self.throughput.per_minute():.1f} msg/min, "
+              f"{self.length_controller.messages_per_speech_minute():.1f} msg per speech-minute, "
+              f"dead air {self.dead_air.mean():.2f}s sequential / "
+              f"{self.dead_air_speculative.mean():.2f}s speculative")
+
+    def _observe_last_turn(self):
+        """上一轮的语音已播完，把它的说话时长反馈给长度控制器"""
+        spoken = self.chat_engine.spoken_seconds()
+        self.length_controller.observe_turn(self._last_answered, spoken - self._spoken_mark)
+        self._spoken_mark = spoken
+        self._last_answered = 0
+
+    async def _decide_length(self):
+        """根据当前积压选择本轮的回复长度档位"""
+        try:
+            backlog = await self.total_queue.danmu_backlog()
+        except Exception:
+            backlog = 0
+        tier = self.length_controller.decide(backlog)
+        if tier:
+            print(f"[ChatWithAudience] Backlog={backlog} → max_tokens={tier.max_tokens}")
+        return tier
+            
+    async def _wait_for_tts_completion(self):
+        """等待上一轮回复播放完毕（由 TTS 线程置位，不轮询）"""
+        if self._last_utterance is not None:
+            await self._last_utterance.played()
         
     def stop(self):
         """停止弹幕监听和消息处理"""
@@ -200,7 +333,7 @@ class ChatWithAudience:
             return
 
         try:
-            system_user = User(user_id=0, name="System")
+            system_user = User(user_id=0, name=SYSTEM_USER_NAME)
             await self.total_queue.put_danmu(system_user, "(System prompt: Please say more)")
             print("[ChatWithAudience] Injected idle prompt → Please say more")
         except Exception as exc:
@@ -0,0 +1,87 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional
+
+
+@dataclass
+class LengthTier:
+    """一档回复长度：积压达到 min_backlog 时启用"""
+    min_backlog: int
+    max_tokens: int
+    directive: str
+
+
+def _default_tiers() -> List[LengthTier]:
+    return [
+        LengthTier(
+            min_backlog=0,
+            max_tokens=300,
+            directive="Chat is quiet right now, so you can take your time and give a fuller, more playful answer.",
+        ),
+        LengthTier(
+            min_backlog=3,
+            max_tokens=150,
+            directive="Several viewers are waiting. Keep your reply to two or three sentences.",
+        ),
+        LengthTier(
+            min_backlog=8,
+            max_tokens=60,
+            directive="Chat is very busy. Reply with one short, punchy sentence.",
+        ),
+    ]
+
+
+@dataclass
+class LengthPolicy:
+    """根据弹幕积压和最近说话时长调整回复长度的策略"""
+    enabled: bool = False
+    tiers: List[LengthTier] = field(default_factory=_default_tiers)
+    # 最近几轮平均说话时间超过这个值且有积压时，再降一档
+    max_speech_seconds: float = 15.0
+    speech_window: int = 5
+
+
+class ResponseLengthController:
+    """观察队列积压与说话时长，逐轮给出 max_tokens 和长度指令"""
+
+    def __init__(self, policy: Optional[LengthPolicy] = None):
+        self.policy = policy or LengthPolicy()
+        self._tiers = sorted(self.policy.tiers, key=lambda t: t.min_backlog)
+        self._recent_speech: Deque[float] = deque(maxlen=self.policy.speech_window)
+        self._answered = 0
+        self._spoken_seconds = 0.0
+        self.current: Optional[LengthTier] = None
+
+    def observe_turn(self, answered: int, speech_seconds: float) -> None:
+        """上一轮回复了 answered 条消息，实际说了 speech_seconds 秒"""
+        if answered <= 0:
+            return
+        self._recent_speech.append(speech_seconds)
+        self._answered += answered
+        self._spoken_seconds += speech_seconds
+
+    def decide(self, backlog: int) -> Optional[LengthTier]:
+        if not self.policy.enabled or not self._tiers:
+            return None
+
+        idx = 0
+        for i, tier in enumerate(self._tiers):
+            if backlog >= tier.min_backlog:
+                idx = i
+
+        if backlog > 0 and self.average_speech_seconds() > self.policy.max_speech_seconds:
+            idx = min(idx + 1, len(self._tiers) - 1)
+
+        self.current = self._tiers[idx]
+        return self.current
+
+    def average_speech_seconds(self) -> float:
+        if not self._recent_speech:
+            return 0.0
+        return sum(self._recent_speech) / len(self._recent_speech)
+
+    def messages_per_speech_minute(self) -> float:
+        """有效吞吐：每说一分钟话能回复多少条消息"""
+        if self._spoken_seconds <= 0:
+            return 0.0
+        return self._answered * 60.0 / self._spoken_seconds
@@ -9,8 +9,10 @@ from src.prompt.builders.base import DialogueActor
 
 
 class SceneOrchestrator:
-    def __init__(self, connect_to_unity: bool = True):
+    def __init__(self, connect_to_unity: bool = True, barge_in: bool = False):
         self.asr = ASREngine(ASRConfig(debug=True))  # 可选 debug=True
+        # barge_in=True 时 AI 说话期间麦克风保持开启，主播一开口就打断 AI（建议戴耳机，避免 AI 自己的声音触发）
+        self.barge_in = barge_in
         self.asr_running = False
         self._asr_thread = None
         self.loop = asyncio.get_event_loop()
@@ -26,18 +28,26 @@ class SceneOrchestrator:
         if self.asr_running:
             print("[SceneOrchestrator] ASR already running.")
             return
-        self.asr.start()
+        self.asr.start(on_partial=self._on_speech_start if self.barge_in else None)
         self.asr_running = True
         self._asr_thread = threading.Thread(target=self._asr_loop, daemon=True)
         self._asr_thread.start()
 
+    def _on_speech_start(self):
+        """ASR 线程回调：第一次检测到人声时打断正在生成/播放的回复"""
+        t0 = time.perf_counter()
+        if self.chat_engine.interrupt():
+            print(f"\n[SceneOrchestrator] Barge-in: stopped AI in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
     def _asr_safe_say(self, text: str):
-        print("[SceneOrchestrator] PAUSE ASR")
-        self.asr.pause()
+        if not self.barge_in:
+            print("[SceneOrchestrator] PAUSE ASR")
+            self.asr.pause()
 
         # 1) 生成 & 把文本送进 TTS 队列
+        utterance = self.chat_engine.new_utterance()
         future = asyncio.run_coroutine_threadsafe(
-            self.chat_engine.stream_chat("asr_user2", text),
+            self.chat_engine.stream_chat("asr_user2", text, utterance=utterance),
             self.loop
         )
         try:
@@ -45,11 +55,11 @@ class SceneOrchestrator:
         except Exception as e:
             print(f"[AI ERROR] {e}")
 
-        # 2) **阻塞，直到 TTS 完全播放结束**
-        while self.chat_engine.is_speaking():
-            time.sleep(0.05)  # 50 ms 轮询一次，负担极小
+        # 2) **阻塞，直到这一轮 TTS 完全播放结束**（TTS 线程播到结束标记时置位，无需轮询）
+        utterance.wait_played()
 
-        time.sleep(0.5)
+        if self.barge_in:
+            return  # ASR 一直在听，无需恢复
 
         print("[SceneOrchestrator] RESUME ASR")
         self.asr.resume()
@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from src.danmaku.models import Message
+
+
+@dataclass
+class SpeculationConfig:
+    """在上一条回复还在播放时预先生成下一条回复"""
+    enabled: bool = False
+    # 优先级数值小于等于这个值的新消息（默认：价值 >= 100 的礼物）会打断预生成
+    preempt_priority: int = -20
+    poll_interval: float = 0.05
+
+
+def should_preempt(pending: Optional[Message], turn: List[Message], config: SpeculationConfig) -> bool:
+    """队列里出现了比预生成这一轮更重要的大额消息时，放弃预生成。"""
+    if pending is None or not turn:
+        return False
+    return (
+        pending.priority <= config.preempt_priority
+        and pending.priority < min(m.priority for m in turn)
+    )
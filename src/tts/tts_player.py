@@ -4,7 +4,7 @@ import logging
 import socket
 import threading
 import wave
-from typing import Optional
+from typing import Callable, Optional
 
 import pyaudio
 import requests
@@ -56,11 +56,16 @@ class TTSPlayer:
 
     # ───── Public API ─────
 
-    def stream(self, text: str) -> None:
-        """Blocking call — synthesize *text* and play through the speakers."""
+    def stream(self, text: str, should_stop: Optional[Callable[[], bool]] = None) -> None:
+        """Blocking call — synthesize *text* and play through the speakers.
+
+        *should_stop* is polled between audio chunks; playback aborts once it returns True.
+        """
         cleaned = self._clean_text(text)
         if not cleaned:
             return
+        # A stop() issued while idle must not abort this new utterance.
+        self._stop_flag.clear()
 
         payload = {
             "text": cleaned,
@@ -83,7 +88,7 @@ class TTSPlayer:
         #     self._play_chunks(resp)
         self._busy.set()
         try:
-            self._play_chunks(resp)
+            self._play_chunks(resp, should_stop=should_stop)
         finally:
             self._busy.clear()
 
@@ -155,7 +160,12 @@ class TTSPlayer:
                 out.append(ch)
         return "".join(out).strip()
 
-    def _play_chunks(self, resp: requests.Response, chunk_size: int = 1024) -> None:  # noqa: C901
+    def _play_chunks(
+            self,
+            resp: requests.Response,
+            chunk_size: int = 1024,
+            should_stop: Optional[Callable[[], bool]] = None,
+    ) -> None:  # noqa: C901
         pa = wave_file = None
         try:
             pa = pyaudio.PyAudio()
@@ -164,7 +174,7 @@ class TTSPlayer:
             stream_started = False
 
             for chunk in resp.raw.stream(chunk_size, decode_content=False):
-                if self._stop_flag.is_set():
+                if self._stop_flag.is_set() or (should_stop and should_stop()):
                     self._logger.debug("Stop flag set — abort playback")
                     break
                 if not chunk:
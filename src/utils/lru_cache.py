@@ -0,0 +1,127 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class BoundedLRU(Generic[K, V]):
+    """
+    同时按条数和估算字节数限制的 LRU 缓存。
+    超限时从最久未访问的一端淘汰，淘汰前调用 on_evict(key, value)，调用方借此把数据写回存储。
+    sizeof 返回单个值的估算字节数；值在缓存里变大时调用 refresh() 重新计量。
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[V], int]] = None,
+        on_evict: Optional[Callable[[K, V], None]] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._on_evict = on_evict
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+        self._sizes: Dict[K, int] = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """读取但不计入命中率、不调整顺序"""
+        with self._lock:
+            return self._data.get(key, default)
+
+    def put(self, key: K, value: V) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._measure(key)
+            self._evict()
+
+    __setitem__ = put
+
+    def refresh(self, key: K) -> None:
+        """值被原地修改后重新估算大小，并视为一次访问"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self._measure(key)
+                self._evict()
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self.resident_bytes -= self._sizes.pop(key, 0)
+            return self._data.pop(key)
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self.keys())
+
+    def keys(self) -> List[K]:
+        with self._lock:
+            return list(self._data.keys())
+
+    def values(self) -> List[V]:
+        with self._lock:
+            return list(self._data.values())
+
+    def items(self) -> List[Tuple[K, V]]:
+        with self._lock:
+            return list(self._data.items())
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "resident_bytes": self.resident_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+            "evictions": self.evictions,
+        }
+
+    def _measure(self, key: K) -> None:
+        size = self._sizeof(self._data[key]) if self._sizeof else 0
+        self.resident_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def _evict(self) -> None:
+        # 至少保留刚访问的那一条，哪怕它自己就超过了字节上限
+        while len(self._data) > 1 and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self.resident_bytes > self.max_bytes)
+        ):
+            key, value = self._data.popitem(last=False)
+            self.resident_bytes -= self._sizes.pop(key, 0)
+            self.evictions += 1
+            if self._on_evict is not None:
+                try:
+                    self._on_evict(key, value)
+                except Exception as e:
+                    print(f"[BoundedLRU] Evict callback error for {key}: {e}")
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+
+class ThroughputMeter:
+    """滑动窗口吞吐统计：最近 window_seconds 内每分钟处理的条数。"""
+
+    def __init__(self, window_seconds: float = 300.0):
+        self.window_seconds = window_seconds
+        self.total = 0
+        self._events: Deque[Tuple[float, int]] = deque()
+        self._window_count = 0
+        self._started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, count: int = 1, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._started_at is None:
+                self._started_at = now
+            self._events.append((now, count))
+            self._window_count += count
+            self.total += count
+            self._expire(now)
+
+    def per_minute(self, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._started_at is None:
+                return 0.0
+            self._expire(now)
+            span = min(self.window_seconds, now - self._started_at)
+            if span <= 0:
+                return 0.0
+            return self._window_count * 60.0 / span
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._events and self._events[0][0] < cutoff:
+            _, count = self._events.popleft()
+            self._window_count -= count
+
+
+class DurationStats:
+    """记录最近 max_samples 个耗时样本（秒），给出均值和分位数。"""
+
+    def __init__(self, max_samples: int = 200):
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def mean(self) -> float:
+        with self._lock:
+            return sum(self._samples) / len(self._samples) if self._samples else 0.0
+
+    def percentile(self, pct: float) -> float:
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+        return ordered[idx]